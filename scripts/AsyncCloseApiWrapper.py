@@ -0,0 +1,479 @@
+import asyncio
+import copy
+import json
+import logging
+import os
+import time
+
+import aiohttp
+import requests
+from closeio_api import API, APIError, ValidationError, __version__
+from closeio_api.utils import local_tz_offset
+from requests.structures import CaseInsensitiveDict
+
+from scripts.CloseApiWrapper import (
+    DEFAULT_REQUEST_STATS,
+    LEAD_PAGE_SIZE,
+    METADATA_CACHE_TTL,
+    MetadataCache,
+    get_lead_probe_params,
+    get_lead_slice_query,
+    is_reusable_get,
+    pick_lead_slice_count,
+)
+from scripts.json_codec import get_json_decoder
+from scripts.rate_limiter import AsyncRateLimitController
+from scripts.single_flight import DEFAULT_RESULT_TTL, AsyncSingleFlight
+
+_SLICE_DONE = object()
+
+
+def _encode_params(params):
+    """
+    Drop `None` params and stringify anything that isn't a string or a number,
+    the way `requests` does, since aiohttp only accepts those.
+    """
+    encoded = {}
+    for key, value in (params or {}).items():
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            value = str(value)
+        encoded[key] = value
+    return encoded
+
+
+def _make_response(status, headers, url, content):
+    """
+    Build a `requests.Response` out of an aiohttp response, so that errors are
+    raised as the same `APIError` / `ValidationError` the sync wrapper raises.
+    """
+    response = requests.Response()
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(headers)
+    response.url = url
+    response.encoding = 'utf-8'
+    response._content = content
+    return response
+
+
+class AsyncCloseApiWrapper:
+    """
+    asyncio variant of `CloseApiWrapper`, with the same convenience functions
+    (as coroutines) and async generators for paginating through resources.
+
+    Requests are sent through a single pooled aiohttp session and paced by an
+    `AsyncRateLimitController`, so any number of coroutines in the same event
+    loop can share one wrapper. Use it as an async context manager (or call
+    `close()`) to release the connections when done:
+
+        async with AsyncCloseApiWrapper(api_key) as api:
+            async for lead in api.iter_lead_slices('has:phone_numbers'):
+                ...
+    """
+
+    def __init__(
+        self,
+        api_key=None,
+        tz_offset=None,
+        max_retries=5,
+        development=False,
+        metadata_cache_ttl=METADATA_CACHE_TTL,
+        rate_limiter=None,
+        request_stats=None,
+        base_url=None,
+        get_result_ttl=DEFAULT_RESULT_TTL,
+        json_decoder=None,
+    ):
+        assert api_key, 'Must specify api_key.'
+        base_url = base_url or os.environ.get('CLOSE_API_BASE_URL')
+        if base_url:
+            self.base_url = base_url
+            self.verify = True
+        elif development:
+            self.base_url = 'https://local-api.close.com:5001/api/v1/'
+            self.verify = False
+        else:
+            self.base_url = 'https://api.close.com/api/v1/'
+            self.verify = True
+        self.api_key = api_key
+        self.tz_offset = str(tz_offset or local_tz_offset())
+        self.max_retries = max_retries
+        self.metadata_cache = MetadataCache(ttl=metadata_cache_ttl)
+        self.rate_limiter = rate_limiter or AsyncRateLimitController()
+        self.request_stats = request_stats or DEFAULT_REQUEST_STATS
+        self.single_flight = AsyncSingleFlight(
+            ttl=get_result_ttl, sizeof=lambda resp: len(resp[2])
+        )
+        self.json_decoder = get_json_decoder(json_decoder)
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @property
+    def session(self):
+        # Created lazily, so that it belongs to the running event loop.
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.rate_limiter.max_concurrency,
+                ssl=None if self.verify else False,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                auth=aiohttp.BasicAuth(self.api_key, ''),
+                headers={
+                    'User-Agent': 'Close/{} python ({})'.format(
+                        __version__, f'aiohttp/{aiohttp.__version__}'
+                    ),
+                    'X-TZ-Offset': self.tz_offset,
+                },
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _dispatch(
+        self, method_name, endpoint, params=None, data=None, timeout=None
+    ):
+        """
+        Same retry policy as `CloseApiWrapper._dispatch`: 429s are waited out
+        by the rate limiter, 503s (and 502s and 504s on GET requests) and
+        connection errors are retried after a randomized delay. Identical
+        GETs are coalesced the same way, too.
+        """
+        # With a trailing slash, like `closeio_api.API` (the API redirects
+        # or 404s without it).
+        url = self.base_url + endpoint + '/'
+        kwargs = {'params': _encode_params(params)}
+        if data is not None:
+            kwargs['json'] = data
+        if timeout is not None:
+            kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+
+        if method_name == 'get':
+            reusable = is_reusable_get(endpoint, params)
+            status, headers, content = await self.single_flight.do(
+                (url, tuple(sorted(kwargs['params'].items()))),
+                lambda: self._send(method_name, endpoint, url, kwargs),
+                cacheable=lambda resp: reusable and 200 <= resp[0] < 400,
+            )
+        else:
+            status, headers, content = await self._send(
+                method_name, endpoint, url, kwargs
+            )
+
+        if 200 <= status < 400:
+            # 204 responses have no content.
+            if status == 204:
+                return ''
+            return self.json_decoder(content)
+
+        response = _make_response(status, headers, url, content)
+        if status == 400:
+            raise ValidationError(response)
+        raise APIError(response)
+
+    async def _send(self, method_name, endpoint, url, kwargs):
+        """
+        Send a request, with retries, and return the status, headers and
+        content of its response.
+        """
+        for retry_count in range(self.max_retries):
+            wait_start = time.monotonic()
+            try:
+                async with self.rate_limiter.permit():
+                    start = time.monotonic()
+                    async with self.session.request(
+                        method_name, url, **kwargs
+                    ) as resp:
+                        content = await resp.read()
+                        status, headers = resp.status, resp.headers
+            except aiohttp.ClientConnectionError:
+                self.request_stats.record(
+                    method_name,
+                    endpoint,
+                    None,
+                    time.monotonic() - start,
+                    pool_wait=start - wait_start,
+                    retry=retry_count > 0,
+                )
+                if retry_count + 1 == self.max_retries:
+                    raise
+                await asyncio.sleep(2)
+                continue
+
+            self.request_stats.record(
+                method_name,
+                endpoint,
+                status,
+                time.monotonic() - start,
+                response_bytes=len(content),
+                pool_wait=start - wait_start,
+                retry=retry_count > 0,
+            )
+
+            body = None
+            if status == 429:
+                try:
+                    body = json.loads(content)
+                except ValueError:
+                    pass
+            self.rate_limiter.update(status, headers, body)
+
+            if status == 429:
+                logging.debug('Request was rate limited, retrying')
+                continue
+
+            # Retry 503 errors or 502 or 504 erors on GET requests.
+            elif status == 503 or (
+                method_name == 'get' and status in (502, 504)
+            ):
+                sleep_time = self._get_randomized_sleep_time_for_error(
+                    status, retry_count
+                )
+                logging.debug(
+                    'Request hit a %s, sleeping for %s seconds',
+                    status,
+                    sleep_time,
+                )
+                await asyncio.sleep(sleep_time)
+                continue
+
+            break
+
+        return status, headers, content
+
+    def _get_randomized_sleep_time_for_error(self, status_code, retries):
+        # Borrowed from the sync client, which doesn't use any of its state.
+        return API._get_randomized_sleep_time_for_error(
+            self, status_code, retries
+        )
+
+    async def get(self, endpoint, params=None, timeout=None):
+        return await self._dispatch(
+            'get', endpoint, params=params, timeout=timeout
+        )
+
+    async def post(self, endpoint, data, timeout=None):
+        try:
+            return await self._dispatch(
+                'post', endpoint, data=data, timeout=timeout
+            )
+        finally:
+            self.metadata_cache.invalidate_for_endpoint(endpoint)
+            self.single_flight.invalidate()
+
+    async def put(self, endpoint, data, timeout=None):
+        try:
+            return await self._dispatch(
+                'put', endpoint, data=data, timeout=timeout
+            )
+        finally:
+            self.metadata_cache.invalidate_for_endpoint(endpoint)
+            self.single_flight.invalidate()
+
+    async def delete(self, endpoint, params=None, timeout=None):
+        try:
+            return await self._dispatch(
+                'delete', endpoint, params=params, timeout=timeout
+            )
+        finally:
+            self.metadata_cache.invalidate_for_endpoint(endpoint)
+            self.single_flight.invalidate()
+
+    async def _get_cached(self, key, fetch):
+        try:
+            return self.metadata_cache.get(key)
+        except KeyError:
+            value = await fetch()
+            self.metadata_cache.set(key, value)
+            return copy.deepcopy(value) if self.metadata_cache.ttl else value
+
+    async def get_organization_id(self):
+        async def _fetch():
+            return (await self.get('me'))['organizations'][0]['id']
+
+        return await self._get_cached(('organization_id',), _fetch)
+
+    async def _get_organization_field(self, field):
+        org_id = await self.get_organization_id()
+        resp = await self.get(
+            f"organization/{org_id}", params={"_fields": field}
+        )
+        return resp[field]
+
+    async def get_memberships(self, include_inactive=False):
+        async def _fetch():
+            org_id = await self.get_organization_id()
+            return await self.get(
+                f"organization/{org_id}",
+                params={"_fields": "memberships,inactive_memberships"},
+            )
+
+        memberships = await self._get_cached(('memberships',), _fetch)
+        if include_inactive:
+            return (
+                memberships["memberships"]
+                + memberships["inactive_memberships"]
+            )
+        return memberships["memberships"]
+
+    async def get_lead_statuses(self):
+        return await self._get_cached(
+            ('lead_statuses',),
+            lambda: self._get_organization_field("lead_statuses"),
+        )
+
+    async def get_opportunity_pipelines(self):
+        return await self._get_cached(
+            ('pipelines',),
+            lambda: self._get_organization_field("pipelines"),
+        )
+
+    async def get_custom_fields(self, type):
+        async def _fetch():
+            return (await self.get(f"custom_field_schema/{type}"))["fields"]
+
+        return await self._get_cached(('custom_fields', type), _fetch)
+
+    async def get_opportunity_statuses(self):
+        opportunity_statuses = []
+        for pipeline in await self.get_opportunity_pipelines():
+            opportunity_statuses.extend(pipeline['statuses'])
+
+        return opportunity_statuses
+
+    async def get_custom_activity_types(self):
+        async def _fetch():
+            return (await self.get("custom_activity"))["data"]
+
+        return await self._get_cached(('custom_activity_types',), _fetch)
+
+    async def get_roles(self):
+        return await self._get_cached(
+            ('roles',), lambda: self.get_all_items('role')
+        )
+
+    async def get_groups(self):
+        async def _fetch():
+            return (await self.get('group'))['data']
+
+        return await self._get_cached(('groups',), _fetch)
+
+    async def get_email_templates(self):
+        return await self._get_cached(
+            ('email_templates',), lambda: self.get_all_items('email_template')
+        )
+
+    async def get_sms_templates(self):
+        return await self._get_cached(
+            ('sms_templates',), lambda: self.get_all_items('sms_template')
+        )
+
+    async def iter_pages(self, url, params=None):
+        """
+        Yield the `data` list of every page of a paginated resource. See
+        `CloseApiWrapper.iter_pages`.
+        """
+        params = dict(params or {})
+        offset = params.get('_skip', 0)
+        while True:
+            resp = await self.get(url, params=params)
+            yield resp['data']
+
+            if 'cursor_next' in resp:
+                if not resp['cursor_next']:
+                    break
+                params['_cursor'] = resp['cursor_next']
+            else:
+                if not resp.get('has_more') or not resp['data']:
+                    break
+                offset += len(resp['data'])
+                params['_skip'] = offset
+
+    async def iter_items(self, url, params=None):
+        """Yield every item of a paginated resource, one page at a time."""
+        async for page in self.iter_pages(url, params=params):
+            for item in page:
+                yield item
+
+    async def get_all_items(self, url, params=None):
+        return [item async for item in self.iter_items(url, params=params)]
+
+    async def _get_lead_slice_count(self, query, fields):
+        start = time.monotonic()
+        resp = await self.get(
+            'lead', params=get_lead_probe_params(query, fields)
+        )
+        return pick_lead_slice_count(resp, time.monotonic() - start)
+
+    async def iter_lead_slices(
+        self, query=None, fields=None, concurrency=None
+    ):
+        """
+        Yield every lead matching a search query, fetching `slice:i/N` parts
+        of the query concurrently. See `CloseApiWrapper.iter_lead_slices`.
+        """
+        fields = list(fields or [])
+        if fields and 'id' not in fields:
+            fields.append('id')
+        fields = ','.join(fields) or None
+
+        total_slices = await self._get_lead_slice_count(query, fields)
+        if not total_slices:
+            return
+
+        if concurrency is None:
+            concurrency = self.rate_limiter.max_concurrency
+
+        # Bounded, so that slices wait for the consumer instead of buffering
+        # the whole result set in memory.
+        pages = asyncio.Queue(maxsize=concurrency * 2)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _fetch_slice(slice_num):
+            params = {
+                'query': get_lead_slice_query(query, slice_num, total_slices),
+                '_limit': LEAD_PAGE_SIZE,
+            }
+            if fields:
+                params['_fields'] = fields
+            async with semaphore:
+                try:
+                    async for page in self.iter_pages('lead', params=params):
+                        await pages.put(page)
+                except Exception as e:
+                    await pages.put(e)
+            await pages.put(_SLICE_DONE)
+
+        tasks = [
+            asyncio.ensure_future(_fetch_slice(slice_num))
+            for slice_num in range(1, total_slices + 1)
+        ]
+
+        seen_ids = set()
+        remaining_slices = total_slices
+        try:
+            while remaining_slices:
+                page = await pages.get()
+                if page is _SLICE_DONE:
+                    remaining_slices -= 1
+                    continue
+                if isinstance(page, Exception):
+                    raise page
+
+                for lead in page:
+                    if lead['id'] in seen_ids:
+                        continue
+                    seen_ids.add(lead['id'])
+                    yield lead
+        finally:
+            for task in tasks:
+                task.cancel()
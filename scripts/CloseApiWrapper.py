@@ -1,14 +1,315 @@
-from closeio_api import Client
+import atexit
+import copy
+import hashlib
+import logging
+import math
+import os
+import re
+import socket
+import time
+
+import requests
+from closeio_api import APIError, Client, ValidationError
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+from scripts import runtime
+from scripts.bulk_executor import DEFAULT_MAX_ATTEMPTS, BulkExecutor
+from scripts.hedging import HEDGE_PERCENTILE, RequestHedger
+from scripts.json_codec import get_json_decoder
+from scripts.rate_limiter import RateLimitController
+from scripts.records import intern_id
+from scripts.request_stats import RequestStats
+from scripts.response_cache import ResponseCache
+from scripts.single_flight import DEFAULT_RESULT_TTL, SingleFlight
+from scripts.structs import decode_page, project_struct, to_struct_page
+
+# Lead search pages are requested with this `_limit`, which is the maximum
+# the Close API allows for leads.
+LEAD_PAGE_SIZE = 200
+
+# How many IDs `get_by_ids` looks up with a single request. This is the
+# maximum `_limit` of most list endpoints, and keeps the URLs short enough.
+ID_CHUNK_SIZE = 100
+
+# Bounds for the number of leads in a single `slice:i/N` of a lead search.
+# Slices are paginated with `_skip`, so we never want them too deep.
+MIN_LEAD_SLICE_SIZE = LEAD_PAGE_SIZE
+MAX_LEAD_SLICE_SIZE = 5000
+
+# Roughly how long a single slice should take to paginate through. Slower
+# pages mean smaller slices, so that the pool isn't held up by a long tail.
+TARGET_SLICE_SECONDS = 20
+
+_SLICE_DONE = object()
+
+_SORT_CLAUSE_RE = re.compile(r'(?<!\S)sort:\S+')
+
+# How many pages paginated iteration requests ahead of the page that's being
+# processed.
+PAGE_PREFETCH = 2
+
+_PAGES_DONE = object()
+
+# Pagination position of a scan that went through all the pages.
+PAGINATION_DONE = {'done': True}
+
+# How deep a keyset window is paginated with `_skip` before a new window is
+# started at the last date seen.
+MAX_WINDOW_SKIP = 1000
+
+# How long organization metadata (statuses, pipelines, custom fields, ...)
+# is cached for before it's fetched again.
+METADATA_CACHE_TTL = 300
+
+# Metadata cache entries that are invalidated by a POST, PUT or DELETE to an
+# endpoint starting with the given prefix.
+METADATA_INVALIDATIONS = [
+    ('status/lead', ['lead_statuses']),
+    ('status/opportunity', ['pipelines']),
+    ('pipeline', ['pipelines']),
+    ('custom_field', ['custom_fields']),
+    ('custom_fields', ['custom_fields']),
+    ('custom_field_schema', ['custom_fields']),
+    ('custom_activity', ['custom_activity_types', 'custom_fields']),
+    ('custom_object_type', ['custom_fields']),
+    ('role', ['roles']),
+    ('group', ['groups']),
+    ('email_template', ['email_templates']),
+    ('sms_template', ['sms_templates']),
+    ('membership', ['memberships']),
+    ('user', ['memberships']),
+    ('organization', ['memberships', 'lead_statuses', 'pipelines']),
+]
+
+# Request stats shared by the wrappers that aren't given their own. If the
+# `CLOSE_API_STATS` environment variable is set, a JSON summary of them is
+# written to the file it points to (or to stderr for `-`) when the process
+# exits.
+DEFAULT_REQUEST_STATS = RequestStats()
+if os.environ.get('CLOSE_API_STATS'):
+    atexit.register(DEFAULT_REQUEST_STATS.write, os.environ['CLOSE_API_STATS'])
+
+# Endpoints whose GET responses aren't reused by later GETs (concurrent ones
+# are still coalesced), because they're polled for changes.
+UNCACHED_ENDPOINTS = ('bulk_action',)
+
+# Params of the pages of a paginated resource. Scans go through every page
+# once, so their pages aren't kept around for later GETs either.
+PAGINATION_PARAMS = ('_skip', '_cursor', '_limit')
+
+# How often (in seconds) the progress of a server-side bulk action is polled.
+BULK_ACTION_POLL_INTERVAL = 5
+
+# Statuses of a bulk action that hasn't completed yet.
+BULK_ACTION_PENDING_STATUSES = ('created', 'processing')
+
+# How long (in seconds) to wait for a bulk action to complete.
+BULK_ACTION_TIMEOUT = 3600
+
+
+class BulkActionTimeout(Exception):
+    """Raised when a bulk action hasn't completed in time."""
+
+
+def is_reusable_get(endpoint, params):
+    """
+    Return whether the response of a GET of `endpoint` with `params` can be
+    reused by the identical GETs that follow it.
+    """
+    if endpoint.startswith(UNCACHED_ENDPOINTS):
+        return False
+    return not any(param in (params or {}) for param in PAGINATION_PARAMS)
+
+
+def _is_ascending(dates, start=None):
+    """Return whether `dates` are in ascending order, none before `start`."""
+    if start is not None:
+        dates = [start] + dates
+    return all(a <= b for a, b in zip(dates, dates[1:]))
+
+
+def get_lead_probe_params(query, fields):
+    """Return the params of the page used to size a sliced lead search."""
+    params = {'_limit': LEAD_PAGE_SIZE, '_fields': fields}
+    if query:
+        params['query'] = query
+    return params
+
+
+def pick_lead_slice_count(probe_resp, latency):
+    """
+    Return the number of slices a lead search should be split into, given
+    the response for its probe page and how long that page took to fetch.
+    """
+    total_leads = probe_resp['total_results']
+    if total_leads <= len(probe_resp['data']):
+        return 1 if total_leads else 0
+
+    pages_per_slice = max(1, int(TARGET_SLICE_SECONDS / max(latency, 0.01)))
+    slice_size = min(
+        max(pages_per_slice * LEAD_PAGE_SIZE, MIN_LEAD_SLICE_SIZE),
+        MAX_LEAD_SLICE_SIZE,
+    )
+    return int(math.ceil(float(total_leads) / slice_size))
+
+
+def get_lead_slice_query(query, slice_num, total_slices):
+    slice_query = f'slice:{slice_num}/{total_slices}'
+    if query:
+        # Sort clauses can't be nested, so keep them after the slice.
+        sort_clauses = _SORT_CLAUSE_RE.findall(query)
+        query = _SORT_CLAUSE_RE.sub('', query).strip()
+        if query and query != '*':
+            slice_query = f'({query}) {slice_query}'
+        slice_query = ' '.join([slice_query] + sort_clauses)
+    return slice_query
+
+
+def get_lead_bulk_edit(data):
+    """
+    Return the bulk edit params that apply the lead update `data`, or None if
+    a bulk edit can't make that change.
+    """
+    if len(data) != 1:
+        return None
+
+    field, value = next(iter(data.items()))
+    if field == 'status_id':
+        return {'type': 'set_lead_status', 'lead_status_id': value}
+    if field.startswith('custom.'):
+        # Custom fields can be referred to by ID or by name.
+        custom_field = field[len('custom.') :]
+        key = (
+            'custom_field_id'
+            if custom_field.startswith('cf_')
+            else 'custom_field_name'
+        )
+        if value is None:
+            return {'type': 'clear_custom_field', key: custom_field}
+        return {
+            'type': 'set_custom_field',
+            key: custom_field,
+            'custom_field_value': value,
+        }
+    return None
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """
+    HTTP adapter that enables TCP keep-alive on its sockets, so that idle
+    connections in the pool aren't silently dropped by NATs and load balancers
+    between bursts of requests (and have to be re-established, TLS handshake
+    included).
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs.setdefault(
+            'socket_options',
+            HTTPConnection.default_socket_options
+            + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)],
+        )
+        super().init_poolmanager(*args, **kwargs)
+
+    def connection_stats(self):
+        """
+        Return the number of connections opened and requests sent through
+        them, across all the hosts this adapter talked to.
+        """
+        pools = self.poolmanager.pools
+        with pools.lock:
+            host_pools = list(pools._container.values())
+        connections = sum(pool.num_connections for pool in host_pools)
+        requests_sent = sum(pool.num_requests for pool in host_pools)
+        return {
+            'connections': connections,
+            'requests': requests_sent,
+            'reuse_rate': (
+                1 - float(connections) / requests_sent
+                if requests_sent
+                else 0.0
+            ),
+        }
+
+
+class MetadataCache:
+    """
+    In-process cache for organization metadata. Entries are keyed by tuples
+    whose first element is the kind of metadata (e.g. `('custom_fields',
+    'lead')`), expire after `ttl` seconds, and can be invalidated by kind.
+    """
+
+    def __init__(self, ttl=METADATA_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+
+    def get(self, key):
+        """
+        Return a copy of the cached value for `key`, or raise a KeyError if
+        it isn't cached or has expired. Copies are returned so that callers
+        can't modify the cached value.
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            raise KeyError(key)
+        return copy.deepcopy(entry[1])
+
+    def set(self, key, value):
+        if self.ttl:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def get_or_fetch(self, key, fetch):
+        """
+        Return a copy of the cached value for `key`, calling `fetch()` to
+        populate the cache if the entry is missing or expired.
+        """
+        try:
+            return self.get(key)
+        except KeyError:
+            value = fetch()
+            self.set(key, value)
+            return copy.deepcopy(value) if self.ttl else value
+
+    def invalidate(self, *kinds):
+        """Drop all the entries of the given kinds of metadata."""
+        for key in list(self._entries):
+            if key[0] in kinds:
+                del self._entries[key]
+
+    def invalidate_for_endpoint(self, endpoint):
+        """Drop all the entries that a write to `endpoint` can make stale."""
+        endpoint = endpoint.strip('/')
+        for prefix, kinds in METADATA_INVALIDATIONS:
+            if endpoint == prefix or endpoint.startswith(prefix + '/'):
+                self.invalidate(*kinds)
+
+    def clear(self):
+        self._entries.clear()
 
 
 class CloseApiWrapper(Client):
     """
     Close API wrapper that makes it easier to paginate through resources and get all items
     with a single function call alongside some convenience functions (e.g. getting all lead statuses).
+
+    Organization metadata returned by the convenience functions is cached in-process (see `MetadataCache`)
+    and invalidated whenever the corresponding endpoints are written to through this wrapper.
     """
 
     def __init__(
-        self, api_key=None, tz_offset=None, max_retries=5, development=False
+        self,
+        api_key=None,
+        tz_offset=None,
+        max_retries=5,
+        development=False,
+        metadata_cache_ttl=METADATA_CACHE_TTL,
+        response_cache=None,
+        rate_limiter=None,
+        request_stats=None,
+        base_url=None,
+        get_result_ttl=DEFAULT_RESULT_TTL,
+        json_decoder=None,
+        hedger=None,
     ):
         super().__init__(
             api_key=api_key,
@@ -16,49 +317,880 @@ class CloseApiWrapper(Client):
             max_retries=max_retries,
             development=development,
         )
+        # Point the wrapper at another server, e.g. `scripts.fake_close_api`.
+        base_url = base_url or os.environ.get('CLOSE_API_BASE_URL')
+        if base_url:
+            self.base_url = base_url
+        self.metadata_cache = MetadataCache(ttl=metadata_cache_ttl)
 
-    def get_lead_statuses(self):
-        organization_id = self.get('me')['organizations'][0]['id']
+        # Opt-in persistent cache of GET responses. Either a path to the
+        # SQLite database or a `ResponseCache` instance.
+        if isinstance(response_cache, str):
+            response_cache = ResponseCache(response_cache)
+        self.response_cache = response_cache
+        self._response_cache_namespace = hashlib.sha256(
+            (api_key or '').encode('utf-8')
+        ).hexdigest()[:16]
+
+        # Every request is sent with a permit from the rate limiter, which
+        # can be shared with other wrapper instances using the same API key.
+        self.rate_limiter = rate_limiter or RateLimitController()
+
+        # Per-endpoint request counters. Unless told otherwise, all the
+        # wrappers in the process share the same stats, so that a single
+        # summary covers the whole run.
+        self.request_stats = request_stats or DEFAULT_REQUEST_STATS
+
+        # Identical GETs in flight at the same time are sent only once, and
+        # successful responses are reused for `get_result_ttl` seconds. Any
+        # write through this wrapper drops the reusable responses.
+        self.single_flight = SingleFlight(
+            ttl=get_result_ttl, sizeof=lambda response: len(response.content)
+        )
+
+        # Responses are decoded with orjson or msgspec when installed (see
+        # `scripts.json_codec.get_json_decoder`).
+        self.json_decoder = get_json_decoder(json_decoder)
+
+        # Optional hedging of slow GETs, enabled by passing a `RequestHedger`
+        # or by setting `CLOSE_API_HEDGE_PERCENTILE`.
+        if hedger is None and HEDGE_PERCENTILE:
+            hedger = RequestHedger()
+        self.hedger = hedger
+
+        # The default adapter keeps at most 10 connections per host and
+        # discards the rest, so at higher concurrency every extra request
+        # would pay for a new connection and TLS handshake.
+        self.http_adapter = KeepAliveAdapter(
+            pool_maxsize=self.rate_limiter.max_concurrency
+        )
+        self.session.mount('https://', self.http_adapter)
+        self.session.mount('http://', self.http_adapter)
+
+    def create_pool(self):
+        """
+        Return a pool of the concurrency backend in use (see
+        `scripts.runtime`) for running requests in parallel. The pool is
+        sized for the maximum concurrency, while the actual number of
+        in-flight requests is governed by the rate limiter.
+        """
+        return runtime.create_pool(self.rate_limiter.max_concurrency)
+
+    def connection_stats(self):
+        """
+        Return how many HTTP connections were opened for how many requests,
+        to confirm that connections (and TLS handshakes) are being reused.
+        """
+        return self.http_adapter.connection_stats()
+
+    def add_stats_sections(self):
+        """
+        Add the connection reuse and the response cache hits of this wrapper
+        so far to the summary of its request stats.
+        """
+        self.request_stats.add_section('connections', self.connection_stats())
+        if self.response_cache:
+            self.request_stats.add_section(
+                'response_cache', self.response_cache.stats()
+            )
+
+    def _dispatch(
+        self,
+        method_name,
+        endpoint,
+        api_key=None,
+        data=None,
+        debug=False,
+        timeout=None,
+        struct=None,
+        **kwargs,
+    ):
+        """
+        Same as `closeio_api.API._dispatch`, except that every attempt is
+        sent with a permit from the rate limiter and reports the rate limit
+        feedback back to it. Waiting for the rate limit window to reset after
+        a 429 is left to the rate limiter, so that all the other requests
+        back off as well.
+
+        GETs go through `self.single_flight`: callers of an identical GET
+        share its response, which every one of them decodes on its own, so
+        that they don't share the returned objects either.
+
+        With a `struct` (see `scripts.structs`), the response is decoded as a
+        page of `struct` instances.
+        """
+        prepped_req = self._prepare_request(
+            method_name, endpoint, api_key, data, debug, **kwargs
+        )
+        if method_name != 'get':
+            return self._handle_response(
+                self._send(method_name, endpoint, prepped_req, timeout)
+            )
+
+        reusable = is_reusable_get(endpoint, kwargs.get('params'))
+        response = self.single_flight.do(
+            (prepped_req.url, prepped_req.headers.get('Authorization')),
+            lambda: self._send_get(endpoint, prepped_req, timeout),
+            cacheable=lambda response: reusable and response.ok,
+        )
+        return self._handle_response(response, struct)
+
+    def _send_get(self, endpoint, prepped_req, timeout):
+        """
+        Send a GET and return its response. With a `hedger`, a GET that takes
+        longer than usual for its endpoint is sent a second time (budget
+        permitting), and whichever copy succeeds first is used.
+        """
+        delay = self.hedger.get_delay(endpoint) if self.hedger else None
+        if delay is None:
+            return self._send('get', endpoint, prepped_req, timeout)
+
+        primary = runtime.spawn(
+            self._send, 'get', endpoint, prepped_req, timeout
+        )
+        primary.join(delay)
+        if primary.ready() or not self.hedger.try_hedge():
+            return primary.get()
+
+        hedge = runtime.spawn(
+            self._send,
+            'get',
+            endpoint,
+            prepped_req.copy(),
+            timeout,
+            hedge=True,
+        )
+        pending = [primary, hedge]
+        try:
+            while True:
+                done = runtime.wait_any(pending)
+                pending.remove(done)
+                # Fall back to the other copy if this one failed.
+                if done.successful() or not pending:
+                    if done is hedge:
+                        self.hedger.record_win()
+                    return done.get()
+        finally:
+            # The slower copy isn't needed anymore.
+            runtime.killall(pending)
+
+    def _send(self, method_name, endpoint, prepped_req, timeout, hedge=False):
+        """Send a prepared request, with retries, and return its response."""
+        for retry_count in range(self.max_retries):
+            wait_start = time.monotonic()
+            try:
+                with self.rate_limiter.permit():
+                    start = time.monotonic()
+                    response = self.session.send(
+                        prepped_req, verify=self.verify, timeout=timeout
+                    )
+            except requests.exceptions.ConnectionError:
+                self.request_stats.record(
+                    method_name,
+                    endpoint,
+                    None,
+                    time.monotonic() - start,
+                    pool_wait=start - wait_start,
+                    retry=retry_count > 0,
+                    hedge=hedge and retry_count == 0,
+                )
+                if retry_count + 1 == self.max_retries:
+                    raise
+                time.sleep(2)
+                continue
+
+            self.request_stats.record(
+                method_name,
+                endpoint,
+                response.status_code,
+                time.monotonic() - start,
+                response_bytes=len(response.content),
+                pool_wait=start - wait_start,
+                retry=retry_count > 0,
+                hedge=hedge and retry_count == 0,
+            )
+            self.rate_limiter.update(response)
+            if self.hedger and method_name == 'get':
+                self.hedger.record(endpoint, time.monotonic() - start)
+
+            if response.status_code == 429:
+                logging.debug('Request was rate limited, retrying')
+                continue
+
+            # Retry 503 errors or 502 or 504 erors on GET requests.
+            elif response.status_code == 503 or (
+                method_name == 'get' and response.status_code in (502, 504)
+            ):
+                sleep_time = self._get_randomized_sleep_time_for_error(
+                    response.status_code, retry_count
+                )
+                logging.debug(
+                    'Request hit a %s, sleeping for %s seconds',
+                    response.status_code,
+                    sleep_time,
+                )
+                time.sleep(sleep_time)
+                continue
+
+            break
+
+        return response
+
+    def _handle_response(self, response, struct=None):
+        if response.ok:
+            # 204 responses have no content.
+            if response.status_code == 204:
+                return ''
+            if struct is not None:
+                return decode_page(
+                    response.content, struct, json_decoder=self.json_decoder
+                )
+            return self.json_decoder(response.content)
+        elif response.status_code == 400:
+            raise ValidationError(response)
+        else:
+            raise APIError(response)
+
+    def get(self, endpoint, params=None, timeout=None, struct=None, **kwargs):
+        """
+        Same as `closeio_api.API.get`. Pages of list endpoints can be decoded
+        into a typed `struct` from `scripts.structs` (e.g. `Activity`), which
+        holds only the fields requested with `_fields` (or all the struct's
+        fields if there's no `_fields` param).
+        """
+        if struct is not None:
+            struct = project_struct(struct, (params or {}).get('_fields'))
+        if self.response_cache is None or kwargs:
+            return super().get(
+                endpoint, params, timeout=timeout, struct=struct, **kwargs
+            )
+
+        key = self.response_cache.make_key(
+            self._response_cache_namespace, endpoint, params
+        )
+        resp = self.response_cache.get(key)
+        if resp is None:
+            resp = super().get(endpoint, params, timeout=timeout)
+            self.response_cache.set(
+                key, resp, self.response_cache.get_ttl(endpoint, params)
+            )
+        if struct is not None:
+            return to_struct_page(resp, struct)
+        return resp
+
+    def post(self, endpoint, data, timeout=None, **kwargs):
+        try:
+            return super().post(endpoint, data, timeout=timeout, **kwargs)
+        finally:
+            self.metadata_cache.invalidate_for_endpoint(endpoint)
+            self.single_flight.invalidate()
+
+    def put(self, endpoint, data, timeout=None, **kwargs):
+        try:
+            return super().put(endpoint, data, timeout=timeout, **kwargs)
+        finally:
+            self.metadata_cache.invalidate_for_endpoint(endpoint)
+            self.single_flight.invalidate()
+
+    def delete(self, endpoint, timeout=None, **kwargs):
+        try:
+            return super().delete(endpoint, timeout=timeout, **kwargs)
+        finally:
+            self.metadata_cache.invalidate_for_endpoint(endpoint)
+            self.single_flight.invalidate()
+
+    def bulk_execute(
+        self,
+        operations,
+        dry_run=False,
+        journal=None,
+        max_attempts=DEFAULT_MAX_ATTEMPTS,
+    ):
+        """
+        Run a stream of `(method, endpoint, data)` write operations
+        concurrently and yield their outcomes as they complete. See
+        `BulkExecutor` for the details.
+        """
+        return BulkExecutor(
+            self, dry_run=dry_run, journal=journal, max_attempts=max_attempts
+        ).run(operations)
+
+    def submit_bulk_action(self, action, query, **data):
+        """
+        Submit a server-side bulk action (`edit`, `delete` or `email`) for
+        all the leads matching `query` and return the created bulk action.
+        """
+        return self.post(
+            f'bulk_action/{action}',
+            data=dict(data, query=query, send_done_email=False),
+        )
+
+    def wait_for_bulk_action(
+        self,
+        action,
+        bulk_action_id,
+        poll_interval=BULK_ACTION_POLL_INTERVAL,
+        timeout=BULK_ACTION_TIMEOUT,
+    ):
+        """
+        Poll a bulk action until it completes and return its final state,
+        with the number of leads it matched (`n_leads`) and processed
+        (`n_leads_processed`). Raise `BulkActionTimeout` if it's still
+        pending after `timeout` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            bulk_action = self.get(f'bulk_action/{action}/{bulk_action_id}')
+            bulk_action.setdefault('n_leads', 0)
+            bulk_action.setdefault('n_leads_processed', 0)
+            logging.debug(
+                'Bulk %s %s is %s (%s/%s leads)',
+                action,
+                bulk_action_id,
+                bulk_action['status'],
+                bulk_action['n_leads_processed'],
+                bulk_action['n_leads'],
+            )
+            if bulk_action['status'] not in BULK_ACTION_PENDING_STATUSES:
+                return bulk_action
+            if time.monotonic() + poll_interval > deadline:
+                raise BulkActionTimeout(
+                    f'Bulk {action} {bulk_action_id} is still '
+                    f'{bulk_action["status"]} after {timeout} seconds '
+                    f'({bulk_action["n_leads_processed"]}/'
+                    f'{bulk_action["n_leads"]} leads processed)'
+                )
+            time.sleep(poll_interval)
+
+    def run_bulk_action(
+        self, action, query, timeout=BULK_ACTION_TIMEOUT, **data
+    ):
+        bulk_action = self.submit_bulk_action(action, query, **data)
+        return self.wait_for_bulk_action(
+            action, bulk_action['id'], timeout=timeout
+        )
+
+    def bulk_edit(self, query, type, timeout=BULK_ACTION_TIMEOUT, **data):
+        """
+        Run a bulk edit (e.g. `type='set_lead_status', lead_status_id=...`)
+        over the leads matching `query` and return its final state.
+        """
+        return self.run_bulk_action(
+            'edit', query, timeout=timeout, type=type, **data
+        )
+
+    def bulk_delete(self, query, timeout=BULK_ACTION_TIMEOUT):
+        return self.run_bulk_action('delete', query, timeout=timeout)
+
+    def bulk_email(
+        self,
+        query,
+        template_id,
+        sender_account_id,
+        sender_name,
+        sender_email,
+        timeout=BULK_ACTION_TIMEOUT,
+    ):
+        return self.run_bulk_action(
+            'email',
+            query,
+            timeout=timeout,
+            template_id=template_id,
+            sender_account_id=sender_account_id,
+            sender_name=sender_name,
+            sender_email=sender_email,
+        )
+
+    def update_leads(
+        self,
+        query,
+        data,
+        dry_run=False,
+        journal=None,
+        timeout=BULK_ACTION_TIMEOUT,
+    ):
+        """
+        Apply the same `data` to all the leads matching `query` and return
+        the number of leads that were `updated`, `skipped` (dry run) and
+        `failed` to update, as a dict.
+
+        Changes a bulk edit can make (setting the lead status, or setting or
+        clearing a single custom field) run server-side as a bulk action,
+        which has `timeout` seconds to complete (see `wait_for_bulk_action`).
+        Anything else falls back to a PUT per lead through `bulk_execute`,
+        which is also used for dry runs.
+        """
+        bulk_edit = get_lead_bulk_edit(data)
+        if bulk_edit and not dry_run:
+            bulk_action = self.bulk_edit(query, timeout=timeout, **bulk_edit)
+            if bulk_action['status'] != 'error':
+                updated = bulk_action['n_leads_processed']
+                return {
+                    'updated': updated,
+                    'skipped': 0,
+                    'failed': max(0, bulk_action['n_leads'] - updated),
+                }
+            logging.warning(
+                'Bulk edit %s failed, updating leads one by one',
+                bulk_action['id'],
+            )
+
+        # Gather all the IDs first, since the update could take the leads
+        # out of the query while we're paginating through it.
+        lead_ids = [
+            lead['id']
+            for lead in self.iter_items(
+                'lead', params={'query': query, '_fields': 'id'}
+            )
+        ]
+        counts = {'updated': 0, 'skipped': 0, 'failed': 0}
+        for result in self.bulk_execute(
+            (('put', f'lead/{lead_id}', data) for lead_id in lead_ids),
+            dry_run=dry_run,
+            journal=journal,
+        ):
+            status = result['status']
+            counts['updated' if status == 'succeeded' else status] += 1
+        return counts
+
+    def get_organization_id(self):
+        return self.metadata_cache.get_or_fetch(
+            ('organization_id',),
+            lambda: self.get('me')['organizations'][0]['id'],
+        )
+
+    def _get_organization_field(self, field):
         return self.get(
-            f"organization/{organization_id}",
-            params={"_fields": "lead_statuses"},
-        )["lead_statuses"]
+            f"organization/{self.get_organization_id()}",
+            params={"_fields": field},
+        )[field]
+
+    def get_memberships(self, include_inactive=False):
+        memberships = self.metadata_cache.get_or_fetch(
+            ('memberships',),
+            lambda: self.get(
+                f"organization/{self.get_organization_id()}",
+                params={"_fields": "memberships,inactive_memberships"},
+            ),
+        )
+        if include_inactive:
+            return (
+                memberships["memberships"]
+                + memberships["inactive_memberships"]
+            )
+        return memberships["memberships"]
+
+    def get_lead_statuses(self):
+        return self.metadata_cache.get_or_fetch(
+            ('lead_statuses',),
+            lambda: self._get_organization_field("lead_statuses"),
+        )
 
     def get_opportunity_pipelines(self):
-        organization_id = self.get('me')['organizations'][0]['id']
-        return self.get(
-            f"organization/{organization_id}",
-            params={"_fields": "pipelines"},
-        )["pipelines"]
+        return self.metadata_cache.get_or_fetch(
+            ('pipelines',),
+            lambda: self._get_organization_field("pipelines"),
+        )
 
     def get_custom_fields(self, type):
-        return self.get(f"custom_field_schema/{type}")["fields"]
+        return self.metadata_cache.get_or_fetch(
+            ('custom_fields', type),
+            lambda: self.get(f"custom_field_schema/{type}")["fields"],
+        )
 
     def get_opportunity_statuses(self):
-        organization_id = self.get('me')['organizations'][0]['id']
-        pipelines = self.get(
-            f"organization/{organization_id}",
-            params={"_fields": "pipelines"},
-        )["pipelines"]
-
         opportunity_statuses = []
-        for pipeline in pipelines:
+        for pipeline in self.get_opportunity_pipelines():
             opportunity_statuses.extend(pipeline['statuses'])
 
         return opportunity_statuses
 
-    def get_all_items(self, url, params=None):
-        if params is None:
-            params = {}
-
-        items = []
-        has_more = True
-        offset = 0
-        while has_more:
-            params["_skip"] = offset
-            resp = self.get(url, params=params)
-            items.extend(resp['data'])
-            offset += len(resp["data"])
-            has_more = resp["has_more"]
-
-        return items
+    def get_custom_activity_types(self):
+        return self.metadata_cache.get_or_fetch(
+            ('custom_activity_types',),
+            lambda: self.get("custom_activity")["data"],
+        )
+
+    def get_roles(self):
+        return self.metadata_cache.get_or_fetch(
+            ('roles',), lambda: self.get_all_items('role')
+        )
+
+    def get_groups(self):
+        return self.metadata_cache.get_or_fetch(
+            ('groups',), lambda: self.get('group')['data']
+        )
+
+    def get_email_templates(self):
+        return self.metadata_cache.get_or_fetch(
+            ('email_templates',), lambda: self.get_all_items('email_template')
+        )
+
+    def get_sms_templates(self):
+        return self.metadata_cache.get_or_fetch(
+            ('sms_templates',), lambda: self.get_all_items('sms_template')
+        )
+
+    def _fetch_pages(self, url, params, position=None, struct=None):
+        """
+        Yield `(page, position)` tuples for every page of a resource, where
+        `position` holds the params that fetch the next page, or is
+        `PAGINATION_DONE` after the last page. Passing a `position` back in
+        continues from there.
+        """
+        if position == PAGINATION_DONE:
+            return
+        params = dict(params or {}, **(position or {}))
+        offset = params.get('_skip', 0)
+        while True:
+            resp = self.get(url, params=params, struct=struct)
+
+            if 'cursor_next' in resp:
+                if not resp['cursor_next']:
+                    yield resp['data'], PAGINATION_DONE
+                    break
+                params['_cursor'] = resp['cursor_next']
+                yield resp['data'], {'_cursor': params['_cursor']}
+            else:
+                if not resp.get('has_more') or not resp['data']:
+                    yield resp['data'], PAGINATION_DONE
+                    break
+                offset += len(resp['data'])
+                params['_skip'] = offset
+                yield resp['data'], {'_skip': offset}
+
+    def _fetch_keyset_pages(
+        self, url, params, date_field, position=None, struct=None
+    ):
+        """
+        Yield `(page, position)` tuples for the pages of a resource ordered
+        by `date_field`, scanning it in `{date_field}__gte` windows that are
+        each paginated at most `MAX_WINDOW_SKIP` items deep. Once a window
+        gets that deep, it's closed at the last date seen so far and a new
+        window starts there.
+
+        If a page shows that the resource ignores the ordering or the filter
+        (its dates go backwards, or start before the window), the rest of it
+        is scanned with plain `_skip` pagination from the items returned so
+        far instead.
+        """
+        if position == PAGINATION_DONE:
+            return
+        params = dict(params or {}, _order_by=date_field)
+        params.pop('_skip', None)
+        if params.get('_fields'):
+            fields = params['_fields'].split(',')
+            params['_fields'] = ','.join(
+                fields + [f for f in ('id', date_field) if f not in fields]
+            )
+
+        # The IDs of the items seen with the latest date, which show up again
+        # at the start of the next window.
+        last_date = position['last_date'] if position else None
+        last_date_ids = set(position['last_date_ids'] if position else [])
+        # Number of items returned so far, where a `_skip` scan continues.
+        count = position.get('count', 0) if position else 0
+        windowed = True
+        while True:
+            window_params = dict(params)
+            if last_date is not None:
+                window_params[f'{date_field}__gte'] = last_date
+            window_start = last_date
+            offset = 0
+            while True:
+                if offset:
+                    window_params['_skip'] = offset
+                resp = self.get(url, params=window_params, struct=struct)
+                dates = [item[date_field] for item in resp['data']]
+                if windowed and not _is_ascending(dates, last_date):
+                    logging.warning(
+                        '%s ignores the %s order or filter, scanning it '
+                        'with _skip instead',
+                        url,
+                        date_field,
+                    )
+                    windowed = False
+                    window_params = dict(params)
+                    offset = count
+                    continue
+                page = []
+                for item in resp['data']:
+                    if item['id'] in last_date_ids:
+                        continue
+                    if item[date_field] != last_date:
+                        last_date = item[date_field]
+                        last_date_ids = set()
+                    last_date_ids.add(item['id'])
+                    page.append(item)
+
+                if not resp.get('has_more') or not resp['data']:
+                    yield page, PAGINATION_DONE
+                    return
+                if page:
+                    count += len(page)
+                    yield page, {
+                        'last_date': last_date,
+                        'last_date_ids': sorted(last_date_ids),
+                        'count': count,
+                    }
+                offset += len(resp['data'])
+
+                # Start a new window unless the whole window shares the same
+                # date, in which case there's nothing to split on.
+                if (
+                    windowed
+                    and offset >= MAX_WINDOW_SKIP
+                    and last_date != window_start
+                ):
+                    break
+
+    def iter_pages(
+        self,
+        url,
+        params=None,
+        prefetch=PAGE_PREFETCH,
+        date_field=None,
+        checkpoint=None,
+        record=None,
+        struct=None,
+    ):
+        """
+        Yield the `data` list of every page of a paginated resource.
+
+        Both pagination styles used by the Close API are supported: endpoints
+        that return a `cursor_next` (e.g. `event`) are paginated with
+        `_cursor`, everything else with `_skip`. The `params` dict passed in
+        is never modified.
+
+        Deep `_skip` offsets get slower the deeper they go and are capped by
+        the API. For large resources that can be filtered and ordered by
+        date, pass `date_field` (e.g. `date_created`) to scan them in shallow
+        keyset windows instead (see `_fetch_keyset_pages`). Items are then
+        returned in ascending `date_field` order.
+
+        Up to `prefetch` pages are requested ahead in a separate greenlet
+        while the caller processes the current one, so that the round trips
+        overlap with the processing. Pass `prefetch=0` to only request a page
+        once the previous one has been processed.
+
+        With a `checkpoint` (see `scripts.checkpoint.Checkpoint`), the scan
+        starts from the checkpoint's position, and the position is advanced
+        every time the caller is done with a page and asks for the next one.
+
+        With a `record` callable (e.g. `scripts.records.LeadRecord.from_json`)
+        every item is converted as soon as its page comes in, so that only
+        the converted items are kept around by the caller. With a `struct`
+        (e.g. `scripts.structs.Activity`), the pages are decoded into it
+        instead of into dicts (see `get`).
+        """
+        position = checkpoint.position if checkpoint else None
+        if date_field:
+            fetch_pages = self._fetch_keyset_pages(
+                url, params, date_field, position, struct
+            )
+        else:
+            fetch_pages = self._fetch_pages(url, params, position, struct)
+
+        if prefetch:
+            fetch_pages = self._prefetch(fetch_pages, prefetch)
+
+        for page, position in fetch_pages:
+            if record:
+                page = [record(item) for item in page]
+            yield page
+            if checkpoint:
+                checkpoint.set_position(position)
+
+    def _prefetch(self, iterator, size):
+        """
+        Yield the items of `iterator`, consuming up to `size` items ahead in
+        a separate greenlet (or thread, see `scripts.runtime`).
+        """
+        items = runtime.Queue(maxsize=size)
+
+        def _fetch():
+            try:
+                for item in iterator:
+                    items.put(item)
+            except Exception as e:
+                items.put(e)
+            items.put(_PAGES_DONE)
+
+        fetcher = runtime.spawn(_fetch)
+        try:
+            while True:
+                item = items.get()
+                if item is _PAGES_DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            fetcher.kill()
+
+    def iter_items(
+        self,
+        url,
+        params=None,
+        prefetch=PAGE_PREFETCH,
+        date_field=None,
+        checkpoint=None,
+        record=None,
+        struct=None,
+    ):
+        """
+        Yield every item of a paginated resource. Only a few pages (see
+        `iter_pages`) are held in memory at a time, so this should be
+        preferred over `get_all_items` whenever the items can be processed
+        as they come in.
+        """
+        for page in self.iter_pages(
+            url,
+            params=params,
+            prefetch=prefetch,
+            date_field=date_field,
+            checkpoint=checkpoint,
+            record=record,
+            struct=struct,
+        ):
+            yield from page
+
+    def get_all_items(
+        self,
+        url,
+        params=None,
+        prefetch=PAGE_PREFETCH,
+        date_field=None,
+        record=None,
+        struct=None,
+    ):
+        return list(
+            self.iter_items(
+                url,
+                params=params,
+                prefetch=prefetch,
+                date_field=date_field,
+                record=record,
+                struct=struct,
+            )
+        )
+
+    def get_by_ids(self, endpoint, ids, fields=None, chunk_size=ID_CHUNK_SIZE):
+        """
+        Return a dict of the objects of `endpoint` (e.g. `contact`) with the
+        given IDs, by ID, optionally with only the given `fields`.
+
+        The IDs are looked up `chunk_size` at a time, with `id__in` list
+        requests (or searches by ID for leads) that run concurrently, instead
+        of one request per ID. Objects that don't exist are left out.
+        """
+        ids = list(dict.fromkeys(id for id in ids if id))
+        fields = list(fields or [])
+        if fields and 'id' not in fields:
+            fields.append('id')
+
+        def _fetch_chunk(chunk):
+            if endpoint == 'lead':
+                params = {'query': ' or '.join(f'id:{id}' for id in chunk)}
+            else:
+                params = {'id__in': ','.join(chunk)}
+            params['_limit'] = len(chunk)
+            if fields:
+                params['_fields'] = ','.join(fields)
+            return self.get_all_items(endpoint, params=params, prefetch=0)
+
+        chunks = [
+            ids[i : i + chunk_size] for i in range(0, len(ids), chunk_size)
+        ]
+        objects = {}
+        pool = self.create_pool()
+        for items in pool.imap_unordered(_fetch_chunk, chunks):
+            for item in items:
+                objects[item['id']] = item
+        return objects
+
+    def _get_lead_slice_count(self, query, fields):
+        """
+        Return the number of slices a lead search should be split into, based
+        on the total number of results and the latency of a probe page.
+        """
+        start = time.monotonic()
+        resp = self.get('lead', params=get_lead_probe_params(query, fields))
+        return pick_lead_slice_count(resp, time.monotonic() - start)
+
+    def iter_lead_slices(
+        self,
+        query=None,
+        fields=None,
+        concurrency=None,
+        record=None,
+        struct=None,
+    ):
+        """
+        Yield every lead matching a search query, fetching `slice:i/N` parts
+        of the query in parallel.
+
+        The number of slices is picked from the total number of results and
+        the observed page latency. Leads are yielded as soon as a page comes
+        in (in no particular order), and leads that show up in more than one
+        slice because they changed during the scan are only yielded once.
+        Leads are converted with `record`, or decoded into a `struct`, if
+        given (see `iter_pages`).
+        """
+        fields = list(fields or [])
+        if fields and 'id' not in fields:
+            fields.append('id')
+        fields = ','.join(fields) or None
+
+        total_slices = self._get_lead_slice_count(query, fields)
+        if not total_slices:
+            return
+
+        if concurrency is None:
+            concurrency = self.rate_limiter.max_concurrency
+
+        # Bounded, so that workers wait for the consumer instead of buffering
+        # the whole result set in memory.
+        pages = runtime.Queue(maxsize=concurrency * 2)
+
+        def _fetch_slice(slice_num):
+            params = {
+                'query': get_lead_slice_query(query, slice_num, total_slices),
+                '_limit': LEAD_PAGE_SIZE,
+            }
+            if fields:
+                params['_fields'] = fields
+            try:
+                for page in self.iter_pages(
+                    'lead', params=params, struct=struct
+                ):
+                    pages.put(page)
+            except Exception as e:
+                pages.put(e)
+            pages.put(_SLICE_DONE)
+
+        pool = runtime.create_pool(concurrency)
+        fetcher = pool.map_async(_fetch_slice, range(1, total_slices + 1))
+
+        seen_ids = set()
+        remaining_slices = total_slices
+        try:
+            while remaining_slices:
+                page = pages.get()
+                if page is _SLICE_DONE:
+                    remaining_slices -= 1
+                    continue
+                if isinstance(page, Exception):
+                    raise page
+
+                for lead in page:
+                    # Interned, so that a record built from the lead shares
+                    # the ID string with `seen_ids`.
+                    lead_id = intern_id(lead['id'])
+                    if lead_id in seen_ids:
+                        continue
+                    seen_ids.add(lead_id)
+                    yield record(lead) if record else lead
+        finally:
+            fetcher.kill()
+            pool.kill()
@@ -0,0 +1,354 @@
+"""
+End-to-end benchmark of the scripts against `scripts.fake_close_api`.
+
+Every selected script is run, as a subprocess, against a fresh fake API for
+every combination of data size, injected latency, pool size and concurrency
+backend (see `scripts.runtime`). For every
+run we record the wall time, the number of API requests the fake server
+handled (and the retries and 429s the wrappers saw), the number of objects
+served, the peak RSS of the script, the objects served per second and the
+effective parallelism reported by the script's concurrency check. The
+results are appended to a JSON lines file, so that runs before and after a
+change can be compared:
+
+    python -m scripts.benchmark --sizes 1000,10000 --latencies 0,0.05 \\
+        --pool-sizes 8,32 --backends gevent,threads \\
+        --scripts find_duplicate_leads,export_calls
+"""
+import argparse
+import contextlib
+import csv
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import urljoin
+from urllib.request import urlopen
+
+from scripts.fake_close_api import STATS_PATH
+from scripts.runtime import BACKENDS
+
+API_KEY = 'benchmark'
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Command line arguments of every benchmarked script. `{api_key}` and
+# `{csv}` (a CSV of lead updates, generated from the fake data) are filled
+# in for every run.
+BENCHMARKS = {
+    'find_duplicate_leads': ['-k', '{api_key}', '-f', 'all'],
+    'export_calls': ['-k', '{api_key}'],
+    'export_sms': ['-k', '{api_key}'],
+    'export_activities_to_json': [
+        '-k',
+        '{api_key}',
+        '-s',
+        '{start_date}',
+        '-e',
+        '{end_date}',
+        '-t',
+        'call',
+    ],
+    'export_sequences_data': ['-k', '{api_key}'],
+    'time_to_respond_report': ['-k', '{api_key}', '-p', '14', '-u', '-o'],
+    'run_leads_deleted_report': ['-k', '{api_key}'],
+    'run_leads_merged_report': ['-k', '{api_key}'],
+    'clone_organization': ['-f', '{api_key}', '-t', '{api_key}', '--all'],
+    'bulk_update_leads_info': ['{csv}', '-k', '{api_key}', '--confirmed'],
+}
+
+# Scripts that ask for a confirmation on stdin.
+SCRIPT_INPUT = {'clone_organization': 'y\n'}
+
+# Number of leads updated by the `bulk_update_leads_info` benchmark.
+CSV_ROWS = 100
+
+
+@contextlib.contextmanager
+def run_fake_api(args, leads, latency):
+    """
+    Start `scripts.fake_close_api` in a process of its own, so that neither
+    its memory nor its CPU time is attributed to the benchmarked scripts,
+    and yield its base URL.
+    """
+    command = [
+        sys.executable,
+        '-m',
+        'scripts.fake_close_api',
+        '--port',
+        '0',
+        '--seed',
+        str(args.seed),
+        '--leads',
+        str(leads),
+        '--latency',
+        str(latency),
+        '--jitter',
+        str(args.jitter),
+        '--error-rate',
+        str(args.error_rate),
+        '--slow-rate',
+        str(args.slow_rate),
+        '--slow-latency',
+        str(args.slow_latency),
+    ]
+    if args.rate_limit:
+        command += ['--rate-limit', str(args.rate_limit)]
+    proc = subprocess.Popen(
+        command,
+        env=dict(os.environ, PYTHONPATH=REPO_DIR),
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        # `Serving a fake Close API at <base URL>`
+        yield proc.stdout.readline().split()[-1]
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def get_fake_api_stats(base_url):
+    url = urljoin(base_url, STATS_PATH)
+    with urlopen(url) as response:
+        return json.load(response)
+
+
+def write_leads_csv(base_url, path, rows=CSV_ROWS):
+    """Write a CSV of lead description updates for the first `rows` leads."""
+    url = f'{base_url}lead/?_limit={rows}&_fields=id'
+    with urlopen(url) as response:
+        leads = json.load(response)['data']
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['lead_id', 'description'])
+        for lead in leads:
+            writer.writerow([lead['id'], 'Updated by the benchmark'])
+
+
+def run_script(script, base_url, work_dir, pool_size, backend, timeout):
+    """Run `script` against the fake API and return its measurements."""
+    csv_path = os.path.join(work_dir, 'leads.csv')
+    if '{csv}' in BENCHMARKS[script]:
+        write_leads_csv(base_url, csv_path)
+    today = datetime.now(timezone.utc).date()
+    args = [
+        arg.format(
+            api_key=API_KEY,
+            csv=csv_path,
+            start_date=f'{today.year - 1}-01-01',
+            end_date=f'{today.year + 1}-01-01',
+        )
+        for arg in BENCHMARKS[script]
+    ]
+    stats_path = os.path.join(work_dir, 'stats.json')
+    env = dict(
+        os.environ,
+        PYTHONPATH=REPO_DIR,
+        CLOSE_API_BASE_URL=base_url,
+        CLOSE_API_STATS=stats_path,
+        CLOSE_API_MAX_CONCURRENCY=str(pool_size),
+        CLOSE_API_CONCURRENCY_BACKEND=backend,
+    )
+
+    stats_before = get_fake_api_stats(base_url)
+    log_path = os.path.join(work_dir, f'{script}.log')
+    with open(log_path, 'w') as log:
+        start = time.monotonic()
+        proc = subprocess.Popen(
+            [sys.executable, '-m', f'scripts.{script}'] + args,
+            cwd=work_dir,
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        timer = threading.Timer(timeout, proc.kill)
+        timer.start()
+        try:
+            proc.stdin.write(SCRIPT_INPUT.get(script, ''))
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        # `wait4` gives us the resource usage of this particular child.
+        _, status, rusage = os.wait4(proc.pid, 0)
+        wall_time = time.monotonic() - start
+        timer.cancel()
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    stats_after = get_fake_api_stats(base_url)
+
+    result = {
+        'returncode': proc.returncode,
+        'timed_out': wall_time >= timeout,
+        'wall_time': round(wall_time, 3),
+        'cpu_time': round(rusage.ru_utime + rusage.ru_stime, 3),
+        # `ru_maxrss` is in kilobytes on Linux (and bytes on macOS).
+        'peak_rss_mb': round(
+            rusage.ru_maxrss
+            / (1024 * 1024 if sys.platform == 'darwin' else 1024),
+            1,
+        ),
+        'requests': (
+            stats_after['request_count'] - stats_before['request_count']
+        ),
+        'items': stats_after['items_served'] - stats_before['items_served'],
+    }
+    result['items_per_second'] = round(result['items'] / wall_time, 1)
+    if os.path.exists(stats_path):
+        with open(stats_path) as f:
+            stats = json.load(f)
+        total = stats['total']
+        result.update(
+            retries=total['retries'],
+            hedges=total['hedges'],
+            rate_limited=total['rate_limited'],
+            errors=total['errors'],
+            latency_p95=total['latency_p95'],
+        )
+        if 'runtime' in stats:
+            result['parallelism'] = stats['runtime']['parallelism']
+        os.remove(stats_path)
+    if proc.returncode:
+        with open(log_path) as f:
+            result['output_tail'] = f.read()[-2000:]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the scripts against a local fake Close API'
+    )
+    parser.add_argument(
+        '--scripts',
+        default=','.join(BENCHMARKS),
+        help='Comma separated scripts to benchmark (default: all)',
+    )
+    parser.add_argument(
+        '--sizes',
+        default='1000',
+        help='Comma separated numbers of leads to seed the fake API with',
+    )
+    parser.add_argument(
+        '--latencies',
+        default='0',
+        help='Comma separated latencies (in seconds) of the fake API',
+    )
+    parser.add_argument(
+        '--pool-sizes',
+        default='32',
+        help='Comma separated maximum numbers of concurrent requests',
+    )
+    parser.add_argument(
+        '--backends',
+        default='gevent',
+        help='Comma separated concurrency backends of the scripts '
+        f'({", ".join(BACKENDS)})',
+    )
+    parser.add_argument(
+        '--jitter',
+        type=float,
+        default=0.5,
+        help='Randomize the latency by +/- this fraction of itself',
+    )
+    parser.add_argument(
+        '--slow-rate',
+        type=float,
+        default=0.0,
+        help='Share of requests that take --slow-latency seconds longer',
+    )
+    parser.add_argument(
+        '--slow-latency',
+        type=float,
+        default=1.0,
+        help='Seconds added to the slow requests',
+    )
+    parser.add_argument(
+        '--rate-limit',
+        type=int,
+        help='Maximum number of requests per second of the fake API',
+    )
+    parser.add_argument(
+        '--error-rate',
+        type=float,
+        default=0.0,
+        help='Share of requests that fail with a 503',
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=600,
+        help='Seconds after which a script is killed',
+    )
+    parser.add_argument(
+        '--output',
+        '-o',
+        default='benchmark_results.jsonl',
+        help='JSON lines file the results are appended to',
+    )
+    args = parser.parse_args()
+
+    scripts = args.scripts.split(',')
+    unknown = set(scripts) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f'Unknown scripts: {", ".join(sorted(unknown))}')
+    backends = args.backends.split(',')
+    unknown = set(backends) - set(BACKENDS)
+    if unknown:
+        parser.error(f'Unknown backends: {", ".join(sorted(unknown))}')
+
+    runs = itertools.product(
+        map(int, args.sizes.split(',')),
+        map(float, args.latencies.split(',')),
+        map(int, args.pool_sizes.split(',')),
+        backends,
+        scripts,
+    )
+    with open(args.output, 'a') as output:
+        for size, latency, pool_size, backend, script in runs:
+            # A fresh fake API for every run, since some of the scripts
+            # write to it.
+            with run_fake_api(args, size, latency) as base_url:
+                with tempfile.TemporaryDirectory() as work_dir:
+                    result = run_script(
+                        script,
+                        base_url,
+                        work_dir,
+                        pool_size,
+                        backend,
+                        args.timeout,
+                    )
+
+            result = dict(
+                script=script,
+                leads=size,
+                latency=latency,
+                pool_size=pool_size,
+                backend=backend,
+                date=datetime.now(timezone.utc).isoformat(),
+                **result,
+            )
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+
+            summary = f'FAILED ({result["returncode"]})'
+            if not result['returncode']:
+                summary = (
+                    f'{result["wall_time"]}s, {result["requests"]} requests, '
+                    f'{result["items_per_second"]} items/s, '
+                    f'{result["peak_rss_mb"]} MB'
+                )
+            print(
+                f'{script} leads={size} latency={latency} '
+                f'pool={pool_size} backend={backend}: {summary}'
+            )
+
+
+if __name__ == '__main__':
+    main()
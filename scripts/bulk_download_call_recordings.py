@@ -1,15 +1,17 @@
-import gevent.monkey
-from gevent.pool import Pool
-
-gevent.monkey.patch_all()
-
 import argparse
-from closeio_api import Client as CloseIO_API
-from dateutil.relativedelta import relativedelta
+import csv
 from datetime import datetime
-import requests
 from operator import itemgetter
-import csv
+
+from dateutil.relativedelta import relativedelta
+
+from scripts.runtime import bootstrap, create_pool
+
+bootstrap()  # isort: split
+
+import requests
+
+from scripts.CloseApiWrapper import CloseApiWrapper
 
 parser = argparse.ArgumentParser(
     description='Bulk Download Close Call Recordings into a specified Folder'
@@ -35,7 +37,7 @@ parser.add_argument(
 )
 args = parser.parse_args()
 
-api = CloseIO_API(args.api_key)
+api = CloseApiWrapper(args.api_key)
 
 days = []
 calls = []
@@ -68,39 +70,30 @@ while starting_date < ending_date_final:
 # Method to get all of the recordings for a specific day.
 def getRecordedCalls(day):
     print(f"Getting all recorded call activities for {day['day']}...")
-    has_more = True
-    offset = 0
-    while has_more:
-        resp = api.get(
-            'activity/call',
-            params={
-                '_skip': offset,
-                'date_created__gte': day['start_date'],
-                'date_created__lte': day['end_date'],
-                '_fields': 'id,recording_url,voicemail_url,date_created,lead_id,duration,voicemail_duration,date_created',
-            },
-        )
-        for call in resp['data']:
-            if (call['duration'] > 0 or call['voicemail_duration'] > 0) and (
-                call.get('recording_url') or call.get('voicemail_url')
-            ):
-                call['url'] = call.get(
-                    'recording_url', call.get('voicemail_url')
-                )
-                if call['duration'] > 0:
-                    call['Type'] = 'Answered Call'
-                    call['Answered or Voicemail Duration'] = call['duration']
-                else:
-                    call['Type'] = 'Voicemail'
-                    call['Answered or Voicemail Duration'] = call[
-                        'voicemail_duration'
-                    ]
-                calls.append(call)
-        offset += len(resp['data'])
-        has_more = resp['has_more']
-
-
-pool = Pool(5)
+    for call in api.iter_items(
+        'activity/call',
+        params={
+            'date_created__gte': day['start_date'],
+            'date_created__lte': day['end_date'],
+            '_fields': 'id,recording_url,voicemail_url,date_created,lead_id,duration,voicemail_duration,date_created',
+        },
+    ):
+        if (call['duration'] > 0 or call['voicemail_duration'] > 0) and (
+            call.get('recording_url') or call.get('voicemail_url')
+        ):
+            call['url'] = call.get('recording_url', call.get('voicemail_url'))
+            if call['duration'] > 0:
+                call['Type'] = 'Answered Call'
+                call['Answered or Voicemail Duration'] = call['duration']
+            else:
+                call['Type'] = 'Voicemail'
+                call['Answered or Voicemail Duration'] = call[
+                    'voicemail_duration'
+                ]
+            calls.append(call)
+
+
+pool = api.create_pool()
 pool.map(getRecordedCalls, days)
 
 # Sort all calls by date_created to be in order because they were pulled in parallel
@@ -137,7 +130,10 @@ def downloadCall(call):
         print(e)
 
 
-pool.map(downloadCall, calls)
+# Recordings are downloaded outside of the API client, so they don't go
+# through its rate limiter and need a pool of their own
+download_pool = create_pool(5)
+download_pool.map(downloadCall, calls)
 
 # Sort all downloaded calls by date_created to be in order because they were pulled in parallel
 downloaded_calls = sorted(
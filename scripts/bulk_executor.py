@@ -0,0 +1,148 @@
+import json
+import logging
+import random
+import time
+from datetime import datetime, timezone
+
+import requests
+from closeio_api import APIError
+
+# How many times an operation is attempted before it's reported as failed.
+# This is on top of the retries `CloseApiWrapper` already does for rate
+# limits and 503s within a single attempt.
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Methods whose operations are retried here. A POST that failed with a
+# timeout or a 5xx may still have gone through, so retrying it could create
+# a duplicate. POSTs are left to the wrapper's own retry policy.
+IDEMPOTENT_METHODS = ('put', 'delete')
+
+# Base delay (in seconds) between attempts of a failed operation, doubled
+# after every attempt.
+RETRY_DELAY = 2
+
+
+def is_transient_error(error):
+    """
+    Return whether a failed operation is worth retrying, i.e. it failed
+    because of the network or the server rather than because of the request.
+    """
+    if isinstance(error, APIError):
+        return (
+            error.response.status_code == 429
+            or error.response.status_code >= 500
+        )
+    return isinstance(
+        error,
+        (requests.exceptions.ConnectionError, requests.exceptions.Timeout),
+    )
+
+
+class BulkExecutor:
+    """
+    Runs a stream of `(method, endpoint, data)` write operations (e.g.
+    `('put', 'task/task_123', {'assigned_to': user_id})`) concurrently
+    through a `CloseApiWrapper`.
+
+    Operations are pulled from the stream as the pool has room for them, so
+    the stream can be a generator over a paginated resource. Concurrency is
+    governed by the wrapper's rate limiter, transient failures of idempotent
+    operations (see `IDEMPOTENT_METHODS`) are retried with an exponential
+    backoff and, in dry-run mode, nothing is sent at all. The outcome of
+    every operation is yielded as a dict (in completion order) and, if a
+    `journal` path is given, appended to it as a line of JSON:
+
+        {"method": "put", "endpoint": "task/task_123", "data": {...},
+         "status": "succeeded", "attempts": 1, "status_code": null,
+         "error": null, "date": "2021-01-01T00:00:00+00:00"}
+
+    `status` is one of `succeeded`, `failed` or `skipped` (dry run).
+    """
+
+    def __init__(
+        self,
+        api,
+        dry_run=False,
+        journal=None,
+        max_attempts=DEFAULT_MAX_ATTEMPTS,
+    ):
+        self.api = api
+        self.dry_run = dry_run
+        self.journal = journal
+        self.max_attempts = max_attempts
+
+    def _send(self, method, endpoint, data):
+        if method == 'delete':
+            return self.api.delete(endpoint)
+        return getattr(self.api, method)(endpoint, data)
+
+    def execute(self, operation):
+        """Run a single operation and return its outcome."""
+        method, endpoint, data = operation
+        method = method.lower()
+        result = {
+            'method': method,
+            'endpoint': endpoint,
+            'data': data,
+            'status': 'skipped',
+            'attempts': 0,
+            'status_code': None,
+            'error': None,
+        }
+        if self.dry_run:
+            return result
+
+        for attempt in range(1, self.max_attempts + 1):
+            result['attempts'] = attempt
+            try:
+                self._send(method, endpoint, data)
+            except (APIError, requests.exceptions.RequestException) as e:
+                if isinstance(e, APIError):
+                    result['status_code'] = e.response.status_code
+                result['error'] = str(e)
+                if (
+                    attempt == self.max_attempts
+                    or method not in IDEMPOTENT_METHODS
+                    or not is_transient_error(e)
+                ):
+                    result['status'] = 'failed'
+                    return result
+
+                sleep_time = (
+                    random.uniform(1, 2) * RETRY_DELAY * 2 ** (attempt - 1)
+                )
+                logging.debug(
+                    '%s %s failed (%s), retrying in %.1f seconds',
+                    method.upper(),
+                    endpoint,
+                    e,
+                    sleep_time,
+                )
+                time.sleep(sleep_time)
+            else:
+                result.update(status='succeeded', status_code=None, error=None)
+                return result
+
+    def run(self, operations):
+        """
+        Run all the `operations` and yield their outcomes as they complete.
+        Stopping the iteration early cancels the operations still pending,
+        and their outcomes are lost. To stop without losing any, end the
+        `operations` stream instead and keep iterating until the operations
+        in flight are done.
+        """
+        journal = open(self.journal, 'a') if self.journal else None
+        pool = self.api.create_pool()
+        try:
+            for result in pool.imap_unordered(self.execute, operations):
+                if journal:
+                    entry = dict(
+                        result, date=datetime.now(timezone.utc).isoformat()
+                    )
+                    journal.write(json.dumps(entry) + '\n')
+                    journal.flush()
+                yield result
+        finally:
+            pool.kill()
+            if journal:
+                journal.close()
@@ -3,8 +3,14 @@
 import argparse
 import logging
 
-from closeio_api import Client as CloseIO_API
+from scripts.runtime import bootstrap
 
+bootstrap()  # isort: split
+
+from scripts.CloseApiWrapper import CloseApiWrapper
+
+# Sorted by creation date, so that updating the leads doesn't reorder the
+# pages we're paginating through.
 LEADS_QUERY = '* sort:created'
 
 ISO_COUNTRIES = {
@@ -278,6 +284,10 @@ parser.add_argument(
     action='store_true',
     help='Without this flag, the script will do a dry run without actually updating any data.',
 )
+parser.add_argument(
+    '--journal',
+    help='Append the outcome of every update to this file as JSON lines.',
+)
 args = parser.parse_args()
 
 log_format = "[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s"
@@ -306,34 +316,25 @@ logging.info(
     )
 )
 
-api = CloseIO_API(args.api_key)
-has_more = True
-offset = 0
+api = CloseApiWrapper(args.api_key)
 
-while has_more:
-    resp = api.get(
-        'lead',
-        params={
-            'query': LEADS_QUERY,
-            '_skip': offset,
-            '_fields': 'id,addresses',
-        },
-    )
-
-    leads = resp['data']
 
-    for lead in leads:
+def get_operations():
+    for lead in api.iter_lead_slices(LEADS_QUERY, fields=['addresses']):
         need_update = False
         for address in lead['addresses']:
             if address['country'] == args.old_code:
                 address['country'] = args.new_code
                 need_update = True
         if need_update:
-            if args.confirmed:
-                api.put(
-                    'lead/' + lead['id'], data={'addresses': lead['addresses']}
-                )
-            logging.info('updated %s' % lead['id'])
+            yield 'put', 'lead/' + lead['id'], {'addresses': lead['addresses']}
+
 
-    offset += len(leads)
-    has_more = resp['has_more']
+for result in api.bulk_execute(
+    get_operations(), dry_run=not args.confirmed, journal=args.journal
+):
+    lead_id = result['endpoint'].split('/')[-1]
+    if result['status'] == 'failed':
+        logging.error('%s skipped with error %s' % (lead_id, result['error']))
+    else:
+        logging.info('updated %s' % lead_id)
@@ -4,12 +4,19 @@
 import argparse
 import csv
 import logging
+import os
 import re
 import sys
 
-from closeio_api import Client as CloseIO_API
 from dateutil.parser import parse as parse_date
 
+from scripts.runtime import bootstrap
+
+bootstrap()  # isort: split
+
+from scripts.checkpoint import Checkpoint
+from scripts.CloseApiWrapper import CloseApiWrapper
+
 OPPORTUNITY_FIELDS = [
     'opportunity%s_note',
     'opportunity%s_value',
@@ -19,6 +26,9 @@ OPPORTUNITY_FIELDS = [
     'opportunity%s_date_won',
 ]
 
+# Number of CSV rows whose leads are fetched ahead in one go.
+LEAD_BATCH_SIZE = 500
+
 
 def get_contact_info(contact_no, csv_row, what, contact_type):
     columns = [
@@ -78,7 +88,7 @@ custom columns (new custom field will be created if not exists):
 """,
 )
 
-parser.add_argument('csvfile', type=argparse.FileType('rU'), help='csv file')
+parser.add_argument('csvfile', type=argparse.FileType('r'), help='csv file')
 parser.add_argument('--api-key', '-k', required=True, help='API Key')
 parser.add_argument(
     '--confirmed',
@@ -104,6 +114,16 @@ parser.add_argument(
     action='store_true',
     help='Do not abort import after first error',
 )
+parser.add_argument(
+    '--resume',
+    action='store_true',
+    help='Continue from the checkpoint of a previous, interrupted run.',
+)
+parser.add_argument(
+    '--checkpoint-file',
+    default='bulk_update_leads_info.checkpoint.json',
+    help='Path to the file the progress of this run is saved to.',
+)
 args = parser.parse_args()
 
 log_format = "[%(asctime)s] %(levelname)s %(message)s"
@@ -138,7 +158,7 @@ header_row['Validation Error'] = 'Validation Error'
 
 error_array.append(header_row)
 
-api = CloseIO_API(args.api_key)
+api = CloseApiWrapper(args.api_key)
 org_id = api.get('me')['organizations'][0]['id']
 org = api.get('organization/' + org_id)
 org_name = org['name']
@@ -169,11 +189,80 @@ if new_custom_fieldnames:
 
 logging.debug('avaliable custom fields: %s' % available_custom_fieldnames)
 
-updated_leads = 0
-new_leads = 0
-skipped_leads = 0
+# Lead IDs of all the rows, so that the leads can be fetched in batches
+# ahead of the rows that update them.
+row_lead_ids = [r.get('lead_id') for r in c]
+args.csvfile.seek(0)
+c = csv.DictReader(args.csvfile, dialect=dialect)
+prefetched_leads = {}
+prefetched_until = 0
+
+checkpoint = Checkpoint(
+    args.checkpoint_file,
+    resume=args.resume,
+    fingerprint=os.path.abspath(args.csvfile.name),
+)
+updated_leads = checkpoint.data.get('updated_leads', 0)
+new_leads = checkpoint.data.get('new_leads', 0)
+skipped_leads = checkpoint.data.get('skipped_leads', 0)
+error_array = checkpoint.data.setdefault('error_array', error_array)
+if checkpoint.resumed:
+    logging.info(
+        'resuming after line %d of %s'
+        % (checkpoint.position or 1, args.csvfile.name)
+    )
+
 
-for r in c:
+def iter_rows():
+    """
+    Yield the rows that haven't been processed by a previous run, advancing
+    the position after each one. The position is saved every few seconds,
+    so a resumed run goes through the last rows again, but skips the writes
+    they already made (see `get_write_key`).
+    """
+    for row_num, r in enumerate(c):
+        if checkpoint.position and c.line_num <= checkpoint.position:
+            continue
+        yield row_num, r
+        checkpoint.data.update(
+            updated_leads=updated_leads,
+            new_leads=new_leads,
+            skipped_leads=skipped_leads,
+        )
+        checkpoint.set_position(c.line_num)
+
+
+def get_write_key(what):
+    """
+    Return the checkpoint key of a write of the current row, e.g. `12/lead`
+    or `12/note/0`.
+    """
+    return '%d/%s' % (c.line_num, what)
+
+
+def get_lead(lead_id, row_num):
+    """
+    Return the lead with the given ID, fetching the leads of the next
+    LEAD_BATCH_SIZE rows along with it. A prefetched lead is only handed
+    out once, so a lead updated by several rows is fetched again for the
+    later ones.
+    """
+    global prefetched_until
+    if row_num >= prefetched_until:
+        prefetched_until = row_num + LEAD_BATCH_SIZE
+        prefetched_leads.clear()
+        prefetched_leads.update(
+            api.get_by_ids('lead', row_lead_ids[row_num:prefetched_until])
+        )
+    lead = prefetched_leads.pop(lead_id, None)
+    if lead is None:
+        # Not found in the batch, let the API tell us why.
+        lead = api.get('lead/%s' % lead_id)
+    return lead
+
+
+stopped_on_error = False
+for row_num, r in iter_rows():
     payload = {}
 
     # Skip all-empty rows
@@ -269,9 +358,21 @@ for r in c:
 
     try:
         lead = None
-        if r.get('lead_id') is not None:
+        # The lead was already written by a previous run.
+        written = checkpoint.get_result(get_write_key('lead'))
+        if written:
+            lead = {'id': written['id']}
+            logging.info(
+                'line %d already written: %s' % (c.line_num, written['id'])
+            )
+            if written['new']:
+                new_leads += 1
+            else:
+                updated_leads += 1
+
+        elif r.get('lead_id') is not None:
             # exists lead
-            resp = api.get('lead/%s' % r['lead_id'])
+            resp = get_lead(r['lead_id'], row_num)
             logging.debug('received: %s' % resp)
             lead = resp
 
@@ -318,7 +419,7 @@ for r in c:
             if resp['total_results']:
                 lead = resp['data'][0]
 
-        if lead:
+        if lead and not written:
             logging.debug('to sent: %s' % payload)
             if args.confirmed:
                 if len(multi_select_fields) > 0 and lead.get('custom'):
@@ -330,6 +431,10 @@ for r in c:
                                 lead['custom'][key] + payload['custom.' + key]
                             )
                 api.put('lead/' + lead['id'], data=payload)
+                checkpoint.mark_completed(
+                    get_write_key('lead'),
+                    result={'id': lead['id'], 'new': False},
+                )
             logging.info(
                 'line %d updated: %s %s'
                 % (
@@ -344,6 +449,10 @@ for r in c:
             logging.debug('to sent: %s' % payload)
             if args.confirmed:
                 lead = api.post('lead', data=payload)
+                checkpoint.mark_completed(
+                    get_write_key('lead'),
+                    result={'id': lead['id'], 'new': True},
+                )
                 logging.info(
                     'line %d new: %s %s'
                     % (
@@ -380,11 +489,13 @@ for r in c:
             continue
 
         notes = [r[x] for x in r.keys() if re.match(r'note[0-9]', x) and r[x]]
-        for note in notes:
-            if args.confirmed:
+        for note_num, note in enumerate(notes):
+            note_key = get_write_key('note/%d' % note_num)
+            if args.confirmed and not checkpoint.is_completed(note_key):
                 resp = api.post(
                     'activity/note', data={'note': note, 'lead_id': lead['id']}
                 )
+                checkpoint.mark_completed(note_key)
             logging.debug(
                 '%s new note: %s'
                 % (lead['id'] if args.confirmed else 'X', note.decode('utf-8'))
@@ -428,8 +539,10 @@ for r in c:
                     # 'date_won': str(parse_date(r['opportunity%s_date_won' % i])) if 'opportunity%s_date_won' % i in r else None
                     # 'date_won': str(datetime.datetime.strptime(r['opportunity%s_date_won' % i], '%d/%m/%y')),
                 }
-                if args.confirmed:
+                opp_key = get_write_key('opportunity/%s' % i)
+                if args.confirmed and not checkpoint.is_completed(opp_key):
                     api.post('opportunity', data=opp_payload)
+                    checkpoint.mark_completed(opp_key)
             else:
                 logging.error(
                     'line %d is not a fully filled opportunity %s, skipped'
@@ -439,11 +552,12 @@ for r in c:
     except Exception as e:
         logging.error('line %d skipped with error %s' % (c.line_num, e))
         skipped_leads += 1
-        r['Validation Error'] = e
+        r['Validation Error'] = str(e)
         error_array.append(r)
         if not args.continue_on_error:
             logging.info('stopped on error')
-            sys.exit(1)
+            stopped_on_error = True
+            break
 
 logging.info(
     'summary: updated[%d], new[%d], skipped[%d]'
@@ -461,3 +575,10 @@ if len(error_array) > 1:
         writer.writerows(error_array)
     finally:
         f.close()
+
+if stopped_on_error:
+    # The state file is kept (saved here up to the last processed row), so
+    # that --resume retries the row that failed.
+    checkpoint.save()
+    sys.exit(1)
+checkpoint.finish()
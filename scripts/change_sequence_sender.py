@@ -1,6 +1,10 @@
 import argparse
 
-from closeio_api import APIError, Client as CloseIO_API
+from scripts.runtime import bootstrap
+
+bootstrap()  # isort: split
+
+from scripts.CloseApiWrapper import CloseApiWrapper
 
 parser = argparse.ArgumentParser(
     description='Change sequence sender for specific user'
@@ -31,59 +35,51 @@ parser.add_argument(
     required=True,
     help='Sender name you want to use to send sequence',
 )
+parser.add_argument(
+    '--journal',
+    help='Append the outcome of every update to this file as JSON lines.',
+)
 
 args = parser.parse_args()
-api = CloseIO_API(args.api_key)
+api = CloseApiWrapper(args.api_key)
 
 from_subs = []
 
 print("Getting sequences")
-sequences = []
-has_more = True
-offset = 0
-while has_more:
-    resp = api.get(
-        'sequence',
-        params={'_skip': offset},
-    )
-    sequences.extend(resp['data'])
-    offset += len(resp['data'])
-    has_more = resp['has_more']
+sequences = api.get_all_items('sequence')
 
 for sequence in sequences:
     print(f"Getting sequence subscriptions for `{sequence['name']}`")
-    has_more = True
     offset = 0
-    while has_more:
-        sub_results = api.get(
-            'sequence_subscription',
-            params={'_skip': offset, 'sequence_id': sequence['id']},
-        )
+    for page in api.iter_pages(
+        'sequence_subscription', params={'sequence_id': sequence['id']}
+    ):
         from_subs += [
             i
-            for i in sub_results['data']
+            for i in page
             if i['sender_email'] == args.from_email
             and i['status'] in ['active', 'paused', 'error', 'goal']
         ]
-        offset += len(sub_results['data'])
-        has_more = sub_results['has_more']
+        offset += len(page)
         print(offset)
 
 print(f"Total subscriptions: {len(from_subs)}")
 print("Updating subscriptions")
 
+sender = {
+    'sender_name': args.sender_name,
+    'sender_account_id': args.sender_account_id,
+    'sender_email': args.to_email,
+}
+operations = (
+    ('put', f"sequence_subscription/{sub['id']}", sender) for sub in from_subs
+)
+
 count = 0
-for sub in from_subs:
-    try:
-        api.put(
-            f"sequence_subscription/{sub['id']}",
-            data={
-                'sender_name': args.sender_name,
-                'sender_account_id': args.sender_account_id,
-                'sender_email': args.to_email,
-            },
-        )
+for result in api.bulk_execute(operations, journal=args.journal):
+    sub_id = result['endpoint'].split('/')[-1]
+    if result['status'] == 'failed':
+        print(f"Can't update sequence {sub_id} because {result['error']}")
+    else:
         count += 1
-        print(f"{count}: {sub['id']}")
-    except APIError as e:
-        print(f"Can't update sequence {sub['id']} because {str(e)}")
+        print(f"{count}: {sub_id}")
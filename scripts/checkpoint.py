@@ -0,0 +1,210 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+# Minimum number of seconds between two saves of the state file.
+DEFAULT_SAVE_INTERVAL = 10
+
+
+class CheckpointMismatchError(Exception):
+    """Raised when resuming from a state file written for other inputs."""
+
+
+class Checkpoint:
+    """
+    Progress of a long-running scan or mutation, persisted to a local JSON
+    state file so that an interrupted run can be resumed where it left off.
+
+    The state consists of a `position` (e.g. the pagination params of the
+    next page, or the last processed line of a CSV file), the set of
+    `completed` keys (e.g. the IDs of the objects already processed, or of
+    the writes already sent) along with an optional result of each, and a
+    `data` dict for anything else the script needs to carry over (e.g.
+    counters or the rows collected so far). Everything must be JSON
+    serializable.
+
+    Completed keys are appended to a journal file next to the state file as
+    soon as they're marked, so that a resumed run never repeats a write. The
+    state file (position and data included) is written at most every
+    `save_interval` seconds when the progress changes, which starts a new
+    journal, and both are removed by `finish()` once the run has completed.
+    `fingerprint` identifies the inputs of a run (e.g. the CSV file name),
+    so that a run isn't accidentally resumed with different inputs.
+
+    Changes and saves are serialized with a lock, so that workers of a pool
+    can mark their keys completed concurrently.
+    """
+
+    def __init__(
+        self,
+        path,
+        resume=False,
+        fingerprint=None,
+        save_interval=DEFAULT_SAVE_INTERVAL,
+    ):
+        self.path = path
+        self.journal_path = f'{path}.journal'
+        self.fingerprint = fingerprint
+        self.save_interval = save_interval
+        self.position = None
+        self.completed = set()
+        self.results = {}
+        self.data = {}
+        self.resumed = False
+        self._journal = None
+        self._last_save = time.monotonic()
+        # Reentrant, since the changes save the state while holding it.
+        self._lock = threading.RLock()
+
+        exists = os.path.exists(path) or os.path.exists(self.journal_path)
+        if resume and exists:
+            self._load()
+            # Start a new journal, rather than appending to one that may end
+            # with a change cut short by the interruption.
+            self.save()
+        elif exists:
+            logging.warning(
+                'Starting over, %s will be overwritten. Use --resume to '
+                'continue from it instead.',
+                path,
+            )
+            self._remove()
+
+    def _check_fingerprint(self, path, fingerprint):
+        if fingerprint != self.fingerprint:
+            raise CheckpointMismatchError(
+                f'{path} was written for {fingerprint}, '
+                f'not for {self.fingerprint}'
+            )
+
+    def _load(self):
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                state = json.load(f)
+            self._check_fingerprint(self.path, state.get('fingerprint'))
+            self.position = state['position']
+            self.completed = set(state['completed'])
+            self.results = dict(state.get('results', []))
+            self.data = state['data']
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path) as f:
+                for i, line in enumerate(f):
+                    try:
+                        change = json.loads(line)
+                    except ValueError:
+                        # Cut short by the interruption.
+                        break
+                    if i == 0:
+                        self._check_fingerprint(
+                            self.journal_path, change.get('fingerprint')
+                        )
+                    else:
+                        self._apply(**change)
+        self.resumed = True
+
+    def _apply(self, completed, result=None, data=None):
+        self.completed.add(completed)
+        if result is not None:
+            self.results[completed] = result
+        if data:
+            self.data.update(data)
+
+    def _record(self, **change):
+        """Apply `change` and append it to the journal."""
+        with self._lock:
+            self._apply(**change)
+            if self._journal is None:
+                self._journal = open(self.journal_path, 'w')
+                self._write_journal({'fingerprint': self.fingerprint})
+            self._write_journal(change)
+
+    def _write_journal(self, change):
+        self._journal.write(json.dumps(change) + '\n')
+        self._journal.flush()
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def is_completed(self, key):
+        return key in self.completed
+
+    def get_result(self, key):
+        """Return the result `key` was marked completed with, if any."""
+        return self.results.get(key)
+
+    def mark_completed(self, key, count=None, result=None):
+        """
+        Mark `key` as completed, with the `result` of its processing if
+        later steps need it (e.g. the ID of an object created by a write).
+        With `count`, the `data[count]` counter is incremented along with
+        it, and its new value returned.
+        """
+        with self._lock:
+            change = {'completed': key}
+            if result is not None:
+                change['result'] = result
+            value = None
+            if count is not None:
+                value = self.data.get(count, 0) + 1
+                change['data'] = {count: value}
+            self._record(**change)
+            self.maybe_save()
+            return value
+
+    def set_position(self, position):
+        with self._lock:
+            self.position = position
+            self.maybe_save()
+
+    def maybe_save(self):
+        with self._lock:
+            if time.monotonic() - self._last_save >= self.save_interval:
+                self.save()
+
+    def save(self):
+        with self._lock:
+            state = {
+                'fingerprint': self.fingerprint,
+                'position': self.position,
+                'completed': list(self.completed),
+                # Pairs, since JSON objects can only have string keys.
+                'results': list(self.results.items()),
+                'data': self.data,
+            }
+            # Write to a temporary file first, so that an interruption while
+            # saving doesn't leave a truncated state file behind.
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(self.path)),
+                prefix=f'{os.path.basename(self.path)}.',
+                suffix='.tmp',
+            )
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(state, f)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            # Everything in the journal is in the state file now. Replaying
+            # it on top of the state file is harmless, so being interrupted
+            # before it's removed is too.
+            self._close_journal()
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self._last_save = time.monotonic()
+
+    def _remove(self):
+        self._close_journal()
+        for path in (self.path, self.journal_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def finish(self):
+        """Mark the run as completed by removing its state files."""
+        with self._lock:
+            self._remove()
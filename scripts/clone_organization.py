@@ -1,5 +1,9 @@
 import argparse
 
+from scripts.runtime import bootstrap
+
+bootstrap()  # isort: split
+
 from closeio_api import APIError
 
 from scripts.CloseApiWrapper import CloseApiWrapper
@@ -181,7 +185,7 @@ if args.custom_objects or args.all:
     # create all objects first
     for object_type in custom_object_types:
         if object_type['editable_with_roles']:
-            new_roles = to_api.get('role')['data']
+            new_roles = to_api.get_roles()
             new_editable_with_roles = []
             for old_role_id in object_type['editable_with_roles']:
                 if old_role_id.startswith('role_'):
@@ -367,7 +371,7 @@ if args.roles or args.all:
     ]
 
     print("\nCopying Roles")
-    roles = from_api.get_all_items('role')
+    roles = from_api.get_roles()
     for role in roles:
         if role["name"] in BUILT_IN_ROLES:
             continue
@@ -383,7 +387,7 @@ if args.roles or args.all:
 
 if args.templates or args.email_templates or args.all:
     print("\nCopying Email Templates")
-    templates = from_api.get_all_items('email_template')
+    templates = from_api.get_email_templates()
     for template in templates:
         del template["id"]
         del template["organization_id"]
@@ -396,7 +400,7 @@ if args.templates or args.email_templates or args.all:
 
 if args.templates or args.sms_templates or args.all:
     print("\nCopying SMS Templates")
-    templates = from_api.get_all_items('sms_template')
+    templates = from_api.get_sms_templates()
     for template in templates:
         del template["id"]
         del template["organization_id"]
@@ -408,11 +412,11 @@ if args.templates or args.sms_templates or args.all:
             print(f"Couldn't add `{template['name']}` because {str(e)}")
 
 # Assumes all the workflow steps (templates) were already transferred over
-if args.sequences or args.workflows or args.all:
+if args.sequences or args.all:
     print("\nCopying Workflows")
 
-    to_email_templates = to_api.get_all_items('email_template')
-    to_sms_templates = to_api.get_all_items('sms_template')
+    to_email_templates = to_api.get_email_templates()
+    to_sms_templates = to_api.get_sms_templates()
     from_workflows = from_api.get_all_items('sequence')
     for workflow in from_workflows:
         steps = workflow["steps"]
@@ -468,11 +472,11 @@ if args.custom_activities or args.all:
     # Get the existing shared custom fields in case the new org already has them
     to_shared_custom_fields = to_api.get_all_items('custom_field/shared')
 
-    custom_activity_types = from_api.get("custom_activity")["data"]
+    custom_activity_types = from_api.get_custom_activity_types()
     for activity_type in custom_activity_types:
         # Re-map old role IDs to new role IDs (by name)
         if activity_type['editable_with_roles']:
-            new_roles = to_api.get('role')['data']
+            new_roles = to_api.get_roles()
             new_editable_with_roles = []
             for old_role_id in activity_type['editable_with_roles']:
                 if old_role_id.startswith('role_'):
@@ -563,7 +567,7 @@ if args.custom_activities or args.all:
 
 if args.groups or args.groups_with_members or args.all:
     print("\nCopying Groups")
-    groups = from_api.get('group')['data']
+    groups = from_api.get_groups()
     for group in groups:
         group = from_api.get(f'group/{group["id"]}', params={'_fields': 'name,members'})
 
@@ -620,8 +624,8 @@ if args.smart_views or args.all:
         map_from_to_id = {}
 
         # Custom Activity Types
-        from_custom_activities = from_api.get("custom_activity")["data"]
-        to_custom_activities = to_api.get("custom_activity")["data"]
+        from_custom_activities = from_api.get_custom_activity_types()
+        to_custom_activities = to_api.get_custom_activity_types()
         for from_ca in from_custom_activities:
             to_ca = next(
                 (x for x in to_custom_activities if x['name'] == from_ca['name']),
@@ -638,7 +642,7 @@ if args.smart_views or args.all:
                 'opportunity',
             ]
             custom_activity_type_ids = [
-                x['id'] for x in api.get("custom_activity")["data"]
+                x['id'] for x in api.get_custom_activity_types()
             ]
 
             custom_fields = []
@@ -692,8 +696,8 @@ if args.smart_views or args.all:
                 map_from_to_id[from_status['id']] = to_status['id']
 
         # Email templates
-        from_templates = from_api.get_all_items('email_template')
-        to_templates = to_api.get_all_items('email_template')
+        from_templates = from_api.get_email_templates()
+        to_templates = to_api.get_email_templates()
         for from_template in from_templates:
             to_template = next(
                 (x for x in to_templates if x['name'] == from_template['name']),
@@ -703,8 +707,8 @@ if args.smart_views or args.all:
                 map_from_to_id[from_template['id']] = to_template['id']
 
         # SMS templates
-        from_templates = from_api.get_all_items('sms_template')
-        to_templates = to_api.get_all_items('sms_template')
+        from_templates = from_api.get_sms_templates()
+        to_templates = to_api.get_sms_templates()
         for from_template in from_templates:
             to_template = next(
                 (x for x in to_templates if x['name'] == from_template['name']),
@@ -725,8 +729,8 @@ if args.smart_views or args.all:
                 map_from_to_id[from_workflow['id']] = to_workflow['id']
 
         # Groups
-        from_groups = from_api.get('group', params={'_fields': 'id,name'})['data']
-        to_groups = to_api.get('group', params={'_fields': 'id,name'})['data']
+        from_groups = from_api.get_groups()
+        to_groups = to_api.get_groups()
         for from_group in from_groups:
             to_group = next(
                 (x for x in to_groups if x['name'] == from_group['name']),
@@ -769,12 +773,8 @@ if args.smart_views or args.all:
     reverse = list(reversed(from_smart_views))
 
 
-    def get_memberships(api, organization):
-        resp = api.get(f"organization/{organization['id']}", params={"_fields": "memberships,inactive_memberships"})
-        return resp["memberships"] + resp["inactive_memberships"]
-
-    from_memberships = get_memberships(from_api, from_organization)
-    to_memberships = get_memberships(to_api, to_organization)
+    from_memberships = from_api.get_memberships(include_inactive=True)
+    to_memberships = to_api.get_memberships(include_inactive=True)
     from_to_membership_id = {}
     for from_membership in from_memberships:
         to_membership = next((x for x in to_memberships if x['user_email'] == from_membership['user_email']), None)
@@ -0,0 +1,139 @@
+"""
+Canonical keys for email addresses and phone numbers, so that the duplicate
+finders match "John.Doe+news@GMail.com" with "johndoe@gmail.com", and
+"+1 (650) 555-1234" with "16505551234".
+
+Phone numbers are turned into E.164 with the phonenumbers library when it's
+installed (`pip install phonenumbers`). Otherwise a simpler parser handles
+international numbers and the national numbers of `REGION_CALLING_CODES`.
+Numbers without a country code are read as numbers of the default region,
+`CLOSE_API_PHONE_REGION` (`US` if not set).
+
+The same addresses and numbers come up many times across an org's contacts,
+so `KeyCanonicalizer` computes the key of every distinct value only once.
+"""
+import os
+import re
+
+try:
+    import phonenumbers
+except ImportError:
+    phonenumbers = None
+
+DEFAULT_PHONE_REGION = os.environ.get('CLOSE_API_PHONE_REGION', 'US')
+
+# Calling code, national trunk prefix and maximum length of a national
+# number (without the trunk prefix) of the regions the fallback parser knows
+# about. Longer numbers that start with the calling code already have it.
+REGION_CALLING_CODES = {
+    'US': ('1', '', 10),
+    'CA': ('1', '', 10),
+    'GB': ('44', '0', 10),
+    'IE': ('353', '0', 9),
+    'AU': ('61', '0', 9),
+    'NZ': ('64', '0', 10),
+    'DE': ('49', '0', 11),
+    'AT': ('43', '0', 13),
+    'CH': ('41', '0', 9),
+    'FR': ('33', '0', 9),
+    'NL': ('31', '0', 9),
+    'BE': ('32', '0', 9),
+    'ES': ('34', '', 9),
+    'IT': ('39', '', 11),
+    'PL': ('48', '', 9),
+    'SE': ('46', '0', 9),
+    'IN': ('91', '0', 10),
+    'BR': ('55', '0', 11),
+    'MX': ('52', '', 10),
+}
+
+# Domains where dots in the local part of an address don't matter, and the
+# domain they're an alias of.
+DOTLESS_EMAIL_DOMAINS = {
+    'gmail.com': 'gmail.com',
+    'googlemail.com': 'gmail.com',
+}
+
+_PHONE_EXTENSION = re.compile(r'(?:ext\.?|extension|x|#|;ext=).*$', re.I)
+_NON_DIGIT = re.compile(r'\D')
+
+
+def canonicalize_email(email):
+    """
+    Return the canonical form of an email address: lowercased, without a
+    `+tag`, and for Gmail without dots in the local part.
+    """
+    email = email.strip().lower()
+    local, at, domain = email.rpartition('@')
+    if not at or not local:
+        return email
+    local = local.split('+', 1)[0] or local
+    if domain in DOTLESS_EMAIL_DOMAINS:
+        local = local.replace('.', '')
+        domain = DOTLESS_EMAIL_DOMAINS[domain]
+    return f'{local}@{domain}'
+
+
+def _canonicalize_phone_fallback(phone, region):
+    phone = _PHONE_EXTENSION.sub('', phone.strip())
+    digits = _NON_DIGIT.sub('', phone)
+    if not digits:
+        return phone
+    if phone.startswith('+'):
+        return f'+{digits}'
+    if digits.startswith('00'):
+        return f'+{digits[2:]}'
+    if region not in REGION_CALLING_CODES:
+        return digits
+    calling_code, trunk_prefix, max_length = REGION_CALLING_CODES[region]
+    if calling_code == '1':
+        # North American numbers have 10 digits, and may be dialed with
+        # the leading 1. Anything else isn't a number of the region.
+        if len(digits) == 11 and digits[0] == '1':
+            return f'+{digits}'
+        return f'+1{digits}' if len(digits) == 10 else digits
+    if digits.startswith(calling_code) and len(digits) > max_length:
+        # E.g. "34 612 345 678", written with the calling code but no `+`.
+        return f'+{digits}'
+    if trunk_prefix and digits.startswith(trunk_prefix):
+        digits = digits[len(trunk_prefix) :]
+    return f'+{calling_code}{digits}'
+
+
+def canonicalize_phone(phone, region=DEFAULT_PHONE_REGION):
+    """
+    Return a phone number in E.164 (e.g. `+16505551234`), reading numbers
+    without a country code as numbers of `region`. Numbers that can't be
+    parsed are returned as they are, without surrounding whitespace.
+    """
+    if phonenumbers is None:
+        return _canonicalize_phone_fallback(phone, region)
+    try:
+        number = phonenumbers.parse(phone, region)
+    except phonenumbers.NumberParseException:
+        return phone.strip()
+    return phonenumbers.format_number(
+        number, phonenumbers.PhoneNumberFormat.E164
+    )
+
+
+class KeyCanonicalizer:
+    """
+    Memoizing wrapper of a canonicalization function (`canonicalize_email`
+    or `canonicalize_phone`), which calls the function once per distinct
+    value, however many times the value comes up.
+    """
+
+    def __init__(self, func, **kwargs):
+        self._func = func
+        self._kwargs = kwargs
+        self._keys = {}
+
+    def __call__(self, value):
+        key = self._keys.get(value)
+        if key is None:
+            key = self._keys[value] = self._func(value, **self._kwargs)
+        return key
+
+    def __len__(self):
+        return len(self._keys)
@@ -0,0 +1,359 @@
+"""
+Duplicate detection for large sets of leads (see `find_duplicate_leads`).
+
+`DuplicateIndex` takes the leads one at a time, as they're fetched, and
+indexes every lead under its match keys (lowercased lead name, contact
+names, email addresses, phone numbers, URL host name or a custom field
+value) in one dict per field. A key shared by two leads makes them
+duplicates, and leads that share any key, directly or through other leads,
+end up in the same cluster. Indexing is a dict lookup per key and clusters
+are kept in a union-find structure, so the whole thing is linear in the
+number of leads and keys, however large the groups of duplicates get.
+
+Email addresses and phone numbers are matched on their canonical form (see
+`scripts.contact_keys`). With `fuzzy_fields`, lead or contact names are
+normalized more thoroughly and names that are merely similar are matched
+too (see `scripts.fuzzy`). The index can be kept on disk and updated with
+the leads that changed (see `scripts.dedupe_store`).
+
+The leads can be anything with the attributes of `scripts.records.LeadRecord`.
+"""
+from collections import defaultdict
+from operator import attrgetter
+from urllib.parse import urlsplit
+
+from scripts.contact_keys import (
+    DEFAULT_PHONE_REGION,
+    KeyCanonicalizer,
+    canonicalize_email,
+    canonicalize_phone,
+)
+from scripts.fuzzy import COMPANY_STOP_WORDS, FuzzyMatcher, normalize_name
+
+# Fields leads can be matched on, in the order the reports are written.
+MATCH_FIELDS = (
+    'lead_name',
+    'custom',
+    'email',
+    'contact_name',
+    'phone',
+    'url',
+)
+
+# Fields that can be matched fuzzily.
+FUZZY_FIELDS = ('lead_name', 'contact_name')
+
+_by_date_created = attrgetter('date_created')
+
+
+def _get_lead_name_keys(lead):
+    return (lead.display_name.strip().lower(),)
+
+
+def _get_contact_name_keys(lead):
+    return [name.strip().lower() for name in lead.contact_names]
+
+
+def _get_normalized_lead_name_keys(lead):
+    return (normalize_name(lead.display_name, COMPANY_STOP_WORDS),)
+
+
+def _get_normalized_contact_name_keys(lead):
+    return [normalize_name(name) for name in lead.contact_names]
+
+
+def _get_url_keys(lead):
+    if not lead.url:
+        return ()
+    # No host name for URLs without a scheme.
+    host_name = urlsplit(lead.url).hostname
+    return (host_name.lower(),) if host_name else ()
+
+
+def _make_email_keys_getter(canonicalize):
+    def _get_email_keys(lead):
+        return [canonicalize(email) for email in lead.emails]
+
+    return _get_email_keys
+
+
+def _make_phone_keys_getter(canonicalize):
+    def _get_phone_keys(lead):
+        return [canonicalize(phone) for phone in lead.phones]
+
+    return _get_phone_keys
+
+
+def _make_custom_keys_getter(custom_field_name):
+    def _get_custom_keys(lead):
+        value = (lead.custom or {}).get(custom_field_name)
+        if isinstance(value, list):
+            value = ','.join(value)
+        return (value,)
+
+    return _get_custom_keys
+
+
+KEY_GETTERS = {
+    'lead_name': _get_lead_name_keys,
+    'contact_name': _get_contact_name_keys,
+    'url': _get_url_keys,
+}
+
+FUZZY_KEY_GETTERS = {
+    'lead_name': _get_normalized_lead_name_keys,
+    'contact_name': _get_normalized_contact_name_keys,
+}
+
+
+class UnionFind:
+    """
+    Disjoint sets of hashable items, with path halving and union by size.
+    Items are added by the first `union` they're part of.
+    """
+
+    def __init__(self):
+        self._parent = {}
+        self._size = {}
+
+    def __contains__(self, item):
+        return item in self._parent
+
+    def find(self, item):
+        """Return the representative of the set `item` belongs to."""
+        parent = self._parent
+        if item not in parent:
+            return item
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, a, b):
+        for item in (a, b):
+            if item not in self._parent:
+                self._parent[item] = item
+                self._size[item] = 1
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if self._size[a] < self._size[b]:
+            a, b = b, a
+        self._parent[b] = a
+        self._size[a] += self._size.pop(b)
+
+    def groups(self):
+        """Return the sets of more than one item, as lists."""
+        groups = defaultdict(list)
+        for item in self._parent:
+            groups[self.find(item)].append(item)
+        return list(groups.values())
+
+
+class DuplicateIndex:
+    """
+    Index of leads by their match keys for the given `fields` (see
+    `MATCH_FIELDS`), built with one `add()` per lead. Matching on `custom`
+    needs the `custom_field_name` to compare.
+
+    Phone numbers without a country code are read as numbers of the
+    `phone_region`.
+
+    The `fuzzy_fields` (see `FUZZY_FIELDS`) are matched with the
+    `fuzzy_matcher` once all the leads are added. Their keys are merged
+    with the keys they're similar to, and reported under the key with the
+    most leads.
+    """
+
+    def __init__(
+        self,
+        fields,
+        custom_field_name=None,
+        fuzzy_fields=(),
+        fuzzy_matcher=None,
+        phone_region=DEFAULT_PHONE_REGION,
+    ):
+        unknown = set(fields) - set(MATCH_FIELDS)
+        if unknown:
+            raise ValueError(
+                f'Unknown match fields: {", ".join(sorted(unknown))}'
+            )
+        if 'custom' in fields and not custom_field_name:
+            raise ValueError('Matching on `custom` needs a custom field name')
+        not_fuzzy = set(fuzzy_fields) - set(FUZZY_FIELDS)
+        if not_fuzzy:
+            raise ValueError(
+                f'Can\'t match fuzzily on: {", ".join(sorted(not_fuzzy))}'
+            )
+
+        self.fields = tuple(field for field in MATCH_FIELDS if field in fields)
+        self.custom_field_name = custom_field_name
+        self.phone_region = phone_region
+        self.fuzzy_fields = tuple(
+            field for field in self.fields if field in fuzzy_fields
+        )
+        self.fuzzy_matcher = fuzzy_matcher or FuzzyMatcher()
+        # Number of pairs of keys scored by the fuzzy matcher, and of blocks
+        # it skipped for being too large, by field.
+        self.candidate_pairs = {}
+        self.skipped_blocks = {}
+        self.lead_count = 0
+        # Contacts share a lot of addresses and numbers (e.g. a company's
+        # main line), which are only canonicalized once.
+        self.canonical_emails = KeyCanonicalizer(canonicalize_email)
+        self.canonical_phones = KeyCanonicalizer(
+            canonicalize_phone, region=phone_region
+        )
+        self._key_getters = [
+            (field, self._get_key_getter(field, custom_field_name), {})
+            for field in self.fields
+        ]
+        self._indexes = {field: index for field, _, index in self._key_getters}
+        self._clusters = UnionFind()
+        # Representative key of every fuzzily matched key, and the leads of
+        # every representative key, by field. Computed once all the leads
+        # are added.
+        self._fuzzy_keys = None
+        self._fuzzy_groups = None
+
+    def _get_key_getter(self, field, custom_field_name):
+        if field == 'custom':
+            return _make_custom_keys_getter(custom_field_name)
+        if field == 'email':
+            return _make_email_keys_getter(self.canonical_emails)
+        if field == 'phone':
+            return _make_phone_keys_getter(self.canonical_phones)
+        if field in self.fuzzy_fields:
+            return FUZZY_KEY_GETTERS[field]
+        return KEY_GETTERS[field]
+
+    def add(self, lead):
+        """Index `lead` under all its (non-empty) keys."""
+        self.lead_count += 1
+        self._fuzzy_keys = self._fuzzy_groups = None
+        for _, get_keys, index in self._key_getters:
+            # A lead is listed once per key, however many of its contacts
+            # share it.
+            for key in set(get_keys(lead)):
+                if not key:
+                    continue
+                group = index.get(key)
+                if group is None:
+                    index[key] = [lead]
+                else:
+                    group.append(lead)
+                    self._clusters.union(group[0], lead)
+
+    def add_all(self, leads):
+        for lead in leads:
+            self.add(lead)
+        return self
+
+    def get_keys(self, lead):
+        """
+        Return the distinct (non-empty) keys `lead` is indexed under, as
+        `(field, key)` pairs. Fuzzy fields are listed with their normalized
+        names, before any fuzzy matching.
+        """
+        return [
+            (field, key)
+            for field, get_keys, _ in self._key_getters
+            for key in set(get_keys(lead))
+            if key
+        ]
+
+    def iter_leads(self):
+        """Yield every indexed lead (i.e. with at least one key) once."""
+        seen = set()
+        for _, _, index in self._key_getters:
+            for group in index.values():
+                for lead in group:
+                    if lead.id not in seen:
+                        seen.add(lead.id)
+                        yield lead
+
+    def _match_fuzzy(self):
+        """
+        Merge the keys of the fuzzy fields with the keys they're similar
+        to, and the clusters of their leads.
+        """
+        if self._fuzzy_keys is not None:
+            return
+        self._fuzzy_keys, self._fuzzy_groups = {}, {}
+        for field in self.fuzzy_fields:
+            index = self._indexes[field]
+            similar = UnionFind()
+            matcher = self.fuzzy_matcher
+            compared, skipped = matcher.candidate_pairs, matcher.skipped_blocks
+            for a, b in matcher.iter_similar_pairs(index):
+                similar.union(a, b)
+            self.candidate_pairs[field] = matcher.candidate_pairs - compared
+            self.skipped_blocks[field] = matcher.skipped_blocks - skipped
+
+            fuzzy_keys, fuzzy_groups = {}, {}
+            for keys in similar.groups():
+                representative = max(
+                    keys, key=lambda key: (len(index[key]), key)
+                )
+                # A lead can have several of the similar keys.
+                leads = list(
+                    dict.fromkeys(lead for key in keys for lead in index[key])
+                )
+                for key in keys:
+                    fuzzy_keys[key] = representative
+                fuzzy_groups[representative] = leads
+                for lead in leads[1:]:
+                    self._clusters.union(leads[0], lead)
+            self._fuzzy_keys[field] = fuzzy_keys
+            self._fuzzy_groups[field] = fuzzy_groups
+
+    def _iter_groups(self, field):
+        """Yield every key of `field` with the leads sharing it."""
+        self._match_fuzzy()
+        fuzzy_keys = self._fuzzy_keys.get(field, {})
+        yield from self._fuzzy_groups.get(field, {}).items()
+        for key, group in self._indexes[field].items():
+            if key not in fuzzy_keys:
+                yield key, group
+
+    def _get_group_size(self, field, key):
+        self._match_fuzzy()
+        fuzzy_key = self._fuzzy_keys.get(field, {}).get(key)
+        if fuzzy_key is not None:
+            return len(self._fuzzy_groups[field][fuzzy_key])
+        return len(self._indexes[field].get(key) or ())
+
+    def get_duplicates(self, field):
+        """
+        Return a dict of the keys of `field` shared by more than one lead,
+        with the leads sharing each key, oldest first.
+        """
+        return {
+            key: sorted(group, key=_by_date_created)
+            for key, group in self._iter_groups(field)
+            if len(group) > 1
+        }
+
+    def get_matched_fields(self, lead):
+        """Return the fields on which `lead` has a duplicate."""
+        return [
+            field
+            for field, get_keys, _ in self._key_getters
+            if any(
+                self._get_group_size(field, key) > 1 for key in get_keys(lead)
+            )
+        ]
+
+    def get_clusters(self):
+        """
+        Return the clusters of leads that are duplicates of each other on
+        any of the fields (directly, or through other leads of the cluster),
+        each oldest lead first, largest clusters first.
+        """
+        self._match_fuzzy()
+        clusters = [
+            sorted(group, key=_by_date_created)
+            for group in self._clusters.groups()
+        ]
+        clusters.sort(key=lambda cluster: (-len(cluster), cluster[0].id))
+        return clusters
@@ -0,0 +1,313 @@
+"""
+Persistent duplicate index (see `find_duplicate_leads --index`), so that
+the runs after the first one only look at the leads that changed since the
+previous run.
+
+`DuplicateStore` keeps the leads that have match keys, every key of every
+lead and the cluster of every lead with duplicates in an SQLite database,
+along with the watermark of the last run. An update takes the leads updated
+since the watermark and the IDs of the leads deleted since, replaces their
+keys, and recomputes only the clusters they were or are now part of: the
+leads connected to them through shared keys, found with a few indexed
+queries. Those leads are indexed in the (empty) `DuplicateIndex` of the
+store, whose clusters are compared with the stored ones to tell new and
+changed clusters from the ones that stayed the same.
+
+Leads that are merely similar don't share a key, so the fuzzy fields of
+`DuplicateIndex` can't be stored.
+"""
+import json
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+from scripts.records import LeadRecord
+
+# Leads updated shortly before the watermark are fetched again by the next
+# update, in case the search didn't return them yet (or the clocks of the
+# API and of this machine disagree). Updating a lead twice is harmless.
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+# Maximum number of lead IDs per `IN (...)` query.
+_BATCH_SIZE = 500
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leads (
+    id TEXT PRIMARY KEY,
+    record TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS keys (
+    field TEXT NOT NULL,
+    key TEXT NOT NULL,
+    lead_id TEXT NOT NULL,
+    PRIMARY KEY (field, key, lead_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS keys_lead_id ON keys (lead_id);
+CREATE TABLE IF NOT EXISTS clusters (
+    lead_id TEXT PRIMARY KEY,
+    cluster TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS clusters_cluster ON clusters (cluster);
+'''
+
+# `LeadRecord` fields stored (as a JSON list) for every lead, and the ones
+# that are tuples.
+_RECORD_FIELDS = (
+    'display_name',
+    'status_label',
+    'date_created',
+    'url',
+    'contact_names',
+    'emails',
+    'phones',
+    'custom',
+)
+_TUPLE_FIELDS = ('contact_names', 'emails', 'phones')
+
+
+def get_watermark():
+    """
+    Return the watermark of a run starting now: the leads updated after it
+    are fetched by the next run.
+    """
+    return (datetime.now(timezone.utc) - WATERMARK_OVERLAP).isoformat()
+
+
+def _batches(items):
+    items = list(items)
+    for start in range(0, len(items), _BATCH_SIZE):
+        yield items[start : start + _BATCH_SIZE]
+
+
+def _placeholders(batch):
+    return ','.join('?' * len(batch))
+
+
+def _dump_record(lead):
+    return json.dumps(
+        [getattr(lead, field) for field in _RECORD_FIELDS],
+        separators=(',', ':'),
+    )
+
+
+def _load_record(lead_id, record):
+    values = dict(zip(_RECORD_FIELDS, json.loads(record)))
+    for field in _TUPLE_FIELDS:
+        values[field] = tuple(values[field])
+    return LeadRecord(lead_id, **values)
+
+
+class DuplicateStore:
+    """
+    Duplicate index of the leads of an org, stored in the SQLite database at
+    `path`, for the fields and settings of `index` (an empty
+    `DuplicateIndex`). A store built with other fields or settings reads as
+    empty, and has to be rebuilt.
+    """
+
+    def __init__(self, path, index):
+        if index.fuzzy_fields:
+            raise ValueError('Fuzzily matched fields can\'t be stored')
+        self.path = path
+        self.index = index
+        self.config = json.dumps(
+            {
+                'fields': index.fields,
+                'custom_field_name': index.custom_field_name,
+                'phone_region': index.phone_region,
+            },
+            sort_keys=True,
+        )
+        self._db = sqlite3.connect(path)
+        self._db.executescript(_SCHEMA)
+
+    def _get_meta(self, name):
+        row = self._db.execute(
+            'SELECT value FROM meta WHERE name = ?', (name,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, name, value):
+        self._db.execute(
+            'INSERT OR REPLACE INTO meta VALUES (?, ?)', (name, value)
+        )
+
+    @property
+    def watermark(self):
+        """
+        Return the watermark of the last build or update of the store, or
+        None if it's empty or was built for other fields or settings.
+        """
+        if self._get_meta('config') != self.config:
+            return None
+        return self._get_meta('watermark')
+
+    def rebuild(self, watermark):
+        """
+        Replace the content of the store with the leads and clusters of the
+        index, with every lead of the org added to it.
+        """
+        with self._db:
+            for table in ('meta', 'leads', 'keys', 'clusters'):
+                self._db.execute(f'DELETE FROM {table}')
+            self._save_leads(self.index.iter_leads())
+            self._save_clusters(self.index.get_clusters())
+            self._set_meta('config', self.config)
+            self._set_meta('watermark', watermark)
+
+    def update(self, leads, deleted_ids, watermark):
+        """
+        Apply the changes since the last watermark: the leads created or
+        updated since, and the IDs of the leads deleted since.
+
+        Return the clusters that are new or changed (i.e. whose leads
+        weren't a cluster before), as `(change, cluster)` pairs where
+        `change` is `New` if none of the leads were in a cluster before and
+        `Changed` otherwise, and the number of former clusters that are left
+        without duplicates. The leads of the clusters are indexed in the
+        store's index.
+        """
+        leads = list(leads)
+        # A lead that's still returned by the search has been restored.
+        deleted_ids = set(deleted_ids).difference(lead.id for lead in leads)
+        changed_ids = {lead.id for lead in leads} | deleted_ids
+        old_clusters = self._get_clusters_of(changed_ids)
+        seed_ids = changed_ids.union(*old_clusters.values()) - deleted_ids
+
+        with self._db:
+            self._delete_leads(changed_ids)
+            self._save_leads(leads)
+            lead_ids = self._get_connected_ids(seed_ids)
+            self.index.add_all(self._load_leads(lead_ids))
+            clusters = self.index.get_clusters()
+
+            # Leads that just joined a cluster may bring other clusters in.
+            old_clusters.update(self._get_clusters_of(lead_ids))
+            old_cluster_ids = {
+                lead_id: cluster
+                for cluster, members in old_clusters.items()
+                for lead_id in members
+            }
+            changes = []
+            for cluster in clusters:
+                members = {lead.id for lead in cluster}
+                previous = {
+                    old_cluster_ids[lead_id]
+                    for lead_id in members
+                    if lead_id in old_cluster_ids
+                }
+                if not previous:
+                    changes.append(('New', cluster))
+                elif (
+                    len(previous) > 1
+                    or old_clusters[previous.pop()] != members
+                ):
+                    changes.append(('Changed', cluster))
+
+            clustered_ids = {
+                lead.id for cluster in clusters for lead in cluster
+            }
+            removed = sum(
+                1
+                for members in old_clusters.values()
+                if not members & clustered_ids
+            )
+            self._delete_clusters(clustered_ids.union(old_cluster_ids))
+            self._save_clusters(clusters)
+            self._set_meta('watermark', watermark)
+        return changes, removed
+
+    def _save_leads(self, leads):
+        lead_rows, key_rows = [], []
+        for lead in leads:
+            keys = self.index.get_keys(lead)
+            if not keys:
+                continue
+            lead_rows.append((lead.id, _dump_record(lead)))
+            key_rows.extend((field, key, lead.id) for field, key in keys)
+        self._db.executemany('INSERT INTO leads VALUES (?, ?)', lead_rows)
+        self._db.executemany('INSERT INTO keys VALUES (?, ?, ?)', key_rows)
+
+    def _delete_leads(self, lead_ids):
+        for batch in _batches(lead_ids):
+            for table, column in (('leads', 'id'), ('keys', 'lead_id')):
+                self._db.execute(
+                    f'DELETE FROM {table} '
+                    f'WHERE {column} IN ({_placeholders(batch)})',
+                    batch,
+                )
+
+    def _load_leads(self, lead_ids):
+        for batch in _batches(lead_ids):
+            yield from (
+                _load_record(*row)
+                for row in self._db.execute(
+                    'SELECT id, record FROM leads '
+                    f'WHERE id IN ({_placeholders(batch)})',
+                    batch,
+                )
+            )
+
+    def _get_connected_ids(self, lead_ids):
+        """
+        Return the IDs of the stored `lead_ids`, and of all the leads they
+        share a key with, directly or through other leads.
+        """
+        connected = set()
+        frontier = set(lead_ids)
+        while frontier:
+            found = set()
+            for batch in _batches(frontier):
+                found.update(
+                    row[0]
+                    for row in self._db.execute(
+                        'SELECT DISTINCT b.lead_id FROM keys a '
+                        'JOIN keys b ON b.field = a.field AND b.key = a.key '
+                        f'WHERE a.lead_id IN ({_placeholders(batch)})',
+                        batch,
+                    )
+                )
+            frontier = found - connected
+            connected |= frontier
+        return connected
+
+    def _get_clusters_of(self, lead_ids):
+        """Return the stored clusters of `lead_ids`, as sets of lead IDs."""
+        cluster_ids = set()
+        for batch in _batches(lead_ids):
+            cluster_ids.update(
+                row[0]
+                for row in self._db.execute(
+                    'SELECT DISTINCT cluster FROM clusters '
+                    f'WHERE lead_id IN ({_placeholders(batch)})',
+                    batch,
+                )
+            )
+        clusters = {}
+        for batch in _batches(cluster_ids):
+            for lead_id, cluster in self._db.execute(
+                'SELECT lead_id, cluster FROM clusters '
+                f'WHERE cluster IN ({_placeholders(batch)})',
+                batch,
+            ):
+                clusters.setdefault(cluster, set()).add(lead_id)
+        return clusters
+
+    def _save_clusters(self, clusters):
+        # A cluster is identified by the smallest ID of its leads.
+        rows = []
+        for cluster in clusters:
+            cluster_id = min(lead.id for lead in cluster)
+            rows.extend((lead.id, cluster_id) for lead in cluster)
+        self._db.executemany('INSERT INTO clusters VALUES (?, ?)', rows)
+
+    def _delete_clusters(self, lead_ids):
+        for batch in _batches(lead_ids):
+            self._db.execute(
+                'DELETE FROM clusters '
+                f'WHERE lead_id IN ({_placeholders(batch)})',
+                batch,
+            )
@@ -3,8 +3,13 @@
 import argparse
 import csv
 import sys
+from collections import defaultdict
 
-from closeio_api import APIError, Client as CloseIO_API
+from scripts.runtime import bootstrap
+
+bootstrap()  # isort: split
+
+from scripts.CloseApiWrapper import CloseApiWrapper
 
 parser = argparse.ArgumentParser(
     description='Remove email addresses from contacts in CSV file'
@@ -18,6 +23,10 @@ parser.add_argument(
 parser.add_argument(
     '--verbose', '-v', action='store_true', help='Increase logging verbosity.'
 )
+parser.add_argument(
+    '--journal',
+    help='Append the outcome of every update to this file as JSON lines.',
+)
 parser.add_argument('file', help='Path to the csv file')
 args = parser.parse_args()
 
@@ -30,37 +39,56 @@ if any(
     )
     sys.exit(-1)
 
-api = CloseIO_API(args.api_key)
+api = CloseApiWrapper(args.api_key)
 
+# Group the email addresses by contact, so that every contact is only read
+# and updated once.
+emails_to_remove = defaultdict(set)
 for row in reader:
-    contact_id = row['contact_id']
-    email_address = row['email_address']
+    emails_to_remove[row['contact_id']].add(row['email_address'])
+
 
+# Fetch the contacts 100 at a time, rather than one request per contact.
+contacts = api.get_by_ids('contact', emails_to_remove, fields=['emails'])
+
+
+def get_update(contact_id):
     if args.verbose:
-        print(f'Attempting to remove {email_address} from {contact_id}')
-
-    try:
-        contact = api.get('contact/' + contact_id)
-
-        if not contact['emails']:
-            if args.verbose:
-                print(
-                    f'Skipping {contact_id} because it has no email addresses'
-                )
-            continue
-
-        emails = list(
-            filter(
-                lambda email: email['email'] != email_address,
-                contact['emails'],
-            )
+        print(
+            f'Attempting to remove {", ".join(emails_to_remove[contact_id])} '
+            f'from {contact_id}'
         )
-        if args.confirmed:
-            resp = api.put('contact/' + contact_id, {'emails': emails})
-            if args.verbose:
-                print(f'Removed {email_address} from {contact_id}')
-    except APIError as e:
+
+    contact = contacts.get(contact_id)
+    if contact is None:
+        if args.verbose:
+            print(f'Skipping {contact_id} because it could not be found')
+        return None
+
+    if not contact['emails']:
+        if args.verbose:
+            print(f'Skipping {contact_id} because it has no email addresses')
+        return None
+
+    emails = [
+        email
+        for email in contact['emails']
+        if email['email'] not in emails_to_remove[contact_id]
+    ]
+    return 'put', 'contact/' + contact_id, {'emails': emails}
+
+
+operations = (update for update in map(get_update, emails_to_remove) if update)
+for result in api.bulk_execute(
+    operations, dry_run=not args.confirmed, journal=args.journal
+):
+    contact_id = result['endpoint'].split('/')[-1]
+    if result['status'] == 'failed':
         if args.verbose:
             print(
-                f'Encountered an API error ({e.response.status_code}): {e.response.text}'
+                f'Encountered an API error ({result["status_code"]}): {result["error"]}'
             )
+    elif args.confirmed and args.verbose:
+        print(
+            f'Removed {", ".join(emails_to_remove[contact_id])} from {contact_id}'
+        )
@@ -3,7 +3,11 @@
 import argparse
 import sys
 
-from closeio_api import Client as CloseIO_API
+from scripts.runtime import bootstrap
+
+bootstrap()  # isort: split
+
+from scripts.CloseApiWrapper import CloseApiWrapper
 
 parser = argparse.ArgumentParser(
     description='Remove tasks associated with inactive users'
@@ -17,9 +21,13 @@ parser.add_argument(
 parser.add_argument(
     '--verbose', '-v', action='store_true', help='Increase logging verbosity.'
 )
+parser.add_argument(
+    '--journal',
+    help='Append the outcome of every deletion to this file as JSON lines.',
+)
 args = parser.parse_args()
 
-api = CloseIO_API(args.api_key)
+api = CloseApiWrapper(args.api_key)
 
 # Get IDs of all inactive users in a given org
 org_id = api.get('me')['organizations'][0]['id']
@@ -34,22 +42,14 @@ for idx, user_id in enumerate(inactive_users):
     if args.verbose:
         print(f'Gathering tasks for {user_id} ({(idx + 1)}/{total_cnt})')
 
-    has_more = True
-    skip = 0
-    limit = 100
-    while has_more:
-        resp = api.get(
+    task_ids.extend(
+        t['id']
+        for t in api.iter_items(
             'task',
-            params={
-                'assigned_to': user_id,
-                '_skip': skip,
-                '_limit': limit,
-                '_fields': 'id',
-            },
+            params={'assigned_to': user_id, '_limit': 100, '_fields': 'id'},
+            date_field='date_created',
         )
-        task_ids.extend(t['id'] for t in resp['data'])
-        has_more = resp['has_more']
-        skip += limit
+    )
 
 if args.verbose:
     print(f'Found {len(task_ids)} tasks')
@@ -61,7 +61,10 @@ if not args.confirmed:
     sys.exit(0)
 
 total_cnt = len(task_ids)
-for idx, task_id in enumerate(task_ids):
-    api.delete('task/' + task_id)
-    if args.verbose:
-        print(f'Deleting {(idx + 1)}/{total_cnt}')
+operations = (('delete', f'task/{task_id}', None) for task_id in task_ids)
+results = api.bulk_execute(operations, journal=args.journal)
+for idx, result in enumerate(results):
+    if result['status'] == 'failed':
+        print(f"Couldn't delete {result['endpoint']}: {result['error']}")
+    elif args.verbose:
+        print(f'Deleted {(idx + 1)}/{total_cnt}')
@@ -5,7 +5,11 @@ import json
 import logging
 import sys
 
-from closeio_api import Client as CloseIO_API
+from scripts.runtime import bootstrap
+
+bootstrap()  # isort: split
+
+from scripts.CloseApiWrapper import CloseApiWrapper
 
 parser = argparse.ArgumentParser(description='Get Events By Request ID')
 parser.add_argument('--api-key', '-k', required=True, help='API Key')
@@ -20,7 +24,7 @@ parser.add_argument(
 )
 args = parser.parse_args()
 
-api = CloseIO_API(args.api_key)
+api = CloseApiWrapper(args.api_key)
 
 
 def setup_logger():
@@ -43,21 +47,12 @@ logger = setup_logger()
 output = open(args.output, "w")
 output.write('{"events": [')
 
-has_more = True
-cursor = None
 first_iter = True
-while has_more:
-    resp = api.get(
-        'event', params={'_cursor': cursor, 'request_id': args.request_id}
-    )
-    cursor = resp['cursor_next']
-    has_more = bool(cursor)
-
-    for event in resp['data']:
-        if not first_iter:
-            output.write(",")
-        json.dump(event, output, indent=4)
-        first_iter = False
+for event in api.iter_items('event', params={'request_id': args.request_id}):
+    if not first_iter:
+        output.write(",")
+    json.dump(event, output, indent=4)
+    first_iter = False
 
 output.write("]}")
 output.close()
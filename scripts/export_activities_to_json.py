@@ -3,12 +3,13 @@ import json
 from datetime import datetime
 from operator import itemgetter
 
-import gevent.monkey
-from closeio_api import Client as CloseIO_API
 from dateutil.relativedelta import relativedelta
-from gevent.pool import Pool
 
-gevent.monkey.patch_all()
+from scripts.runtime import bootstrap
+
+bootstrap()  # isort: split
+
+from scripts.CloseApiWrapper import CloseApiWrapper
 
 parser = argparse.ArgumentParser(
     description='Export Close activity data within a date range into a JSON file'
@@ -44,7 +45,7 @@ parser.add_argument(
 )
 args = parser.parse_args()
 
-api = CloseIO_API(args.api_key)
+api = CloseApiWrapper(args.api_key)
 
 days = []
 activities = []
@@ -83,24 +84,18 @@ while starting_date < ending_date_final:
 # Method to get all of the specified activities for a specific day.
 def getActivities(day):
     print(f"Getting all {args.activity_type} activites for {day['day']}...")
-    has_more = True
-    offset = 0
-    while has_more:
-        resp = api.get(
+    activities.extend(
+        api.iter_items(
             'activity/' + endpoint,
             params={
-                '_skip': offset,
                 'date_created__gte': day['start_date'],
                 'date_created__lte': day['end_date'],
             },
         )
-        for activity in resp['data']:
-            activities.append(activity)
-        offset += len(resp['data'])
-        has_more = resp['has_more']
+    )
 
 
-pool = Pool(5)
+pool = api.create_pool()
 pool.map(getActivities, days)
 
 # Sort all activities by date_created to be in order because they were pulled in parallel
@@ -1,15 +1,11 @@
 import argparse
 import csv
-import math
 
-import gevent.monkey
+from scripts.runtime import bootstrap
 
-gevent.monkey.patch_all()
-from gevent.pool import Pool
+bootstrap()  # isort: split
 
-pool = Pool(7)
-
-from closeio_api import Client as CloseApi
+from scripts.CloseApiWrapper import CloseApiWrapper
 
 parser = argparse.ArgumentParser(
     description='Download a CSV of calls from/to a specific Close number over a specified time range'
@@ -62,9 +58,14 @@ parser.add_argument(
     help='Use this field if you want to include a call transcript column in your export CSV',
 )
 
+parser.add_argument(
+    '--response-cache',
+    help='Path to a SQLite file used to cache API responses between runs of this report',
+)
+
 args = parser.parse_args()
 
-api = CloseApi(args.api_key)
+api = CloseApiWrapper(args.api_key, response_cache=args.response_cache)
 
 params = {}
 
@@ -89,46 +90,9 @@ if args.user_id:
 print("Getting Leads...")
 print(f'\t{lead_query}')
 
-def get_all(url, params=None):
-    if params is None:
-        params = {}
-
-    items = []
-    has_more = True
-    offset = 0
-    while has_more:
-        params["_skip"] = offset
-        resp = api.get(url, params=params)
-        items.extend(resp['data'])
-        offset += len(resp["data"])
-        has_more = resp["has_more"]
-    return items
-
-def get_all_leads_with_slices(params, slice_size=500):
-    leads = []
-
-    total_leads = api.get("lead", params={"_limit": 0, "query": params["query"], "_fields": "id"})[
-        "total_results"]
-    total_slices = int(math.ceil(float(total_leads) / slice_size))
-
-    slices = []
-    for slice_number in range(1, total_slices + 1):
-        slices.append({"total_slices": total_slices, "slice": slice_number, "params": params})
-
-    def _get_all_leads_slice(slice_obj):
-        params = slice_obj["params"]
-
-        new_params = params.copy()
-        new_params["query"] = f'({params["query"]}) slice:{slice_obj["slice"]}/{slice_obj["total_slices"]}'
-
-        leads.extend(get_all("lead", params=new_params))
-
-    pool.map(_get_all_leads_slice, slices)
-
-    return leads
-
-
-leads = get_all_leads_with_slices(params={"query": lead_query, "_fields": "id,contacts,display_name"})
+leads = api.iter_lead_slices(
+    lead_query, fields=["id", "contacts", "display_name"]
+)
 
 lead_id_to_name = {}
 contacts_id_to_name = {}
@@ -150,40 +114,47 @@ if args.transcripts:
 
 params['_fields'] = ','.join(call_fields)
 
-print("Getting Calls...")
-calls = get_all("activity/call", params=params)
-
-# Add lead names and formatted costs
-for call in calls:
-    call['lead_name'] = lead_id_to_name.get(call.get('lead_id'), '')
-    call['contact_name'] = contacts_id_to_name.get(call.get('contact_id'), '')
-
-    if call.get('cost'):
-        call['formatted_cost'] = f"${(float(call['cost']) / 100)}"
-    if call.get('recording_transcript'):
-        call['recording_transcript'] = call.get('recording_transcript').get('summary_text')
-
-# Filter calls
-if args.missed_or_voicemail:
-    calls = [i for i in calls if i['duration'] == 0]
-
-if args.direction:
-    calls = [i for i in calls if i['direction'] == args.direction]
-
-if args.phone_number:
-    calls = [i for i in calls if i['local_phone'] == args.phone_number]
-
 # Write to CSV
 organization = api.get('me')['organizations'][0]
 organization_name = organization['name'].replace('/', "")
 file_name = f'{organization_name} Calls.csv'
 
+print("Getting Calls...")
 with open(file_name, 'w', newline='', encoding='utf-8') as f:
     keys = call_fields + ['lead_name', 'contact_name']
     if args.call_costs:
         keys += ['cost', 'formatted_cost']
     writer = csv.DictWriter(f, keys)
     writer.writeheader()
-    writer.writerows(calls)
 
-print(f'Done! Report is saved to `{file_name}`')
\ No newline at end of file
+    # Calls are written as they're paginated through, so that only a single
+    # page of calls is kept in memory at a time
+    for call in api.iter_items("activity/call", params=params):
+        # Filter calls
+        if args.missed_or_voicemail and call['duration'] != 0:
+            continue
+
+        if args.direction and call['direction'] != args.direction:
+            continue
+
+        if args.phone_number and call['local_phone'] != args.phone_number:
+            continue
+
+        # Add lead names and formatted costs
+        call['lead_name'] = lead_id_to_name.get(call.get('lead_id'), '')
+        call['contact_name'] = contacts_id_to_name.get(
+            call.get('contact_id'), ''
+        )
+
+        if call.get('cost'):
+            call['formatted_cost'] = f"${(float(call['cost']) / 100)}"
+        if call.get('recording_transcript'):
+            call['recording_transcript'] = call.get(
+                'recording_transcript'
+            ).get('summary_text')
+
+        writer.writerow(call)
+
+print(f'Done! Report is saved to `{file_name}`')
+
+api.add_stats_sections()
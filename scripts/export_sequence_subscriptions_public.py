@@ -1,71 +1,28 @@
 import argparse
 import csv
-import math
 
-import gevent.monkey
+from scripts.runtime import bootstrap
 
-gevent.monkey.patch_all()
+bootstrap()  # isort: split
 
-from closeio_api import Client as CloseApi
-from gevent.pool import Pool
-
-pool = Pool(10)
+from scripts.CloseApiWrapper import CloseApiWrapper
 
 arg_parser = argparse.ArgumentParser(description="Download a CSV of email sequence subscriptions")
 arg_parser.add_argument("--api-key", "-k", required=True, help="API Key")
 arg_parser.add_argument("--sequence-id", help="Fetch only subscriptions from this Sequence ID")
 args = arg_parser.parse_args()
 
-api = CloseApi(args.api_key)
+api = CloseApiWrapper(args.api_key)
+pool = api.create_pool()
 
 csv_data = []
 
 
-def get_sequences():
-    sequences = []
-
-    has_more = True
-    offset = 0
-    while has_more:
-        resp = api.get('sequence')
-        sequences.extend(resp['data'])
-        offset += len(resp['data'])
-        has_more = resp['has_more']
-
-    return sequences
-
-
-sequences = get_sequences()
+sequences = api.get_all_items('sequence')
 
 query = "contact(sequence_subscription(sequence:*)) "
 
-# Get the total number of slices
-total_leads = api.get('lead', params={'_limit': 0, 'query': query})['total_results']
-total_slices = int(math.ceil(float(total_leads) / 1000))
-slices = range(1, total_slices + 1)
-
-
-def get_leads_slice(slice_index):
-    print(f"Getting lead slice {slice_index} of {total_slices}...")
-    has_more = True
-    offset = 0
-    while has_more:
-        resp = api.get(
-            'lead',
-            params={
-                '_skip': offset,
-                'query': f'sort:created slice:{slice_index}/{total_slices}',
-                '_fields': 'id'
-            },
-        )
-        leads.extend(resp['data'])
-
-        offset += len(resp['data'])
-        has_more = resp['has_more']
-
-
-leads = []
-pool.map(get_leads_slice, slices)
+leads = api.iter_lead_slices(query, fields=['id'])
 
 
 def fetch_sequence_subscriptions(lead):
@@ -74,20 +31,7 @@ def fetch_sequence_subscriptions(lead):
     if args.sequence_id:
         params["sequence_id"] = args.sequence_id
 
-    def get_sequence_subscriptions(params):
-        subscriptions = []
-
-        has_more = True
-        offset = 0
-        while has_more:
-            resp = api.get('sequence_subscription', params=params)
-            subscriptions.extend(resp['data'])
-            offset += len(resp['data'])
-            has_more = resp['has_more']
-
-        return subscriptions
-
-    all_subs.extend(get_sequence_subscriptions(params))
+    all_subs.extend(api.iter_items('sequence_subscription', params=params))
 
 
 all_subs = []
@@ -1,11 +1,11 @@
 import argparse
 import csv
 
-import gevent.monkey
+from scripts.runtime import bootstrap
 
-gevent.monkey.patch_all()
-from closeio_api import Client as CloseIO_API
-from gevent.pool import Pool
+bootstrap()  # isort: split
+
+from scripts.CloseApiWrapper import CloseApiWrapper
 
 parser = argparse.ArgumentParser(
     description='Download a CSV of email sequences and their subscription counts (number of active/paused/finished subscriptions)'
@@ -14,22 +14,15 @@ parser = argparse.ArgumentParser(
 parser.add_argument('--api-key', '-k', required=True, help='API Key')
 args = parser.parse_args()
 
-api = CloseIO_API(args.api_key)
+api = CloseApiWrapper(args.api_key)
 org_name = api.get('me')['organizations'][0]['name']
 
 print('Getting email sequences...')
 
-params = {'_fields': 'id'}
-has_more = True
-offset = 0
-sequence_ids = []
-while has_more:
-    params['_skip'] = offset
-    resp = api.get('sequence', params=params)
-    for sequence in resp['data']:
-        sequence_ids.append(sequence['id'])
-    offset += len(resp['data'])
-    has_more = resp['has_more']
+sequence_ids = [
+    sequence['id']
+    for sequence in api.iter_items('sequence', params={'_fields': 'id'})
+]
 
 print(f'Found {len(sequence_ids)} email sequences. Getting their details...')
 
@@ -60,7 +53,7 @@ def fetch_sequence(sequence_id):
 
 sequences = []
 
-pool = Pool(5)
+pool = api.create_pool()
 pool.map(fetch_sequence, sequence_ids)
 
 file_name = f'{org_name.replace("/", " ")} Email Sequences.csv'
@@ -1,15 +1,12 @@
 import argparse
 import csv
-import math
 
-import gevent.monkey
+from scripts.runtime import bootstrap
 
-gevent.monkey.patch_all()
-from gevent.pool import Pool
+bootstrap()  # isort: split
 
-pool = Pool(7)
-
-from closeio_api import Client as CloseApi
+from scripts.CloseApiWrapper import CloseApiWrapper
+from scripts.records import intern_id
 
 arg_parser = argparse.ArgumentParser(description="Download a CSV of SMS messages over a specified time range")
 arg_parser.add_argument("--api-key", "-k", required=True, help="API Key")
@@ -42,9 +39,14 @@ arg_parser.add_argument(
     help="Use this field to only export SMS in specific status.",
 )
 arg_parser.add_argument("--smart-view", help="Export SMS messages only for leads in a specific Smart View")
+arg_parser.add_argument(
+    "--response-cache",
+    help="Path to a SQLite file used to cache API responses between runs of this report",
+)
 args = arg_parser.parse_args()
 
-api = CloseApi(args.api_key)
+api = CloseApiWrapper(args.api_key, response_cache=args.response_cache)
+pool = api.create_pool()
 
 organization = api.get("me")["organizations"][0]
 
@@ -56,8 +58,7 @@ sms_messages_params = {
 
 if args.user:
     def get_membership(user_identifier):
-        resp = api.get(f"organization/{organization['id']}", params={"_fields": "memberships,inactive_memberships"})
-        memberships = resp["memberships"] + resp["inactive_memberships"]
+        memberships = api.get_memberships(include_inactive=True)
 
         if user_identifier.startswith("user_"):
             return next(iter(x for x in memberships if x["user_id"] == user_identifier), None)
@@ -107,79 +108,37 @@ if args.smart_view:
 print("Getting Leads...")
 print(f'\t{query}')
 
-def get_all(url, params=None):
-    if params is None:
-        params = {}
-
-    items = []
-    has_more = True
-    offset = 0
-    while has_more:
-        params["_skip"] = offset
-        resp = api.get(url, params=params)
-        items.extend(resp['data'])
-        offset += len(resp["data"])
-        has_more = resp["has_more"]
-    return items
-
-
-def get_all_leads_with_slices(params, slice_size=500):
-    leads = []
-
-    total_leads = api.get("lead", params={"_limit": 0, "query": params["query"], "_fields": "id"})[
-        "total_results"]
-    total_slices = int(math.ceil(float(total_leads) / slice_size))
-
-    slices = []
-    for slice_number in range(1, total_slices + 1):
-        slices.append({"total_slices": total_slices, "slice": slice_number, "params": params})
-
-    def _get_all_leads_slice(slice_obj):
-        params = slice_obj["params"]
-
-        new_params = params.copy()
-        new_params["query"] = f'({params["query"]}) slice:{slice_obj["slice"]}/{slice_obj["total_slices"]}'
-
-        leads.extend(get_all("lead", params=new_params))
-
-    pool.map(_get_all_leads_slice, slices)
-
-    return leads
-
-
-leads = get_all_leads_with_slices(params={"query": query, "_fields": "id,display_name"})
-
+# Only the names of the leads are kept, by (interned) ID
 lead_id_to_name = {}
-for lead in leads:
-    lead_id_to_name[lead["id"]] = lead["display_name"]
+for lead in api.iter_lead_slices(query, fields=["id", "display_name"]):
+    lead_id_to_name[intern_id(lead["id"])] = lead["display_name"]
 
 print("Getting SMS messages...")
 
 
-def get_sms_messages_for_lead(lead):
+def get_sms_messages_for_lead(lead_id):
     sms_params = sms_messages_params.copy()
-    sms_params["lead_id"] = lead["id"]
+    sms_params["lead_id"] = lead_id
 
     if args.start_date:
         sms_params["date_created__gt"] = args.start_date
     if args.end_date:
         sms_params["date_created__lt"] = args.end_date
 
-    sms_messages.extend(get_all("activity/sms", params=sms_params))
+    for sms_message in api.iter_items("activity/sms", params=sms_params):
+        if args.direction and sms_message["direction"] != args.direction:
+            continue
+        if args.status and sms_message["status"] != args.status:
+            continue
+        sms_messages.append(sms_message)
 
 
 sms_messages = []
-pool.map(get_sms_messages_for_lead, leads)
+pool.map(get_sms_messages_for_lead, lead_id_to_name)
 
 # Sort by newest first
 sms_messages.sort(key=lambda x: x["date_created"], reverse=True)
 
-if args.direction:
-    sms_messages = [i for i in sms_messages if i["direction"] == args.direction]
-
-if args.status:
-    sms_messages = [i for i in sms_messages if i["status"] == args.status]
-
 for sms_message in sms_messages:
     sms_message["lead_name"] = lead_id_to_name.get(sms_message.get("lead_id"), "")
 
@@ -195,3 +154,5 @@ with open(file_name, 'w', newline='', encoding='utf-8') as f:
     writer.writerows(sms_messages)
 
 print(f'Done! Report is saved to `{file_name}`')
+
+api.add_stats_sections()
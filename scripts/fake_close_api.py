@@ -0,0 +1,1355 @@
+"""
+Local stand-in for the Close API, seeded with synthetic data, for testing
+and benchmarking the scripts without a live Close organization.
+
+It implements the endpoints the scripts use: the organization metadata
+(`me`, `organization/<id>`, statuses, pipelines, custom fields, ...), lead
+search (`*`, free text, `has:`, `slice:i/N` and `sort:` clauses, `_fields`,
+`_skip`/`_limit`/`has_more` paging), contacts, opportunities, tasks,
+activities, sequences and sequence subscriptions (with field filters such as
+`lead_id=...` and `date_created__gte=...`), `event` with `_cursor` paging and
+the filters documented for it (see `EVENT_FILTERS`), and bulk edits and
+deletes. GETs, POSTs, PUTs and DELETEs of single objects work on an
+in-memory copy of the data. Latency, rate limiting and errors can be
+injected to mimic a loaded API.
+
+Run it on localhost:
+
+    python -m scripts.fake_close_api --port 8000 --leads 10000 --latency 0.05
+
+and point the scripts at it (with any API key) by setting
+`CLOSE_API_BASE_URL=http://localhost:8000/api/v1/`, or start it in-process:
+
+    with FakeCloseApi(leads=1000) as server:
+        api = CloseApiWrapper('fake', base_url=server.base_url)
+"""
+import argparse
+import base64
+import copy
+import json
+import random
+import re
+import string
+import threading
+import time
+import zlib
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+# Maximum `_limit` for lead searches and for everything else.
+MAX_LEAD_LIMIT = 200
+MAX_LIMIT = 100
+
+# Path of the counters of a running server (outside of the API base URL, so
+# that fetching them doesn't count as a request).
+STATS_PATH = '/_fake/stats'
+
+# Endpoints of the objects that belong to a lead, and the lead field they
+# are nested in (if any).
+LEAD_CHILDREN = {
+    'activity': None,
+    'contact': 'contacts',
+    'opportunity': 'opportunities',
+    'task': 'tasks',
+}
+
+# Default maximum `_skip`. Deeper pages get a 400, like on the real API.
+DEFAULT_MAX_SKIP = 10000
+
+# Filters of the event log, as documented for the real API. Any other filter
+# is ignored, so that a script relying on one fails here too.
+EVENT_FILTERS = (
+    'object_type',
+    'object_id',
+    'lead_id',
+    'action',
+    'request_id',
+    'user_id',
+    'date_updated__gt',
+    'date_updated__gte',
+    'date_updated__lt',
+    'date_updated__lte',
+)
+
+ACTIVITY_TYPES = {
+    'call': 'Call',
+    'email': 'Email',
+    'note': 'Note',
+    'sms': 'SMS',
+    'meeting': 'Meeting',
+    'task_completed': 'TaskCompleted',
+}
+
+# Collections of objects with an ID, by endpoint, and their ID prefixes.
+COLLECTIONS = {
+    'lead': 'lead',
+    'contact': 'cont',
+    'opportunity': 'oppo',
+    'task': 'task',
+    'activity': 'acti',
+    'user': 'user',
+    'role': 'role',
+    'group': 'group',
+    'sequence': 'seq',
+    'sequence_subscription': 'sub',
+    'email_template': 'tmpl',
+    'sms_template': 'smstmpl',
+    'custom_activity': 'actitype',
+    'custom_object_type': 'cotype',
+    'integration_link': 'ilink',
+    'saved_search': 'save',
+    'webhook': 'whsub',
+    'status/lead': 'stat',
+    'pipeline': 'pipe',
+}
+
+CUSTOM_FIELD_TYPES = [
+    'lead',
+    'contact',
+    'opportunity',
+    'activity',
+    'custom_object_type',
+    'shared',
+]
+
+_FIRST_NAMES = ['Ada', 'Alan', 'Grace', 'Linus', 'Margaret', 'Ken', 'Barbara']
+_LAST_NAMES = ['Lovelace', 'Turing', 'Hopper', 'Torvalds', 'Hamilton']
+_COMPANY_WORDS = ['Acme', 'Globex', 'Initech', 'Umbrella', 'Hooli', 'Vandelay']
+_COMPANY_SUFFIXES = ['Inc', 'LLC', 'Ltd', 'GmbH', 'Corp']
+_COUNTRIES = ['US', 'GB', 'DE', 'FR', 'CA', 'AU']
+
+
+# Search query clauses `_filter_leads` doesn't understand: nested queries such
+# as `sms(...)` and comparisons such as `calls > 0`.
+_DATE_CLAUSE_RE = re.compile(
+    r'\b(date_created|date_updated)\s*(>=|<=|>|<)\s*"([^"]*)"'
+)
+_IGNORED_CLAUSE_RE = re.compile(
+    r'\w+\((?:[^()]|\([^()]*\))*\)'
+    r'|[\w."]+\s*(?:>=|<=|>|<|=)\s*(?:"[^"]*"|\S+)'
+)
+
+
+def _format_date(date):
+    return date.strftime('%Y-%m-%dT%H:%M:%S.%f+00:00')
+
+
+def _now():
+    return _format_date(datetime.now(timezone.utc))
+
+
+def _slice_of(lead_id, total_slices):
+    return zlib.crc32(lead_id.encode()) % total_slices + 1
+
+
+def _project(obj, fields):
+    if not fields:
+        return obj
+    return {field: obj[field] for field in fields if field in obj}
+
+
+class FakeCloseApiError(Exception):
+    def __init__(self, status_code, error):
+        super().__init__(error)
+        self.status_code = status_code
+        self.error = error
+
+
+class FakeCloseApi:
+    """
+    In-memory fake of the Close API served over HTTP on localhost.
+
+    `latency` (in seconds, randomized by +/- `jitter` of itself) is added to
+    every response, and `slow_latency` to a `slow_rate` share of them, to
+    simulate a latency tail. `rate_limit` caps the number of requests per
+    second: requests over it get a 429 with the same `RateLimit` headers and
+    `rate_reset` hint as the real API. `error_rate` is the share of requests
+    that fail with an `error_status_code` (503 by default). The synthetic
+    data is generated from `seed`, so every run sees the same objects (with
+    dates relative to the current day). `request_count` and `items_served`
+    count the requests handled and the objects returned in list responses.
+    """
+
+    def __init__(
+        self,
+        seed=0,
+        leads=1000,
+        users=5,
+        activities_per_lead=5,
+        events_per_lead=1,
+        sequences=3,
+        latency=0.0,
+        jitter=0.0,
+        rate_limit=None,
+        error_rate=0.0,
+        error_status_code=503,
+        max_skip=DEFAULT_MAX_SKIP,
+        slow_rate=0.0,
+        slow_latency=1.0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.error_status_code = error_status_code
+        self.max_skip = max_skip
+        self.request_count = 0
+        self.items_served = 0
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window_start = 0.0
+        self._window_count = 0
+        self._server = None
+        self._thread = None
+
+        self.objects = {endpoint: {} for endpoint in COLLECTIONS}
+        self.custom_fields = {type: {} for type in CUSTOM_FIELD_TYPES}
+        self.events = []
+        self.bulk_actions = {}
+        self._lead_activity_ids = defaultdict(list)
+        self._seed(
+            leads, users, activities_per_lead, events_per_lead, sequences
+        )
+
+    # Synthetic data
+
+    def _make_id(self, prefix):
+        chars = string.ascii_letters + string.digits
+        return prefix + '_' + ''.join(self._random.choices(chars, k=43))
+
+    def _add(self, endpoint, obj):
+        obj.setdefault('id', self._make_id(COLLECTIONS[endpoint]))
+        obj.setdefault('organization_id', self.organization_id)
+        self.objects[endpoint][obj['id']] = obj
+        return obj
+
+    def _seed(
+        self, leads, users, activities_per_lead, events_per_lead, sequences
+    ):
+        rng = self._random
+        self.organization_id = self._make_id('orga')
+        # Spread the leads over the days leading up to today, 7 minutes
+        # apart, so that reports over the last few days find some data.
+        today = datetime.now(timezone.utc).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        start = today - timedelta(days=2, minutes=leads * 7)
+
+        user_ids = []
+        for i in range(users):
+            first, last = rng.choice(_FIRST_NAMES), rng.choice(_LAST_NAMES)
+            user = self._add(
+                'user',
+                {
+                    'first_name': first,
+                    'last_name': last,
+                    'email': f'{first}.{last}.{i}@example.com'.lower(),
+                    'date_created': _format_date(start),
+                },
+            )
+            user_ids.append(user['id'])
+        self.me_id = user_ids[0]
+        self.inactive_user_ids = user_ids[-1:] if users > 1 else []
+
+        for label in ['Potential', 'Bad Fit', 'Qualified', 'Customer']:
+            self._add('status/lead', {'label': label})
+        pipeline = self._add('pipeline', {'name': 'Sales', 'statuses': []})
+        for label, type in [
+            ('Active', 'active'),
+            ('Won', 'won'),
+            ('Lost', 'lost'),
+        ]:
+            pipeline['statuses'].append(
+                {
+                    'id': self._make_id('stat'),
+                    'label': label,
+                    'type': type,
+                    'pipeline_id': pipeline['id'],
+                }
+            )
+        for name, type, multiple in [
+            ('Industry', 'text', False),
+            ('Source CRM', 'text', False),
+            ('Tags', 'choices', True),
+        ]:
+            self._add_custom_field(
+                'lead', name, type=type, accepts_multiple_values=multiple
+            )
+        self._add_custom_field('contact', 'LinkedIn')
+        self._add_custom_field('opportunity', 'Contract length')
+        shared_field = self._add_custom_field('shared', 'Priority')
+
+        # Custom activity and object types editable with a custom role.
+        role = self._add('role', {'name': 'Sales Manager'})
+        for i in range(3):
+            activity_field = self._add_custom_field('activity', f'Outcome {i}')
+            object_field = self._add_custom_field(
+                'custom_object_type', f'Plan {i}'
+            )
+            for endpoint, name, field in [
+                ('custom_activity', f'Demo {i}', activity_field),
+                ('custom_object_type', f'Subscription {i}', object_field),
+            ]:
+                self._add(
+                    endpoint,
+                    {
+                        'name': name,
+                        'editable_with_roles': [role['id'], 'admin'],
+                        'fields': [
+                            {
+                                'id': f['id'],
+                                'name': f['name'],
+                                'is_shared': f is shared_field,
+                                'required': False,
+                                'editable_with_roles': [],
+                                'referenced_custom_type_id': None,
+                            }
+                            for f in [field, shared_field]
+                        ],
+                    },
+                )
+        self._add('group', {'name': 'Sales Team', 'members': []})
+        self._add('email_template', {'name': 'Intro', 'subject': 'Hi'})
+        self._add('sms_template', {'name': 'Follow up', 'text': 'Hi'})
+        self._add(
+            'saved_search',
+            {
+                'name': 'Customers',
+                'type': 'lead',
+                'query': 'lead_status:Customer',
+                'is_shared': True,
+                'shared_with': [],
+                'user_id': self.me_id,
+            },
+        )
+
+        lead_statuses = list(self.objects['status/lead'].values())
+        opportunity_statuses = pipeline['statuses']
+        for i in range(leads):
+            created = start + timedelta(minutes=i * 7 + rng.randint(0, 6))
+            updated = min(created + timedelta(days=rng.randint(0, 30)), today)
+            company = (
+                f'{rng.choice(_COMPANY_WORDS)} {rng.choice(_COMPANY_WORDS)} '
+                f'{rng.choice(_COMPANY_SUFFIXES)}'
+            )
+            status = rng.choice(lead_statuses)
+            lead = self._add(
+                'lead',
+                {
+                    'name': company,
+                    'display_name': company,
+                    'status_id': status['id'],
+                    'status_label': status['label'],
+                    'description': '',
+                    'url': None,
+                    'date_created': _format_date(created),
+                    'date_updated': _format_date(updated),
+                    'created_by': rng.choice(user_ids),
+                    'addresses': [
+                        {
+                            'label': 'business',
+                            'city': 'Springfield',
+                            'country': rng.choice(_COUNTRIES),
+                        }
+                    ],
+                    'custom': {'Industry': rng.choice(['SaaS', 'Retail'])},
+                    'contacts': [],
+                    'opportunities': [],
+                    'tasks': [],
+                },
+            )
+
+            for j in range(rng.randint(1, 3)):
+                first, last = rng.choice(_FIRST_NAMES), rng.choice(_LAST_NAMES)
+                domain = company.split()[0].lower()
+                email = f'{first}.{last}@{domain}.com'.lower()
+                contact = self._add(
+                    'contact',
+                    {
+                        'lead_id': lead['id'],
+                        'name': f'{first} {last}',
+                        'display_name': f'{first} {last}',
+                        'title': '',
+                        'emails': [
+                            {
+                                'type': 'office',
+                                'email': email,
+                            }
+                        ],
+                        'phones': [
+                            {
+                                'type': 'office',
+                                'phone': '+1555%07d' % rng.randint(0, 9999999),
+                            }
+                        ],
+                        'urls': [],
+                        'date_created': lead['date_created'],
+                        'date_updated': lead['date_created'],
+                    },
+                )
+                lead['contacts'].append(contact)
+
+            if rng.random() < 0.5:
+                opp_status = rng.choice(opportunity_statuses)
+                opportunity = self._add(
+                    'opportunity',
+                    {
+                        'lead_id': lead['id'],
+                        'user_id': rng.choice(user_ids),
+                        'status_id': opp_status['id'],
+                        'status_label': opp_status['label'],
+                        'status_type': opp_status['type'],
+                        'value': rng.randint(1, 100) * 10000,
+                        'value_period': 'one_time',
+                        'confidence': rng.randint(0, 100),
+                        'note': '',
+                        'date_created': lead['date_created'],
+                        'date_updated': lead['date_created'],
+                    },
+                )
+                lead['opportunities'].append(opportunity)
+
+            if rng.random() < 0.5:
+                task = self._add(
+                    'task',
+                    {
+                        '_type': 'lead',
+                        'lead_id': lead['id'],
+                        'assigned_to': rng.choice(user_ids),
+                        'text': 'Follow up',
+                        'is_complete': rng.random() < 0.5,
+                        'date': _format_date(updated)[:10],
+                        'date_created': lead['date_created'],
+                        'date_updated': lead['date_created'],
+                    },
+                )
+                lead['tasks'].append(task)
+
+            for j in range(activities_per_lead):
+                contact = rng.choice(lead['contacts'])
+                type = rng.choice(['call', 'email', 'note', 'sms'])
+                activity = {
+                    '_type': ACTIVITY_TYPES[type],
+                    'lead_id': lead['id'],
+                    'contact_id': contact['id'],
+                    'user_id': rng.choice(user_ids),
+                    'date_created': _format_date(
+                        created + timedelta(hours=j * 5 + rng.randint(0, 4))
+                    ),
+                    'direction': rng.choice(['inbound', 'outbound']),
+                    'status': 'completed',
+                }
+                if type == 'call':
+                    activity.update(
+                        duration=rng.randint(0, 600),
+                        disposition='answered',
+                        remote_phone=contact['phones'][0]['phone'],
+                        local_phone='+15550000000',
+                        cost=str(rng.randint(0, 50)),
+                        recording_url=None,
+                        note='',
+                    )
+                elif type == 'sms':
+                    activity.update(
+                        text='Hi there',
+                        remote_phone=contact['phones'][0]['phone'],
+                        local_phone='+15550000000',
+                        cost=str(rng.randint(0, 5)),
+                        source='Close.io',
+                    )
+                elif type == 'email':
+                    activity.update(
+                        subject='Hello',
+                        sender='sales@example.com',
+                        to=[contact['emails'][0]['email']],
+                        body_text='Hello',
+                        status='sent',
+                    )
+                else:
+                    activity.update(note='Talked about pricing')
+                activity['date_updated'] = activity['date_created']
+                self._add('activity', activity)
+                self._lead_activity_ids[lead['id']].append(activity['id'])
+
+            for j in range(events_per_lead):
+                self._add_event(
+                    'lead',
+                    'created',
+                    lead,
+                    date=lead['date_created'],
+                    user_id=lead['created_by'],
+                )
+
+        lead_ids = list(self.objects['lead'])
+        for i in range(sequences):
+            sequence = self._add(
+                'sequence',
+                {
+                    'name': f'Sequence {i + 1}',
+                    'status': 'active',
+                    'steps': [],
+                    'date_created': _format_date(start),
+                },
+            )
+            for lead_id in rng.sample(lead_ids, min(len(lead_ids), 20)):
+                lead = self.objects['lead'][lead_id]
+                contact = lead['contacts'][0]
+                self._add(
+                    'sequence_subscription',
+                    {
+                        'sequence_id': sequence['id'],
+                        'lead_id': lead_id,
+                        'contact_id': contact['id'],
+                        'contact_email': contact['emails'][0]['email'],
+                        'sender_email': 'sales@example.com',
+                        'sender_name': 'Sales',
+                        'sender_account_id': self._make_id('emailacct'),
+                        'status': rng.choice(['active', 'paused', 'finished']),
+                        'date_created': lead['date_created'],
+                    },
+                )
+
+        # A few deleted and merged leads, for the event based reports.
+        n = max(1, leads // 100)
+        for lead_id in lead_ids[:n]:
+            self._delete_lead(lead_id, user_id=rng.choice(user_ids))
+        for source_id, destination_id in zip(
+            lead_ids[n : 2 * n], lead_ids[2 * n : 3 * n]
+        ):
+            self._merge_leads(
+                source_id, destination_id, user_id=rng.choice(user_ids)
+            )
+
+    def _add_event(
+        self,
+        object_type,
+        action,
+        obj,
+        date=None,
+        user_id=None,
+        request_id=None,
+        meta=None,
+    ):
+        # Like on the real API, the lead snapshots don't include the nested
+        # contacts, opportunities and tasks.
+        data = copy.deepcopy(
+            {
+                key: value
+                for key, value in obj.items()
+                if key not in ('contacts', 'opportunities', 'tasks')
+            }
+        )
+        date = date or _now()
+        event = {
+            'id': self._make_id('ev'),
+            'object_type': object_type,
+            'object_id': obj['id'],
+            'lead_id': obj.get('lead_id', obj['id']),
+            'action': action,
+            'date_created': date,
+            'date_updated': date,
+            'request_id': request_id or self._make_id('req'),
+            'user_id': user_id,
+            'data': data if action != 'deleted' else None,
+            'previous_data': (
+                data if action in ('deleted', 'updated') else None
+            ),
+            'meta': meta or {},
+        }
+        self.events.append(event)
+        return event
+
+    def _delete_lead(self, lead_id, user_id=None, request_id=None):
+        lead = self.objects['lead'].pop(lead_id)
+        previous_data = dict(lead)
+        children = [
+            ('contact', previous_data.pop('contacts', [])),
+            ('opportunity', previous_data.pop('opportunities', [])),
+            ('task', previous_data.pop('tasks', [])),
+            (
+                'activity',
+                [
+                    self.objects['activity'][activity_id]
+                    for activity_id in self._lead_activity_ids.pop(lead_id, [])
+                    if activity_id in self.objects['activity']
+                ],
+            ),
+        ]
+        self._add_event(
+            'lead',
+            'deleted',
+            previous_data,
+            user_id=user_id,
+            request_id=request_id,
+        )
+        for endpoint, objects in children:
+            for obj in objects:
+                if self.objects[endpoint].pop(obj['id'], None) is None:
+                    continue
+                self._add_event(
+                    endpoint
+                    if endpoint != 'activity'
+                    else f'activity.{obj["_type"].lower()}',
+                    'deleted',
+                    obj,
+                    user_id=user_id,
+                    request_id=request_id,
+                )
+
+    def _merge_leads(self, source_id, destination_id, user_id=None):
+        """
+        Delete the source lead, like a merge does, and log a `merged` event
+        for the destination lead. Unlike the real API, the contacts and
+        activities of the source lead aren't moved over.
+        """
+        if source_id not in self.objects['lead']:
+            raise FakeCloseApiError(404, f'{source_id} not found')
+        destination = self.objects['lead'].get(destination_id)
+        if destination is None:
+            raise FakeCloseApiError(404, f'{destination_id} not found')
+        request_id = self._make_id('req')
+        self._delete_lead(source_id, user_id=user_id, request_id=request_id)
+        self._add_event(
+            'lead',
+            'merged',
+            destination,
+            user_id=user_id,
+            request_id=request_id,
+            meta={
+                'merge_source_lead_id': source_id,
+                'merge_destination_lead_id': destination_id,
+            },
+        )
+        return {}
+
+    # Serving
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/api/v1/'
+
+    def start(self, host='127.0.0.1', port=0):
+        """Serve the API in a background thread and return its base URL."""
+        fake = self
+
+        class Handler(_Handler):
+            api = fake
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True
+        )
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'request_count': self.request_count,
+                'items_served': self.items_served,
+            }
+
+    def _check_rate_limit(self):
+        """Return the `RateLimit` headers, or raise a 429."""
+        if not self.rate_limit:
+            return {}
+        now = time.monotonic()
+        with self._lock:
+            if now - self._window_start >= 1:
+                self._window_start = now
+                self._window_count = 0
+            self._window_count += 1
+            remaining = self.rate_limit - self._window_count
+            reset = max(0.0, 1 - (now - self._window_start))
+        headers = {
+            'RateLimit': 'limit=%d, remaining=%d, reset=%.3f'
+            % (self.rate_limit, max(0, remaining), reset)
+        }
+        if remaining < 0:
+            error = FakeCloseApiError(
+                429,
+                {
+                    'message': 'API call count exceeded for this period',
+                    'rate_reset': reset,
+                },
+            )
+            error.headers = headers
+            raise error
+        return headers
+
+    def handle(self, method, path, params, body):
+        """
+        Return a `(status_code, headers, response)` tuple for a request to
+        `path` (relative to the API base URL).
+        """
+        with self._lock:
+            self.request_count += 1
+        if self.latency:
+            time.sleep(
+                self.latency
+                * self._random.uniform(1 - self.jitter, 1 + self.jitter)
+            )
+        if self.slow_rate and self._random.random() < self.slow_rate:
+            time.sleep(self.slow_latency)
+        try:
+            headers = self._check_rate_limit()
+            if self.error_rate and self._random.random() < self.error_rate:
+                raise FakeCloseApiError(
+                    self.error_status_code, 'Injected error'
+                )
+            with self._lock:
+                response = self._route(method, path, params, body)
+        except FakeCloseApiError as e:
+            return e.status_code, getattr(e, 'headers', {}), {'error': e.error}
+        if response is None:
+            return 204, headers, None
+        return 200, headers, response
+
+    # Routing
+
+    def _route(self, method, path, params, body):
+        parts = [part for part in path.strip('/').split('/') if part]
+        if not parts:
+            raise FakeCloseApiError(404, 'Not found')
+
+        if parts == ['me']:
+            return self._get_me()
+        if parts == ['api_key']:
+            return {'data': [{'organization_id': self.organization_id}]}
+        if parts[0] == 'organization' and len(parts) == 2:
+            return _project(self._get_organization(), _get_fields(params))
+        if parts == ['status', 'opportunity']:
+            return self._list(self._get_opportunity_statuses(), params)
+        if parts[0] == 'custom_field_schema' and len(parts) == 2:
+            return {'fields': list(self.custom_fields[parts[1]].values())}
+        if parts[0] == 'custom_field_schema' and len(parts) == 3:
+            return self._get_custom_activity_schema(parts[2])
+        if parts[0] in ('custom_field', 'custom_fields') and len(parts) >= 2:
+            return self._handle_custom_field(method, parts[1:], params, body)
+        if parts[0] == 'event':
+            return self._list_events(params)
+        if parts[0] == 'bulk_action' and len(parts) >= 2:
+            return self._handle_bulk_action(method, parts[1:], body)
+        if parts[0] == 'lead' and len(parts) == 1 and method == 'GET':
+            return self._search_leads(params)
+        if parts == ['lead', 'merge'] and method == 'POST':
+            return self._merge_leads(body['source'], body['destination'])
+
+        # `activity/call`, `activity/call/<id>` or `activity/<id>`.
+        activity_type = None
+        if parts[0] == 'activity' and len(parts) > 1:
+            if parts[1] in ACTIVITY_TYPES:
+                activity_type = ACTIVITY_TYPES[parts[1]]
+                parts = ['activity'] + parts[2:]
+
+        endpoint = '/'.join(parts[:2]) if parts[0] == 'status' else parts[0]
+        object_id = parts[-1] if len(parts) > endpoint.count('/') + 1 else None
+        if endpoint not in self.objects:
+            raise FakeCloseApiError(404, f'Unknown endpoint {path}')
+
+        if object_id is None:
+            if method == 'GET':
+                objects = self._get_lead_objects(endpoint, params)
+                if activity_type:
+                    objects = [
+                        o for o in objects if o['_type'] == activity_type
+                    ]
+                return self._list(objects, params)
+            if method == 'POST':
+                return self._create(endpoint, body, activity_type)
+            raise FakeCloseApiError(405, 'Method not allowed')
+
+        obj = self.objects[endpoint].get(object_id)
+        if obj is None:
+            raise FakeCloseApiError(404, f'{object_id} not found')
+        if method == 'GET':
+            if endpoint == 'sequence':
+                obj = dict(
+                    obj,
+                    subscription_counts_by_status=self._count_subscriptions(
+                        object_id
+                    ),
+                )
+            return _project(obj, _get_fields(params))
+        if method == 'PUT':
+            return self._update(endpoint, obj, body)
+        if method == 'DELETE':
+            if endpoint == 'lead':
+                self._delete_lead(object_id)
+                return {}
+            del self.objects[endpoint][object_id]
+            lead = self.objects['lead'].get(obj.get('lead_id'))
+            if lead and LEAD_CHILDREN.get(endpoint):
+                lead[LEAD_CHILDREN[endpoint]].remove(obj)
+                self._touch_lead(obj)
+            return {}
+        raise FakeCloseApiError(405, 'Method not allowed')
+
+    def _get_me(self):
+        user = self.objects['user'][self.me_id]
+        return dict(
+            user,
+            organizations=[{'id': self.organization_id, 'name': 'Fake Org'}],
+            memberships=[
+                {
+                    'id': self._membership_id(user),
+                    'organization_id': self.organization_id,
+                    'role_id': 'admin',
+                }
+            ],
+        )
+
+    def _get_memberships(self, inactive):
+        return [
+            {
+                'id': self._membership_id(user),
+                'user_id': user['id'],
+                'user_full_name': f'{user["first_name"]} {user["last_name"]}',
+                'user_email': user['email'],
+                'role_id': 'admin',
+            }
+            for user in self.objects['user'].values()
+            if (user['id'] in self.inactive_user_ids) == inactive
+        ]
+
+    def _membership_id(self, user):
+        return 'mem_' + user['id'].split('_', 1)[1]
+
+    def _count_subscriptions(self, sequence_id):
+        counts = {'active': 0, 'paused': 0, 'finished': 0}
+        for subscription in self.objects['sequence_subscription'].values():
+            if subscription['sequence_id'] == sequence_id:
+                counts[subscription['status']] += 1
+        return counts
+
+    def _get_opportunity_statuses(self):
+        return [
+            status
+            for pipeline in self.objects['pipeline'].values()
+            for status in pipeline['statuses']
+        ]
+
+    def _get_organization(self):
+        return {
+            'id': self.organization_id,
+            'name': 'Fake Org',
+            'memberships': self._get_memberships(inactive=False),
+            'inactive_memberships': self._get_memberships(inactive=True),
+            'lead_statuses': list(self.objects['status/lead'].values()),
+            'pipelines': list(self.objects['pipeline'].values()),
+            'opportunity_statuses': self._get_opportunity_statuses(),
+            'lead_custom_fields': list(self.custom_fields['lead'].values()),
+        }
+
+    def _list(self, objects, params, max_limit=MAX_LIMIT):
+        objects = [o for o in objects if _matches(o, params)]
+        order_by = params.get('_order_by')
+        if order_by:
+            field = order_by.lstrip('-')
+            objects.sort(
+                key=lambda o: str(o.get(field) or ''),
+                reverse=order_by.startswith('-'),
+            )
+        elif objects and 'date_created' in objects[0]:
+            objects.sort(key=lambda o: o['date_created'], reverse=True)
+        return self._paginate(objects, params, max_limit)
+
+    def _paginate(self, objects, params, max_limit):
+        skip = int(params.get('_skip') or 0)
+        limit = min(int(params.get('_limit') or max_limit), max_limit)
+        if skip > self.max_skip:
+            raise FakeCloseApiError(
+                400, f'_skip can be at most {self.max_skip}'
+            )
+        fields = _get_fields(params)
+        page = objects[skip : skip + limit]
+        self.items_served += len(page)
+        return {
+            'data': [_project(o, fields) for o in page],
+            'has_more': skip + limit < len(objects),
+            'total_results': len(objects),
+        }
+
+    def _search_leads(self, params):
+        leads = self._filter_leads(params.get('query', ''))
+        return self._paginate(leads, params, MAX_LEAD_LIMIT)
+
+    def _filter_leads(self, query):
+        """
+        Return the leads matching a search query. Only a small subset of the
+        query language is supported: `*`, `slice:i/N`, `sort:[-]field`,
+        `has:phone_numbers`, `has:email_addresses`, `"custom.Field":*`,
+        `id:lead_1 or id:lead_2 ...`, `date_updated >= "..."` (and the other
+        comparisons of `date_created` and `date_updated`) and free text
+        matched against the lead name, all ANDed (except for the IDs). Any
+        other clause (e.g. `has:calls`, `sms_messages > 0` or `sms(...)`)
+        matches every lead.
+        """
+        leads = list(self.objects['lead'].values())
+        sort = '-date_updated'
+        for field, op, value in _DATE_CLAUSE_RE.findall(query):
+            leads = [
+                lead
+                for lead in leads
+                if _compare(str(lead.get(field) or ''), op, value)
+            ]
+        query = _DATE_CLAUSE_RE.sub(' ', query)
+        query = _IGNORED_CLAUSE_RE.sub(' ', query)
+        terms = _tokenize(query.replace('(', ' ').replace(')', ' '))
+        negate = False
+        ids = set()
+        for term in terms:
+            if term == 'not':
+                negate = True
+                continue
+            if term in ('*', 'and', 'or'):
+                continue
+            if term.startswith('id:'):
+                ids.add(term[len('id:') :])
+                continue
+            if term.startswith('slice:'):
+                slice_num, total_slices = map(int, term[6:].split('/'))
+                leads = [
+                    lead
+                    for lead in leads
+                    if _slice_of(lead['id'], total_slices) == slice_num
+                ]
+            elif term.startswith('sort:'):
+                sort = term[5:]
+                if sort.lstrip('-') in ('created', 'updated'):
+                    sort = sort.replace(
+                        sort.lstrip('-'), f'date_{sort.lstrip("-")}'
+                    )
+            else:
+                leads = [
+                    lead
+                    for lead in leads
+                    if _matches_term(lead, term) != negate
+                ]
+            negate = False
+
+        if ids:
+            leads = [lead for lead in leads if lead['id'] in ids]
+
+        field = sort.lstrip('-')
+        leads.sort(
+            key=lambda lead: str(lead.get(field) or ''),
+            reverse=sort.startswith('-'),
+        )
+        return leads
+
+    def _list_events(self, params):
+        filters = {
+            param: value
+            for param, value in params.items()
+            if param in EVENT_FILTERS
+        }
+        events = [e for e in reversed(self.events) if _matches(e, filters)]
+        offset = 0
+        if params.get('_cursor'):
+            offset = int(base64.urlsafe_b64decode(params['_cursor']))
+        limit = min(int(params.get('_limit') or 50), 50)
+        page = events[offset : offset + limit]
+        cursor_next = None
+        if offset + limit < len(events):
+            cursor_next = base64.urlsafe_b64encode(
+                str(offset + limit).encode()
+            ).decode()
+        self.items_served += len(page)
+        return {
+            'data': [_project(e, _get_fields(params)) for e in page],
+            'cursor_next': cursor_next,
+        }
+
+    def _get_lead_objects(self, endpoint, params):
+        """
+        Return the objects of `endpoint` a list request could match, using
+        the per-lead indexes when it's filtered by `lead_id`, so that the
+        per-lead requests of the scripts don't scan every object.
+        """
+        lead_id = params.get('lead_id')
+        if not lead_id or endpoint not in LEAD_CHILDREN:
+            return self.objects[endpoint].values()
+        if endpoint == 'activity':
+            ids = self._lead_activity_ids.get(lead_id, [])
+        else:
+            lead = self.objects['lead'].get(lead_id, {})
+            ids = [obj['id'] for obj in lead.get(LEAD_CHILDREN[endpoint], [])]
+        return [
+            self.objects[endpoint][id]
+            for id in ids
+            if id in self.objects[endpoint]
+        ]
+
+    def _create(self, endpoint, body, activity_type=None):
+        obj = dict(body or {})
+        obj.pop('id', None)
+        obj.setdefault('date_created', _now())
+        obj['date_updated'] = obj['date_created']
+        if activity_type:
+            obj['_type'] = activity_type
+        if endpoint == 'lead':
+            obj.setdefault('name', '')
+            obj.setdefault('display_name', obj['name'])
+            obj.setdefault('custom', {})
+            contacts = obj.pop('contacts', [])
+            obj.update(contacts=[], opportunities=[], tasks=[])
+            self._add(endpoint, obj)
+            for contact in contacts:
+                self._create('contact', dict(contact, lead_id=obj['id']))
+            self._set_custom_fields(obj, body or {})
+            return obj
+
+        self._add(endpoint, obj)
+        lead = self.objects['lead'].get(obj.get('lead_id'))
+        if lead and endpoint == 'activity':
+            self._lead_activity_ids[lead['id']].append(obj['id'])
+        elif lead and endpoint in LEAD_CHILDREN:
+            lead[LEAD_CHILDREN[endpoint]].append(obj)
+            self._touch_lead(obj)
+        return obj
+
+    def _update(self, endpoint, obj, body):
+        obj.update({k: v for k, v in (body or {}).items() if k != 'id'})
+        self._set_custom_fields(obj, body or {})
+        obj['date_updated'] = _now()
+        if LEAD_CHILDREN.get(endpoint):
+            self._touch_lead(obj)
+        return obj
+
+    def _touch_lead(self, obj):
+        """
+        Bump the `date_updated` of the lead of a contact (or another child
+        object of leads) that changed, like the API does.
+        """
+        lead = self.objects['lead'].get(obj.get('lead_id'))
+        if lead:
+            lead['date_updated'] = _now()
+
+    def _set_custom_fields(self, obj, body):
+        for key, value in body.items():
+            if not key.startswith('custom.'):
+                continue
+            obj.pop(key, None)
+            name = key[len('custom.') :]
+            field = self.custom_fields['lead'].get(name)
+            if field:
+                name = field['name']
+            if value is None:
+                obj.setdefault('custom', {}).pop(name, None)
+            else:
+                obj.setdefault('custom', {})[name] = value
+
+    def _get_custom_activity_schema(self, activity_type_id):
+        activity_type = self.objects['custom_activity'].get(activity_type_id)
+        if activity_type is None:
+            raise FakeCloseApiError(404, f'{activity_type_id} not found')
+        fields = {
+            **self.custom_fields['activity'],
+            **self.custom_fields['shared'],
+        }
+        return {
+            'fields': [
+                fields[field['id']]
+                for field in activity_type['fields']
+                if field['id'] in fields
+            ]
+        }
+
+    def _add_custom_field(self, object_type, name, **extra):
+        field = {
+            'id': self._make_id('cf'),
+            'organization_id': self.organization_id,
+            'name': name,
+            'type': 'text',
+            'accepts_multiple_values': False,
+            'required': False,
+            'editable_with_roles': [],
+            'referenced_custom_type_id': None,
+            'is_shared': object_type == 'shared',
+            'associations': [],
+        }
+        field.update(extra)
+        self.custom_fields[object_type][field['id']] = field
+        return field
+
+    def _handle_custom_field(self, method, parts, params, body):
+        type = parts[0]
+        if type not in self.custom_fields:
+            raise FakeCloseApiError(404, f'Unknown custom field type {type}')
+        fields = self.custom_fields[type]
+        if len(parts) == 1:
+            if method == 'GET':
+                return self._list(fields.values(), params)
+            if method == 'POST':
+                body = dict(body)
+                return self._add_custom_field(type, body.pop('name'), **body)
+        elif parts[1] in fields and len(parts) == 3:
+            # Shared field associations, e.g. with custom activity types.
+            if method == 'POST' and parts[2] == 'association':
+                fields[parts[1]]['associations'].append(body)
+                return body
+        elif parts[1] in fields:
+            if method == 'GET':
+                return fields[parts[1]]
+            if method == 'PUT':
+                fields[parts[1]].update(body)
+                return fields[parts[1]]
+            if method == 'DELETE':
+                del fields[parts[1]]
+                return {}
+        raise FakeCloseApiError(404, 'Not found')
+
+    def _handle_bulk_action(self, method, parts, body):
+        """
+        Bulk edits and deletes are applied right away, so they're finished
+        by the time they're first polled.
+        """
+        action = parts[0]
+        if len(parts) == 2:
+            if parts[1] not in self.bulk_actions:
+                raise FakeCloseApiError(404, 'Not found')
+            return self.bulk_actions[parts[1]]
+        if method != 'POST' or action not in ('edit', 'delete', 'email'):
+            raise FakeCloseApiError(404, 'Not found')
+
+        leads = self._filter_leads(body.get('query', ''))
+        for lead in leads:
+            if action == 'delete':
+                self._delete_lead(lead['id'])
+            elif action == 'edit':
+                self._apply_bulk_edit(lead, body)
+        bulk_action = {
+            'id': self._make_id(f'bulk{action}'),
+            'status': 'finished',
+            'n_leads': len(leads),
+            'n_leads_processed': len(leads),
+        }
+        self.bulk_actions[bulk_action['id']] = bulk_action
+        return bulk_action
+
+    def _apply_bulk_edit(self, lead, body):
+        if body['type'] == 'set_lead_status':
+            status = self.objects['status/lead'][body['lead_status_id']]
+            self._update(
+                'lead',
+                lead,
+                {'status_id': status['id'], 'status_label': status['label']},
+            )
+            return
+
+        field = body.get('custom_field_name') or body.get('custom_field_id')
+        value = body.get('custom_field_value')
+        if body['type'] == 'clear_custom_field':
+            value = None
+        self._update('lead', lead, {f'custom.{field}': value})
+
+
+def _get_fields(params):
+    fields = params.get('_fields')
+    return fields.split(',') if fields else None
+
+
+def _tokenize(query):
+    tokens, token, quoted = [], '', False
+    for char in query:
+        if char == '"':
+            quoted = not quoted
+            token += char
+        elif char.isspace() and not quoted:
+            if token:
+                tokens.append(token)
+            token = ''
+        else:
+            token += char
+    if token:
+        tokens.append(token)
+    return tokens
+
+
+def _matches_term(lead, term):
+    if term == 'has:phone_numbers':
+        return any(c['phones'] for c in lead['contacts'])
+    if term == 'has:email_addresses':
+        return any(c['emails'] for c in lead['contacts'])
+    if term.startswith('"custom.') and term.endswith('":*'):
+        return bool(lead.get('custom', {}).get(term[len('"custom.') : -3]))
+    if ':' in term:
+        return True
+    return term.strip('"').lower() in lead['display_name'].lower()
+
+
+_COMPARISONS = {'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+
+
+def _compare(actual, op, value):
+    return {
+        '>': actual > value,
+        '>=': actual >= value,
+        '<': actual < value,
+        '<=': actual <= value,
+    }[op]
+
+
+def _matches(obj, params):
+    """Return whether `obj` matches the field filters in `params`."""
+    for param, value in params.items():
+        if param.startswith('_') or param == 'query':
+            continue
+        field, _, op = param.partition('__')
+        if field not in obj:
+            continue
+        actual = obj[field]
+        if isinstance(actual, bool):
+            actual = 'true' if actual else 'false'
+            value = value.lower()
+        actual = '' if actual is None else str(actual)
+        if op == 'in':
+            if actual not in value.split(','):
+                return False
+        elif op in _COMPARISONS:
+            if not _compare(actual, _COMPARISONS[op], value):
+                return False
+        elif actual != value:
+            return False
+    return True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # The headers and the body are written separately, so without this
+    # every keep-alive response waits for a delayed ACK.
+    disable_nagle_algorithm = True
+    api = None
+
+    def _handle(self, method):
+        url = urlparse(self.path)
+        path = url.path
+        if path.startswith('/api/v1'):
+            path = path[len('/api/v1') :]
+        params = dict(parse_qsl(url.query, keep_blank_values=True))
+
+        body = None
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            body = json.loads(self.rfile.read(length))
+
+        if url.path == STATS_PATH:
+            status_code, headers, response = 200, {}, self.api.get_stats()
+        else:
+            status_code, headers, response = self.api.handle(
+                method, path, params, body
+            )
+        content = b'' if response is None else json.dumps(response).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(content)
+        except ConnectionError:
+            # The client gave up on the request, e.g. a hedged request whose
+            # duplicate came back first.
+            self.close_connection = True
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serve a fake Close API with synthetic data on localhost'
+    )
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--leads', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--activities-per-lead', type=int, default=5)
+    parser.add_argument(
+        '--latency',
+        type=float,
+        default=0.0,
+        help='Seconds added to every response',
+    )
+    parser.add_argument(
+        '--jitter',
+        type=float,
+        default=0.0,
+        help='Randomize the latency by +/- this fraction of itself',
+    )
+    parser.add_argument(
+        '--slow-rate',
+        type=float,
+        default=0.0,
+        help='Share of requests that take --slow-latency seconds longer',
+    )
+    parser.add_argument(
+        '--slow-latency',
+        type=float,
+        default=1.0,
+        help='Seconds added to the slow requests',
+    )
+    parser.add_argument(
+        '--rate-limit', type=int, help='Maximum number of requests per second'
+    )
+    parser.add_argument(
+        '--error-rate',
+        type=float,
+        default=0.0,
+        help='Share of requests that fail with a 503',
+    )
+    args = parser.parse_args()
+
+    fake_api = FakeCloseApi(
+        seed=args.seed,
+        leads=args.leads,
+        users=args.users,
+        activities_per_lead=args.activities_per_lead,
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit=args.rate_limit,
+        error_rate=args.error_rate,
+        slow_rate=args.slow_rate,
+        slow_latency=args.slow_latency,
+    )
+    base_url = fake_api.start(args.host, args.port)
+    print(f'Serving a fake Close API at {base_url}', flush=True)
+    try:
+        fake_api._thread.join()
+    except KeyboardInterrupt:
+        fake_api.stop()
@@ -1,15 +1,20 @@
 import argparse
 import csv
-import math
 from operator import itemgetter
 
-import gevent.monkey
-from closeio_api import Client as CloseIO_API
-from gevent.pool import Pool
+from scripts.runtime import bootstrap, create_pool
 
-gevent.monkey.patch_all()
+bootstrap()  # isort: split
 
-pool = Pool(7)
+from scripts.CloseApiWrapper import CloseApiWrapper
+from scripts.contact_keys import (
+    DEFAULT_PHONE_REGION,
+    KeyCanonicalizer,
+    canonicalize_email,
+    canonicalize_phone,
+)
+
+pool = create_pool(7)
 
 parser = argparse.ArgumentParser(
     description='Find duplicate contacts on a lead in your Close org via contact_name, email address, or phone number'
@@ -23,20 +28,24 @@ parser.add_argument(
     required=False,
     help="Specify a field to compare uniqueness",
 )
+parser.add_argument(
+    '--phone-region',
+    default=DEFAULT_PHONE_REGION,
+    help='Region of the phone numbers without a country code (default: %(default)s)',
+)
 args = parser.parse_args()
 
+# Email addresses and phone numbers are compared in their canonical form, so
+# that e.g. "+1 (650) 555-1234" and "16505551234" match
+canonical_emails = KeyCanonicalizer(canonicalize_email)
+canonical_phones = KeyCanonicalizer(
+    canonicalize_phone, region=args.phone_region
+)
+
 # Initialize Close API Wrapper
-api = CloseIO_API(args.api_key)
+api = CloseApiWrapper(args.api_key)
 org_name = api.get('me')['organizations'][0]['name'].replace('/', '')
 
-# Calculate number of slices necessary to get all leads
-total_leads = api.get(
-    'lead', params={'_limit': 0, 'query': 'sort:created contacts > 1'}
-)['total_results']
-total_slices = int(math.ceil(float(total_leads) / 1000))
-slices = range(1, total_slices + 1)
-leads = []
-
 
 # Write data to a CSV
 def writeCSV(type_name, items, ordered_keys):
@@ -54,28 +63,6 @@ def writeCSV(type_name, items, ordered_keys):
     finally:
         f.close()
 
-    # Get leads for each slice
-
-
-def getLeadsSlice(slice_num):
-    print(f"Getting lead slice {slice_num} of {total_slices}...")
-    has_more = True
-    offset = 0
-    while has_more:
-        resp = api.get(
-            'lead',
-            params={
-                '_skip': offset,
-                'query': 'sort:created slice:%s/%s contacts > 1'
-                % (slice_num, total_slices),
-                '_fields': 'id,display_name,contacts,date_created',
-            },
-        )
-        for lead in resp['data']:
-            leads.append(lead)
-        offset += len(resp['data'])
-        has_more = resp['has_more']
-
 
 # Add to a list of duplicates for contact names
 def getDuplicatesForContactName(contact_name):
@@ -125,8 +112,13 @@ def getDuplicatesForPhone(phone):
 
 
 print("Getting Leads...")
-pool.map(getLeadsSlice, slices)
-leads = sorted(leads, key=itemgetter('date_created'))
+leads = sorted(
+    api.iter_lead_slices(
+        'contacts > 1',
+        fields=['id', 'display_name', 'contacts', 'date_created'],
+    ),
+    key=itemgetter('date_created'),
+)
 
 # Process duplicates
 contact_name_duplicates = []
@@ -134,7 +126,7 @@ email_duplicates = []
 phone_duplicates = []
 print("Processing contacts on each lead...")
 
-for lead in leads:
+for lead_num, lead in enumerate(leads, start=1):
     contact_names = {}
     emails = {}
     phones = {}
@@ -158,26 +150,22 @@ for lead in leads:
         # Populate a dictionary of emails, and keep track of those that appear more than once
         if args.field in ['all', 'email']:
             for email in contact['emails']:
-                if (
-                    emails.get(email['email'])
-                    and contact not in emails[email['email']]
-                ):
-                    emails[email['email']].append(contact)
-                    keys_with_dupes_email.append(email['email'])
-                elif not emails.get(email['email']):
-                    emails[email['email']] = [contact]
+                email = canonical_emails(email['email'])
+                if emails.get(email) and contact not in emails[email]:
+                    emails[email].append(contact)
+                    keys_with_dupes_email.append(email)
+                elif not emails.get(email):
+                    emails[email] = [contact]
 
         # Populate a dictionary of phones, and keep track of those that appear more than once
         if args.field in ['all', 'phone']:
             for phone in contact['phones']:
-                if (
-                    phones.get(phone['phone'])
-                    and contact not in phones[phone['phone']]
-                ):
-                    phones[phone['phone']].append(contact)
-                    keys_with_dupes_phone.append(phone['phone'])
-                elif not phones.get(phone['phone']):
-                    phones[phone['phone']] = [contact]
+                phone = canonical_phones(phone['phone'])
+                if phones.get(phone) and contact not in phones[phone]:
+                    phones[phone].append(contact)
+                    keys_with_dupes_phone.append(phone)
+                elif not phones.get(phone):
+                    phones[phone] = [contact]
 
     # Write data to appropriate arrays
     if args.field in ['all', 'contact_name']:
@@ -197,7 +185,7 @@ for lead in leads:
             keys_with_dupes_phone = list(set(keys_with_dupes_phone))
             pool.map(getDuplicatesForPhone, keys_with_dupes_phone)
 
-    print(f"{(leads.index(lead) + 1)} of {len(leads)}: {lead['id']}")
+    print(f"{lead_num} of {len(leads)}: {lead['id']}")
 
 if args.field in ['all', 'contact_name']:
     # Sort the duplicates alphabetically by lead name and then contact name and write them to a CSV
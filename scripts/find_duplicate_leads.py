@@ -1,16 +1,18 @@
 import argparse
 import csv
-import math
+from functools import partial
 from operator import itemgetter
 
-import gevent.monkey
+from scripts.runtime import bootstrap
 
-gevent.monkey.patch_all()
-from urllib.parse import urlparse
-from closeio_api import Client as CloseIO_API
-from gevent.pool import Pool
+bootstrap()  # isort: split
 
-pool = Pool(7)
+from scripts.CloseApiWrapper import CloseApiWrapper
+from scripts.contact_keys import DEFAULT_PHONE_REGION
+from scripts.dedupe import FUZZY_FIELDS, DuplicateIndex
+from scripts.dedupe_store import DuplicateStore, get_watermark
+from scripts.fuzzy import DEFAULT_FUZZY_THRESHOLD, FuzzyMatcher
+from scripts.records import LeadRecord
 
 parser = argparse.ArgumentParser(
     description='Find duplicate leads in your Close org via lead name, email address, phone number, or lead url hostname'
@@ -36,22 +38,43 @@ parser.add_argument(
     '-c',
     help="Specify the custom field name if you're deduplicating by `custom` field",
 )
+parser.add_argument(
+    '--phone-region',
+    default=DEFAULT_PHONE_REGION,
+    help='Region of the phone numbers without a country code (default: %(default)s)',
+)
+parser.add_argument(
+    '--fuzzy',
+    action='store_true',
+    help='Also match lead and contact names that are only similar (e.g. "Acme Inc." and "ACME, Inc")',
+)
+parser.add_argument(
+    '--fuzzy-threshold',
+    type=float,
+    default=DEFAULT_FUZZY_THRESHOLD,
+    help='Minimum similarity (0 to 1) of names matched with --fuzzy',
+)
+parser.add_argument(
+    '--index',
+    help='SQLite file to keep the duplicate index in. The first run fetches every lead, later runs only fetch the leads updated or deleted since the previous run, and only report the clusters that are new or changed',
+)
+parser.add_argument(
+    '--rebuild',
+    action='store_true',
+    help='Fetch every lead and rebuild the --index from scratch',
+)
 args = parser.parse_args()
+if args.index and args.fuzzy:
+    parser.error('--fuzzy can\'t be used with --index')
+if args.rebuild and not args.index:
+    parser.error('--rebuild needs an --index')
 
 # Initialize Close API Wrapper
-api = CloseIO_API(args.api_key)
+api = CloseApiWrapper(args.api_key)
 organization = api.get('me')['organizations'][0]
 org_id = organization['id']
 org_name = organization['name']
 
-# Calculate number of slices necessary to get all leads
-total_leads = api.get('lead', params={'_limit': 0, 'query': 'sort:created'})[
-    'total_results'
-]
-total_slices = int(math.ceil(float(total_leads) / 1000))
-slices = range(1, total_slices + 1)
-leads = []
-
 
 # Write data to a CSV
 def write_to_csv_file(type_name, items, ordered_keys):
@@ -89,358 +112,177 @@ if args.field == 'custom':
         exit(1)
 
 
-def get_leads_slice(slice_num):
-    print(f"Getting lead slice {slice_num} of {total_slices}...")
-    has_more = True
-    offset = 0
-    while has_more:
-        resp = api.get(
-            'lead',
-            params={
-                '_skip': offset,
-                'query': 'sort:created slice:%s/%s'
-                % (slice_num, total_slices),
-                '_fields': ','.join(lead_params_fields),
-            },
-        )
-        leads.extend(resp['data'])
-
-        offset += len(resp['data'])
-        has_more = resp['has_more']
-
-
-# Add to a list of duplicates for lead names
-def get_duplicates_for_lead_name(lead_name):
-    for dupe in lead_names[lead_name]:
-        lead_name_duplicates.append(
-            {
-                'Lead Name': dupe['display_name'],
-                'Status Label': dupe['status_label'],
-                'Lead ID': dupe['id'],
-                'Lead Date Created': dupe['date_created'],
-                'Close URL': 'https://app.close.com/lead/%s/' % dupe['id'],
-            }
-        )
-    print(
-        f"{(keys_with_dupes_lead_name.index(lead_name) + 1)} of {len(keys_with_dupes_lead_name)}: {lead_name}"
-    )
-
-
-def get_duplicates_for_custom_field(custom_field_value):
-    custom_field_name = args.custom_field_name
-
-    for dupe in custom_fields[custom_field_value]:
-        custom_field_duplicates.append(
-            {
-                f'custom.{custom_field_name}': custom_field_value,
-                'Lead Name': dupe['display_name'],
-                'Status Label': dupe['status_label'],
-                'Lead ID': dupe['id'],
-                'Lead Date Created': dupe['date_created'],
-                'Close URL': 'https://app.close.com/lead/%s/' % dupe['id'],
-            }
+# Column with the duplicated value, and report name, of every field. Lead
+# names are reported as they are, rather than lowercased, unless they're
+# matched fuzzily and the rows need the name they were matched on.
+def get_report_columns(field):
+    if field == 'lead_name' and args.fuzzy:
+        return 'Matched Lead Name', 'Lead Name'
+    if field == 'custom':
+        return f'custom.{args.custom_field_name}', (
+            f'Custom - {args.custom_field_name}'
         )
-    print(
-        f"{(keys_with_dupes_custom_field.index(custom_field_value) + 1)} of {len(keys_with_dupes_custom_field)}: {custom_field_value}"
-    )
-
+    return {
+        'lead_name': (None, 'Lead Name'),
+        'contact_name': ('Contact Name', 'Contact Name'),
+        'email': ('Email Address', 'Email'),
+        'phone': ('Phone Number', 'Phone'),
+        'url': ('URL Hostname', 'URL'),
+    }[field]
+
+
+def get_lead_row(lead):
+    return {
+        'Lead Name': lead.display_name,
+        'Status Label': lead.status_label,
+        'Lead ID': lead.id,
+        'Lead Date Created': lead.date_created,
+        'Close URL': 'https://app.close.com/lead/%s/' % lead.id,
+    }
+
+
+lead_columns = [
+    'Lead Name',
+    'Status Label',
+    'Lead Date Created',
+    'Lead ID',
+    'Close URL',
+]
 
-# Add to a list of duplicates for contact emails
-def get_duplicates_for_email(email):
-    for dupe in emails[email]:
-        email_duplicates.append(
-            {
-                'Email Address': email,
-                'Lead Name': dupe['display_name'],
-                'Status Label': dupe['status_label'],
-                'Lead ID': dupe['id'],
-                'Lead Date Created': dupe['date_created'],
-                'Close URL': 'https://app.close.com/lead/%s/' % dupe['id'],
-            }
-        )
-    print(
-        f"{(keys_with_dupes_email.index(email) + 1)} of {len(keys_with_dupes_email)}: {email}"
-    )
+if args.field == 'all':
+    fields = ['lead_name', 'email', 'contact_name', 'phone', 'url']
+else:
+    fields = [args.field]
+index = DuplicateIndex(
+    fields,
+    custom_field_name=args.custom_field_name,
+    fuzzy_fields=FUZZY_FIELDS if args.fuzzy else (),
+    fuzzy_matcher=FuzzyMatcher(threshold=args.fuzzy_threshold),
+    phone_region=args.phone_region,
+)
+# Leads are kept as compact records rather than their JSON, so that large
+# orgs fit in memory.
+lead_record = partial(
+    LeadRecord.from_json,
+    custom_fields=[args.custom_field_name] if args.field == 'custom' else (),
+)
 
 
-# Add to a list of duplicates for contact emails
-def get_duplicates_for_contact_name(contact_name):
-    for dupe in contact_names[contact_name]:
-        contact_name_duplicates.append(
-            {
-                'Contact Name': contact_name,
-                'Lead Name': dupe['display_name'],
-                'Status Label': dupe['status_label'],
-                'Lead ID': dupe['id'],
-                'Lead Date Created': dupe['date_created'],
-                'Close URL': 'https://app.close.com/lead/%s/' % dupe['id'],
-            }
+def update_index(store, watermark):
+    """
+    Update the stored index with the leads updated or deleted since its
+    watermark, and report the clusters that are new or changed.
+    """
+    since = store.watermark
+    print(f"Getting Leads updated since {since}...")
+    leads = list(
+        api.iter_lead_slices(
+            query=f'date_updated >= "{since}"',
+            fields=lead_params_fields,
+            record=lead_record,
         )
-    print(
-        f"{(keys_with_dupes_contact_name.index(contact_name) + 1)} of {len(keys_with_dupes_contact_name)}: {contact_name}"
     )
-
-
-# Add to a list of duplicates for contact phones
-def get_duplicates_for_phone(phone):
-    for dupe in phones[phone]:
-        phone_duplicates.append(
-            {
-                'Phone Number': phone,
-                'Lead Name': dupe['display_name'],
-                'Status Label': dupe['status_label'],
-                'Lead ID': dupe['id'],
-                'Lead Date Created': dupe['date_created'],
-                'Close URL': 'https://app.close.com/lead/%s/' % dupe['id'],
-            }
+    print("Getting Leads deleted...")
+    deleted_ids = {
+        event['lead_id']
+        for page in api.iter_pages(
+            'event',
+            params={
+                'object_type': 'lead',
+                'action': 'deleted',
+                'date_updated__gte': since,
+            },
         )
-    print(
-        f"{(keys_with_dupes_phone.index(phone) + 1)} of {len(keys_with_dupes_phone)}: {phone}"
-    )
+        for event in page
+    }
+    print(f"{len(leads)} leads updated, {len(deleted_ids)} leads deleted")
 
-
-# Add to a list of duplicates for lead URLs
-def get_duplicates_for_url(url):
-    for dupe in urls[url]:
-        url_duplicates.append(
-            {
-                'URL Hostname': url,
-                'Lead Name': dupe['display_name'],
-                'Status Label': dupe['status_label'],
-                'Lead ID': dupe['id'],
-                'Lead Date Created': dupe['date_created'],
-                'Close URL': 'https://app.close.com/lead/%s/' % dupe['id'],
-            }
-        )
+    changes, removed = store.update(leads, deleted_ids, watermark)
     print(
-        f"{(keys_with_dupes_url.index(url) + 1)} of {len(keys_with_dupes_url)}: {url}"
-    )
-
-
-print("Getting Leads...")
-pool.map(get_leads_slice, slices)
-leads = sorted(leads, key=itemgetter('date_created'))
-
-# Process duplicates
-lead_names = {}
-custom_fields = {}
-contact_names = {}
-emails = {}
-phones = {}
-urls = {}
-keys_with_dupes_lead_name = []
-keys_with_dupes_custom_field = []
-keys_with_dupes_contact_name = []
-keys_with_dupes_email = []
-keys_with_dupes_phone = []
-keys_with_dupes_url = []
-
-for lead in leads:
-    if args.field in ['all', 'lead_name']:
-        # Pouplate a dictionary of duplicate lead names, and keep track of those that appear more than once
-        lower_name = lead['display_name'].strip().lower()
-        if lead_names.get(lower_name) and lead not in lead_names[lower_name]:
-            lead_names[lower_name].append(lead)
-            keys_with_dupes_lead_name.append(lower_name)
-        elif not lead_names.get(lower_name):
-            lead_names[lower_name] = [lead]
-
-    if args.field == 'custom':
-        custom_field_value = lead['custom'].get(args.custom_field_name)
-        if isinstance(custom_field_value, list):
-            custom_field_value = ','.join(custom_field_value)
-
-        if custom_field_value:
-            if (
-                custom_fields.get(custom_field_value)
-                and lead not in custom_fields[custom_field_value]
-            ):
-                custom_fields[custom_field_value].append(lead)
-                keys_with_dupes_custom_field.append(custom_field_value)
-            elif not custom_fields.get(custom_field_value):
-                custom_fields[custom_field_value] = [lead]
-
-    if args.field in ['all', 'url']:
-        # Pouplate a dictionary of duplicate lead urls, and keep track of those that appear more than once
-        if lead.get('url'):
-            host_name = urlparse(lead['url']).hostname.lower()
-            if urls.get(host_name) and lead not in urls[host_name]:
-                urls[host_name].append(lead)
-                keys_with_dupes_url.append(host_name)
-            elif not urls.get(host_name):
-                urls[host_name] = [lead]
-
-    if args.field in ['all', 'email', 'phone', 'contact_name']:
-        for contact in lead['contacts']:
-            if args.field in ['all', 'contact_name']:
-                if not contact['name']:
-                    continue
-
-                contact_name = contact['name'].strip().lower()
-                if (
-                    contact_names.get(contact_name)
-                    and lead not in contact_names[contact_name]
-                ):
-                    contact_names[contact_name].append(lead)
-                    keys_with_dupes_contact_name.append(contact_name)
-                elif not contact_names.get(contact_name):
-                    contact_names[contact_name] = [lead]
-
-            # Populate a dictionary of emails, and keep track of those that appear more than once
-            if args.field in ['all', 'email']:
-                for email in contact['emails']:
-                    if (
-                        emails.get(email['email'])
-                        and lead not in emails[email['email']]
-                    ):
-                        emails[email['email']].append(lead)
-                        keys_with_dupes_email.append(email['email'])
-                    elif not emails.get(email['email']):
-                        emails[email['email']] = [lead]
-
-            # Populate a dictionary of phones, and keep track of those that appear more than once
-            if args.field in ['all', 'phone']:
-                for phone in contact['phones']:
-                    if (
-                        phones.get(phone['phone'])
-                        and lead not in phones[phone['phone']]
-                    ):
-                        phones[phone['phone']].append(lead)
-                        keys_with_dupes_phone.append(phone['phone'])
-                    elif not phones.get(phone['phone']):
-                        phones[phone['phone']] = [lead]
-
-if args.field in ['all', 'lead_name']:
-    lead_name_duplicates = []
-    print("Getting lead name duplicate data...")
-    keys_with_dupes_lead_name = list(set(keys_with_dupes_lead_name))
-    pool.map(get_duplicates_for_lead_name, keys_with_dupes_lead_name)
-
-    # Sort the duplicates alphabetically and write them to a CSV
-    lead_name_duplicates = sorted(
-        lead_name_duplicates, key=itemgetter('Lead Name')
+        f"{len(changes)} new or changed clusters of duplicate leads, "
+        f"{removed} clusters without duplicates anymore"
     )
+    rows = []
+    for cluster_num, (change, cluster) in enumerate(changes, start=1):
+        for dupe in cluster:
+            row = get_lead_row(dupe)
+            row['Cluster'] = cluster_num
+            row['Change'] = change
+            row['Matched On'] = ','.join(store.index.get_matched_fields(dupe))
+            rows.append(row)
     write_to_csv_file(
-        "Lead Name",
-        lead_name_duplicates,
-        [
-            'Lead Name',
-            'Status Label',
-            'Lead Date Created',
-            'Lead ID',
-            'Close URL',
-        ],
+        "Changed Cluster",
+        rows,
+        ['Cluster', 'Change', 'Matched On'] + lead_columns,
     )
 
-if args.field == 'custom':
-    custom_field_name = args.custom_field_name
-
-    custom_field_duplicates = []
-    print(f"Getting custom field `{custom_field_name}` duplicate data...")
-    keys_with_dupes_lead_name = list(set(keys_with_dupes_custom_field))
-    pool.map(get_duplicates_for_custom_field, keys_with_dupes_custom_field)
 
-    # Sort the duplicates alphabetically and write them to a CSV
-    custom_field_duplicates = sorted(
-        custom_field_duplicates, key=itemgetter(f'custom.{custom_field_name}')
-    )
-    write_to_csv_file(
-        f'Custom - {custom_field_name}',
-        custom_field_duplicates,
-        [
-            f'custom.{custom_field_name}',
-            'Lead Name',
-            'Status Label',
-            'Lead Date Created',
-            'Lead ID',
-            'Close URL',
-        ],
-    )
-
-if args.field in ['all', 'email']:
-    email_duplicates = []
-    print("Getting email duplicate data...")
-    keys_with_dupes_email = list(set(keys_with_dupes_email))
-    pool.map(get_duplicates_for_email, keys_with_dupes_email)
+store = None
+if args.index:
+    store = DuplicateStore(args.index, index)
+    # Taken before any lead is fetched, so that the leads updated while
+    # they're fetched get fetched again by the next run.
+    watermark = get_watermark()
+    if store.watermark and not args.rebuild:
+        update_index(store, watermark)
+        exit(0)
+    print(f"Building the duplicate index in {args.index}")
 
-    # Sort the duplicates alphabetically and write them to a CSV
-    email_duplicates = sorted(
-        email_duplicates, key=itemgetter('Email Address')
-    )
-    write_to_csv_file(
-        "Email",
-        email_duplicates,
-        [
-            'Email Address',
-            'Lead Name',
-            'Status Label',
-            'Lead Date Created',
-            'Lead ID',
-            'Close URL',
-        ],
-    )
+print("Getting Leads...")
+# Leads are indexed as they come in.
+index.add_all(
+    api.iter_lead_slices(fields=lead_params_fields, record=lead_record)
+)
+print(f"Indexed {index.lead_count} leads")
+
+for field in index.fields:
+    key_column, report_name = get_report_columns(field)
+    print(f"Getting {report_name} duplicate data...")
+    duplicates = index.get_duplicates(field)
+    print(f"{len(duplicates)} values shared by more than one lead")
+    if field in index.fuzzy_fields:
+        print(
+            f"Compared {index.candidate_pairs[field]} candidate pairs, "
+            f"skipped {index.skipped_blocks[field]} blocks of more than "
+            f"{index.fuzzy_matcher.max_block_size} names"
+        )
 
-if args.field in ['all', 'contact_name']:
-    contact_name_duplicates = []
-    print("Getting contact duplicate data...")
-    keys_with_dupes_contact_name = list(set(keys_with_dupes_contact_name))
-    pool.map(get_duplicates_for_contact_name, keys_with_dupes_contact_name)
+    rows = []
+    for key, dupes in duplicates.items():
+        for dupe in dupes:
+            row = get_lead_row(dupe)
+            if key_column:
+                row[key_column] = key
+            rows.append(row)
 
     # Sort the duplicates alphabetically and write them to a CSV
-    contact_name_duplicates = sorted(
-        contact_name_duplicates, key=itemgetter('Contact Name')
-    )
+    if key_column:
+        columns = [key_column] + lead_columns
+    else:
+        key_column, columns = 'Lead Name', lead_columns
     write_to_csv_file(
-        "Contact Name",
-        contact_name_duplicates,
-        [
-            'Contact Name',
-            'Lead Name',
-            'Status Label',
-            'Lead Date Created',
-            'Lead ID',
-            'Close URL',
-        ],
+        report_name, sorted(rows, key=itemgetter(key_column)), columns
     )
 
-if args.field in ['all', 'phone']:
-    phone_duplicates = []
-    print("Getting phone duplicate data...")
-    keys_with_dupes_phone = list(set(keys_with_dupes_phone))
-    pool.map(get_duplicates_for_phone, keys_with_dupes_phone)
-
-    # Sort the duplicates alphabetically and write them to a CSV
-    phone_duplicates = sorted(phone_duplicates, key=itemgetter('Phone Number'))
+if len(index.fields) > 1:
+    # Leads that are duplicates on any field (directly, or through other
+    # leads), so that every group of duplicates can be merged in one go.
+    print("Getting duplicate clusters...")
+    clusters = index.get_clusters()
+    print(f"{len(clusters)} clusters of duplicate leads")
+    rows = []
+    for cluster_num, cluster in enumerate(clusters, start=1):
+        for dupe in cluster:
+            row = get_lead_row(dupe)
+            row['Cluster'] = cluster_num
+            row['Matched On'] = ','.join(index.get_matched_fields(dupe))
+            rows.append(row)
     write_to_csv_file(
-        "Phone",
-        phone_duplicates,
-        [
-            'Phone Number',
-            'Lead Name',
-            'Status Label',
-            'Lead Date Created',
-            'Lead ID',
-            'Close URL',
-        ],
+        "Cluster",
+        rows,
+        ['Cluster', 'Matched On'] + lead_columns,
     )
 
-if args.field in ['all', 'url']:
-    url_duplicates = []
-    print("Getting URL duplicate data...")
-    keys_with_dupes_url = list(set(keys_with_dupes_url))
-    pool.map(get_duplicates_for_url, keys_with_dupes_url)
-
-    # Sort the duplicates alphabetically and write them to a CSV
-    url_duplicates = sorted(url_duplicates, key=itemgetter('URL Hostname'))
-    write_to_csv_file(
-        "URL",
-        url_duplicates,
-        [
-            'URL Hostname',
-            'Lead Name',
-            'Status Label',
-            'Lead Date Created',
-            'Lead ID',
-            'Close URL',
-        ],
-    )
+if store is not None:
+    print(f"Saving the duplicate index to {args.index}...")
+    store.rebuild(watermark)
@@ -0,0 +1,279 @@
+"""
+Fuzzy matching of lead and contact names, for finding near duplicates
+("Acme Inc." and "ACME, Inc", "Jon Smith" and "John Smith") among millions
+of names without comparing every pair of them.
+
+Names are normalized first (see `normalize_name`), which already makes most
+variants of a company name equal. The remaining candidates for a match are
+found by blocking: names only get compared if they share a phonetic key
+(the Soundex codes of their words) or a band of their MinHash signature (a
+sketch of their character trigrams, so that two names with most trigrams
+in common are likely to share a band). Only those candidate pairs are
+scored with a string similarity, which keeps the matching roughly linear in
+the number of names.
+
+The similarity is rapidfuzz's token sort ratio when rapidfuzz is installed
+(`pip install rapidfuzz`), and `difflib`'s ratio of the sorted words
+otherwise.
+"""
+import difflib
+import random
+import re
+import unicodedata
+import zlib
+from array import array
+from collections import defaultdict
+
+try:
+    from rapidfuzz import fuzz
+except ImportError:
+    fuzz = None
+
+# Names at least this similar (from 0 to 1) are considered duplicates.
+DEFAULT_FUZZY_THRESHOLD = 0.85
+
+# MinHash signatures have `NUM_PERM` values, split into bands of `LSH_ROWS`
+# values. Two names share a band with a probability of 1 - (1 - j^r)^b for
+# a trigram Jaccard similarity j, i.e. more often than not from j ~ 0.5.
+NUM_PERM = 32
+LSH_ROWS = 4
+SHINGLE_SIZE = 3
+
+# Blocks with more distinct names than this (e.g. the phonetic key of a
+# very common first name) are too unspecific to be worth comparing, so
+# they're skipped altogether. Their names are still compared in the other
+# blocks they share.
+MAX_BLOCK_SIZE = 100
+
+# Words that don't tell companies apart.
+COMPANY_STOP_WORDS = frozenset(
+    [
+        'ag',
+        'and',
+        'co',
+        'company',
+        'corp',
+        'corporation',
+        'gmbh',
+        'inc',
+        'incorporated',
+        'limited',
+        'llc',
+        'llp',
+        'lp',
+        'ltd',
+        'plc',
+        'pty',
+        'sa',
+        'sarl',
+        'the',
+    ]
+)
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_NON_WORD = re.compile(r'[\W_]+')
+
+_SOUNDEX_CODES = {
+    letter: str(code)
+    for code, letters in enumerate(
+        ['aehiouwy', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r']
+    )
+    for letter in letters
+}
+
+
+def normalize_name(name, stop_words=()):
+    """
+    Return `name` lowercased, without accents or punctuation and without
+    the `stop_words`, with single spaces between the words. If nothing but
+    stop words is left, they're kept.
+    """
+    name = unicodedata.normalize('NFKD', name.lower())
+    name = ''.join(char for char in name if not unicodedata.combining(char))
+    words = _NON_WORD.sub(' ', name).split()
+    kept = [word for word in words if word not in stop_words]
+    return ' '.join(kept or words)
+
+
+def soundex(word):
+    """Return the Soundex code of `word` (e.g. `r163` for robert)."""
+    codes = [_SOUNDEX_CODES.get(char) for char in word if char.isalpha()]
+    letters = [char for char in word if char.isalpha()]
+    if not letters:
+        return ''
+    result = letters[0]
+    previous = codes[0]
+    for char, code in zip(letters[1:], codes[1:]):
+        if code is None:
+            continue
+        if code != '0' and code != previous:
+            result += code
+            if len(result) == 4:
+                break
+        # H and W don't separate letters with the same code.
+        if char not in 'hw':
+            previous = code
+    return result.ljust(4, '0')
+
+
+def get_shingles(text, size=SHINGLE_SIZE):
+    """Return the set of `size` character substrings of `text`."""
+    text = f' {text} '
+    return {text[i : i + size] for i in range(max(len(text) - size + 1, 1))}
+
+
+def _sort_words(name):
+    return ' '.join(sorted(name.split()))
+
+
+class _SimilarityScorer:
+    """
+    Tells whether names (with sorted words) are at least `threshold`
+    similar, comparing one name to many others in a row. Pairs that can't
+    reach the threshold are ruled out without computing their similarity.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self._name = None
+        # Indexing the second sequence is the expensive part of difflib's
+        # matching, so it's done once for every name compared to others.
+        self._matcher = difflib.SequenceMatcher()
+
+    def set_name(self, name):
+        self._name = name
+        if fuzz is None:
+            self._matcher.set_seq2(name)
+
+    def is_similar(self, other):
+        threshold = self.threshold
+        if fuzz is not None:
+            score_cutoff = threshold * 100
+            return fuzz.ratio(self._name, other, score_cutoff=score_cutoff) > 0
+        matcher = self._matcher
+        matcher.set_seq1(other)
+        # Cheap upper bounds of `ratio()` first.
+        return (
+            matcher.real_quick_ratio() >= threshold
+            and matcher.quick_ratio() >= threshold
+            and matcher.ratio() >= threshold
+        )
+
+
+class FuzzyMatcher:
+    """
+    Finds the pairs of similar names among a set of normalized names (see
+    the module docstring). `threshold` is the minimum similarity of a pair,
+    and `num_perm`, `rows` and `max_block_size` tune the blocking.
+    """
+
+    def __init__(
+        self,
+        threshold=DEFAULT_FUZZY_THRESHOLD,
+        num_perm=NUM_PERM,
+        rows=LSH_ROWS,
+        max_block_size=MAX_BLOCK_SIZE,
+        seed=0,
+    ):
+        if num_perm % rows:
+            raise ValueError('num_perm must be a multiple of rows')
+        self.threshold = threshold
+        self.rows = rows
+        self.max_block_size = max_block_size
+        self.candidate_pairs = 0
+        self.skipped_blocks = 0
+        # The permuted hashes of every trigram seen, which a signature is
+        # the minimum of. There are far fewer distinct trigrams than names.
+        self._shingle_hashes = {}
+
+        rng = random.Random(seed)
+        self._permutations = [
+            (
+                rng.randrange(1, _MERSENNE_PRIME),
+                rng.randrange(0, _MERSENNE_PRIME),
+            )
+            for _ in range(num_perm)
+        ]
+
+    def get_signature(self, name):
+        """Return the MinHash signature of `name`'s trigrams."""
+        shingle_hashes = []
+        for shingle in get_shingles(name):
+            hashes = self._shingle_hashes.get(shingle)
+            if hashes is None:
+                h = zlib.crc32(shingle.encode())
+                hashes = self._shingle_hashes[shingle] = array(
+                    'Q',
+                    [
+                        (a * h + b) % _MERSENNE_PRIME
+                        for a, b in self._permutations
+                    ],
+                )
+            shingle_hashes.append(hashes)
+        return list(map(min, zip(*shingle_hashes)))
+
+    def get_blocking_keys(self, name):
+        """
+        Return the keys of the blocks `name` is put in: the phonetic key,
+        then one key per band. Keys at the same position of two names are
+        of the same kind.
+        """
+        keys = [('soundex', ' '.join(sorted(map(soundex, name.split()))))]
+        signature = self.get_signature(name)
+        for start in range(0, len(signature), self.rows):
+            band = tuple(signature[start : start + self.rows])
+            keys.append((start, hash(band)))
+        return keys
+
+    def iter_similar_pairs(self, names):
+        """
+        Yield the pairs of `names` (distinct, normalized names) that are at
+        least `threshold` similar. Only names sharing a block are compared,
+        and every pair is compared once, in the first block they share.
+        Blocks of more than `max_block_size` names are skipped (and counted
+        in `skipped_blocks`), so the pairs found don't depend on the order
+        of `names`.
+        """
+        blocks = defaultdict(list)
+        sorted_words = {}
+        blocking_keys = {}
+        for name in names:
+            sorted_words[name] = _sort_words(name)
+            keys = blocking_keys[name] = self.get_blocking_keys(name)
+            for position, key in enumerate(keys):
+                blocks[position, key].append(name)
+
+        skipped = {
+            block_key
+            for block_key, block in blocks.items()
+            if len(block) > self.max_block_size
+        }
+        self.skipped_blocks += len(skipped)
+
+        def _first_shared_position(a_keys, b_keys):
+            for position, key in enumerate(a_keys):
+                if key == b_keys[position] and (position, key) not in skipped:
+                    return position
+
+        scorer = _SimilarityScorer(self.threshold)
+        for block_key, block in blocks.items():
+            if block_key in skipped:
+                continue
+            position = block_key[0]
+            # difflib's ratio isn't symmetric, so pairs are always scored
+            # the same way around, whatever the order of `names`.
+            block.sort()
+            for i, a in enumerate(block):
+                scorer.set_name(sorted_words[a])
+                a_keys = blocking_keys[a]
+                for b in block[i + 1 :]:
+                    # Pairs sharing several blocks are compared in the first.
+                    if (
+                        position
+                        and _first_shared_position(a_keys, blocking_keys[b])
+                        != position
+                    ):
+                        continue
+                    self.candidate_pairs += 1
+                    if scorer.is_similar(sorted_words[b]):
+                        yield a, b
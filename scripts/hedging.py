@@ -0,0 +1,101 @@
+import collections
+import os
+import threading
+
+from scripts.request_stats import normalize_endpoint
+
+# GETs that take longer than this percentile of the recent latencies of
+# their endpoint get a duplicate request. Hedging is off unless it's enabled
+# for a wrapper, or with `CLOSE_API_HEDGE_PERCENTILE` for all of them.
+HEDGE_PERCENTILE = float(os.environ.get('CLOSE_API_HEDGE_PERCENTILE') or 0)
+DEFAULT_HEDGE_PERCENTILE = HEDGE_PERCENTILE or 95
+
+# Extra requests allowed, as a share of the GETs sent (5% by default).
+DEFAULT_HEDGE_BUDGET = float(os.environ.get('CLOSE_API_HEDGE_BUDGET', 0.05))
+
+# Upper bound for the number of hedges that can be sent back to back after a
+# quiet stretch, so that an outage doesn't double the load all of a sudden.
+MAX_HEDGE_BURST = 10
+
+# Number of recent latencies kept per endpoint, and the number needed before
+# the endpoint's requests are hedged at all.
+LATENCY_WINDOW = 200
+MIN_LATENCY_SAMPLES = 20
+
+# Requests faster than this are never hedged, whatever the percentile says.
+MIN_HEDGE_DELAY = 0.1
+
+
+class RequestHedger:
+    """
+    Decides when a slow GET should be hedged, i.e. sent a second time so
+    that whichever copy comes back first can be used.
+
+    A GET is hedged once it has been running for longer than `percentile`
+    of the recent latencies of its endpoint. To keep the API quota use
+    bounded, every GET earns `budget` of a hedge (up to `MAX_HEDGE_BURST`
+    saved up) and every hedge spends a whole one, so at most `budget` extra
+    requests are sent per GET.
+    """
+
+    def __init__(
+        self,
+        percentile=DEFAULT_HEDGE_PERCENTILE,
+        budget=DEFAULT_HEDGE_BUDGET,
+        min_delay=MIN_HEDGE_DELAY,
+    ):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_delay = min_delay
+        self.hedges = 0
+        self.hedges_won = 0
+        self.over_budget = 0
+
+        self._lock = threading.Lock()
+        self._tokens = 0.0
+        self._latencies = collections.defaultdict(
+            lambda: collections.deque(maxlen=LATENCY_WINDOW)
+        )
+
+    def record(self, endpoint, latency):
+        """Record the latency of a GET to `endpoint`."""
+        with self._lock:
+            self._latencies[normalize_endpoint(endpoint)].append(latency)
+
+    def get_delay(self, endpoint):
+        """
+        Return how long a GET to `endpoint` that's about to be sent should
+        be given before it's hedged, or None if it shouldn't be (e.g. there
+        aren't enough latencies recorded yet). Adds to the hedge budget.
+        """
+        with self._lock:
+            self._tokens = min(self._tokens + self.budget, MAX_HEDGE_BURST)
+            latencies = self._latencies.get(normalize_endpoint(endpoint))
+            if not latencies or len(latencies) < MIN_LATENCY_SAMPLES:
+                return None
+            latencies = sorted(latencies)
+        index = int(len(latencies) * self.percentile / 100)
+        return max(latencies[min(index, len(latencies) - 1)], self.min_delay)
+
+    def try_hedge(self):
+        """Spend a hedge from the budget, returning whether there was one."""
+        with self._lock:
+            if self._tokens < 1:
+                self.over_budget += 1
+                return False
+            self._tokens -= 1
+            self.hedges += 1
+            return True
+
+    def record_win(self):
+        """Record that a hedge came back before the request it duplicated."""
+        with self._lock:
+            self.hedges_won += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hedges': self.hedges,
+                'hedges_won': self.hedges_won,
+                'over_budget': self.over_budget,
+            }
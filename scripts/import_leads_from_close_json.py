@@ -2,11 +2,13 @@ import argparse
 import copy
 import json
 
-import gevent.monkey
-gevent.monkey.patch_all()
+from scripts.runtime import bootstrap
 
-from closeio_api import APIError, Client as CloseIO_API
-from gevent.pool import Pool
+bootstrap()  # isort: split
+
+from closeio_api import APIError
+
+from scripts.CloseApiWrapper import CloseApiWrapper
 
 
 
@@ -16,7 +18,7 @@ parser = argparse.ArgumentParser(
 parser.add_argument('--api-key', '-k', required=True, help='API Key')
 parser.add_argument('--jsonfile', '-j', required=True, help='JSON File Path')
 args = parser.parse_args()
-api = CloseIO_API(args.api_key)
+api = CloseApiWrapper(args.api_key)
 
 # Create a list of active users for the sake of posting opps and activities.
 me = api.get('me')
@@ -153,17 +155,13 @@ def importActivities(activity_data, new_lead_id):
 
 # Remove task completed activities from top of lead.
 def removeTaskCompletedActivities(new_lead_id):
-    has_more = True
-    offset = 0
-    task_completed_ids = []
-    while has_more:
-        resp_task_completed = api.get(
+    task_completed_ids = [
+        i['id']
+        for i in api.iter_items(
             'activity/task_completed',
-            params={'_skip': offset, 'lead_id': new_lead_id, '_fields': 'id'},
+            params={'lead_id': new_lead_id, '_fields': 'id'},
         )
-        task_completed_ids = [i['id'] for i in resp_task_completed['data']]
-        offset += len(resp_task_completed['data'])
-        has_more = resp_task_completed['has_more']
+    ]
 
     for completed_id in task_completed_ids:
         try:
@@ -237,7 +235,7 @@ def restoreLead(lead):
 
 
 print(f"Total leads being restored: {len(data)}")
-pool = Pool(5)
+pool = api.create_pool()
 pool.map(restoreLead, data)
 print(f"Total leads restored {len(total_leads_imported)}")
 print(f"Total leads not restored {(len(data) - len(total_leads_imported))}")
@@ -0,0 +1,44 @@
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+def get_json_decoders():
+    """Return the JSON decoders that are installed, fastest first, by name."""
+    decoders = {}
+    if orjson is not None:
+        decoders['orjson'] = orjson.loads
+    if msgspec is not None:
+        decoders['msgspec'] = msgspec.json.Decoder().decode
+    decoders['json'] = json.loads
+    return decoders
+
+
+def get_json_decoder(name=None):
+    """
+    Return a function that decodes a JSON document (`bytes` or `str`).
+
+    `name` picks the decoder (`orjson`, `msgspec` or `json`), and defaults to
+    the `CLOSE_API_JSON_DECODER` environment variable, and then to the
+    fastest decoder that is installed. orjson and msgspec are optional, the
+    standard library's `json` is always available.
+    """
+    decoders = get_json_decoders()
+    name = name or os.environ.get('CLOSE_API_JSON_DECODER')
+    if not name:
+        return next(iter(decoders.values()))
+    if name not in decoders:
+        raise ValueError(
+            f'JSON decoder {name!r} is not available, pick one of: '
+            f'{", ".join(decoders)}'
+        )
+    return decoders[name]
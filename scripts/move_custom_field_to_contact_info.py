@@ -1,6 +1,18 @@
 #!/usr/bin/env python
 import click
-from closeio_api import APIError, Client as CloseIO_API
+
+from scripts.runtime import bootstrap
+
+bootstrap()  # isort: split
+
+from closeio_api import APIError
+
+from scripts.CloseApiWrapper import CloseApiWrapper
+
+LEADS_QUERY = (
+    '"custom.Source CRM":* not "custom.Migration completed":* sort:created'
+)
+LEADS_FIELDS = ['id', 'display_name', 'name', 'contacts', 'custom']
 
 
 @click.command()
@@ -56,109 +68,102 @@ def run(
     print(f'title_custom_field: {title_custom_field}')
     print(f'use_existing_contact: {use_existing_contact}')
 
-    api = CloseIO_API(api_key)
-    has_more = True
-    offset = 0
-
-    while has_more:
-
-        # Get a page of leads
-        resp = api.get(
-            'lead',
-            params={
-                'query': '"custom.Source CRM":* not "custom.Migration completed":* sort:created',
-                '_skip': offset,
-                '_fields': 'id,display_name,name,contacts,custom',
-            },
-        )
-        leads = resp['data']
-
-        for lead in leads:
-            contacts = lead['contacts']
-            custom = lead['custom']
-
-            company_emails = custom.get(emails_custom_field, '')
-            company_phones = custom.get(phones_custom_field, '')
-            contact_title = custom.get(title_custom_field, '')
-
-            if not company_phones and not company_emails and not contact_title:
-                continue
-
-            if company_emails:
-                if company_emails.startswith('["'):
-                    company_emails = company_emails[2:-2].split('", "')
-                else:
-                    company_emails = [company_emails]
-
-            if company_phones:
-                if company_phones.startswith('["'):
-                    company_phones = company_phones[2:-2].split('", "')
-                else:
-                    company_phones = [company_phones]
-
-            if contacts and use_existing_contact:
-                contact = contacts[0]
-            else:
-                contact = {'lead_id': lead['id'], 'phones': [], 'emails': []}
-                if new_contact_name:
-                    contact['name'] = new_contact_name
-
-            for pn in company_phones:
-                contact['phones'].append({'type': 'office', 'phone': pn})
-            for e in company_emails:
-                contact['emails'].append({'type': 'office', 'email': e})
-            if contact_title:
-                contact['title'] = contact_title
-
-            print('Lead:', lead['id'], lead['name'].encode('utf8'))
-            print(
-                f'Emails: {custom.get(emails_custom_field)} => {company_emails}'
-            )
-            print(
-                f'Phones: {custom.get(phones_custom_field)} => {company_phones}'
-            )
-            print(
-                f'Title: {custom.get(title_custom_field)} => {contact_title}'
+    api = CloseApiWrapper(api_key)
+
+    def iter_leads():
+        if not confirmed:
+            # Nothing gets updated, so the leads never leave the query: scan
+            # it in slices rather than with an ever growing `_skip`.
+            yield from api.iter_lead_slices(LEADS_QUERY, fields=LEADS_FIELDS)
+            return
+
+        # Every processed lead is marked as migrated, which takes it out of
+        # the query, so we keep fetching the first page until it's empty.
+        has_more = True
+        while has_more:
+            resp = api.get(
+                'lead',
+                params={
+                    'query': LEADS_QUERY,
+                    '_fields': ','.join(LEADS_FIELDS),
+                },
             )
+            yield from resp['data']
+            has_more = resp['has_more']
+
+    for lead in iter_leads():
+        contacts = lead['contacts']
+        custom = lead['custom']
 
-            try:
-                if contact.get('id'):
-                    print('Updating an existing contact', contact['id'])
-                    if confirmed:
-                        api.put(
-                            'contact/%s' % contact['id'],
-                            data={
-                                'phones': contact['phones'],
-                                'emails': contact['emails'],
-                            },
-                        )
-                else:
-                    print('Creating a new contact')
-                    if confirmed:
-                        api.post('contact', data=contact)
-                print('Payload:', contact)
+        company_emails = custom.get(emails_custom_field, '')
+        company_phones = custom.get(phones_custom_field, '')
+        contact_title = custom.get(title_custom_field, '')
+
+        if not company_phones and not company_emails and not contact_title:
+            continue
+
+        if company_emails:
+            if company_emails.startswith('["'):
+                company_emails = company_emails[2:-2].split('", "')
+            else:
+                company_emails = [company_emails]
+
+        if company_phones:
+            if company_phones.startswith('["'):
+                company_phones = company_phones[2:-2].split('", "')
+            else:
+                company_phones = [company_phones]
+
+        if contacts and use_existing_contact:
+            contact = contacts[0]
+        else:
+            contact = {'lead_id': lead['id'], 'phones': [], 'emails': []}
+            if new_contact_name:
+                contact['name'] = new_contact_name
+
+        for pn in company_phones:
+            contact['phones'].append({'type': 'office', 'phone': pn})
+        for e in company_emails:
+            contact['emails'].append({'type': 'office', 'email': e})
+        if contact_title:
+            contact['title'] = contact_title
+
+        print('Lead:', lead['id'], lead['name'].encode('utf8'))
+        print(f'Emails: {custom.get(emails_custom_field)} => {company_emails}')
+        print(f'Phones: {custom.get(phones_custom_field)} => {company_phones}')
+        print(f'Title: {custom.get(title_custom_field)} => {contact_title}')
+
+        try:
+            if contact.get('id'):
+                print('Updating an existing contact', contact['id'])
                 if confirmed:
                     api.put(
-                        'lead/%s' % lead['id'],
-                        data={'custom.Migration completed': 'Yes'},
+                        'contact/%s' % contact['id'],
+                        data={
+                            'phones': contact['phones'],
+                            'emails': contact['emails'],
+                        },
                     )
-            except APIError as e:
-                print(str(e))
-                print('Payload:', contact)
+            else:
+                print('Creating a new contact')
                 if confirmed:
-                    api.put(
-                        'lead/%s' % lead['id'],
-                        data={'custom.Migration completed': 'skipped'},
-                    )
-
-            print()
-
-        if not confirmed:
-            # If we don't actually update the "Migration completed" custom field,
-            # we need to paginate
-            offset += len(leads)
-
-        has_more = resp['has_more']
+                    api.post('contact', data=contact)
+            print('Payload:', contact)
+            if confirmed:
+                api.put(
+                    'lead/%s' % lead['id'],
+                    data={'custom.Migration completed': 'Yes'},
+                )
+        except APIError as e:
+            print(str(e))
+            print('Payload:', contact)
+            if confirmed:
+                api.put(
+                    'lead/%s' % lead['id'],
+                    data={'custom.Migration completed': 'skipped'},
+                )
+
+        print()
 
     print('Done')
 
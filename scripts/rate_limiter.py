@@ -0,0 +1,222 @@
+import asyncio
+import contextlib
+import os
+import threading
+import time
+
+# Number of concurrent requests the controller starts out with.
+DEFAULT_INITIAL_CONCURRENCY = 4
+
+# Upper bound for the number of concurrent requests. This is also the size
+# of the pools that hand their work to the controller. It can be overridden
+# with `CLOSE_API_MAX_CONCURRENCY`, e.g. to compare pool sizes.
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get('CLOSE_API_MAX_CONCURRENCY', 32))
+
+# How long to back off for when a 429 response doesn't tell us how long the
+# rate limit window is going to last.
+DEFAULT_RATE_LIMIT_DELAY = 2
+
+
+def parse_rate_limit(status_code, headers, body=None):
+    """
+    Return a `(limit, remaining, reset)` tuple from the rate limit headers of
+    a response, with `None` for anything the response doesn't specify.
+
+    Both the combined `RateLimit: limit=X, remaining=Y, reset=Z` header and
+    the separate `RateLimit-Limit`, `RateLimit-Remaining`, `RateLimit-Reset`
+    headers are supported. For 429 responses, `Retry-After` and the
+    `rate_reset` hint in the decoded response `body` take precedence for
+    `reset`.
+    """
+    values = {}
+    combined = headers.get('RateLimit')
+    if combined:
+        for part in combined.split(','):
+            key, _, value = part.strip().partition('=')
+            values[key.strip().lower()] = value.strip()
+    for key in ('limit', 'remaining', 'reset'):
+        header = headers.get(f'RateLimit-{key.capitalize()}')
+        if header is not None:
+            values[key] = header
+
+    if status_code == 429:
+        if headers.get('Retry-After'):
+            values['reset'] = headers['Retry-After']
+        else:
+            with contextlib.suppress(KeyError, TypeError):
+                values['reset'] = body['error']['rate_reset']
+
+    def _to_float(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    return (
+        _to_float(values.get('limit')),
+        _to_float(values.get('remaining')),
+        _to_float(values.get('reset')),
+    )
+
+
+class RateLimitController:
+    """
+    Hands out permits for in-flight API requests and adapts how many of them
+    can be in flight at once based on the rate limit feedback from the API.
+
+    The number of permits grows additively (by roughly one for every round
+    of successful requests) and is halved on a 429, at most once per rate
+    limit window. When a 429 or a `RateLimit-Remaining` of zero comes back,
+    no new permits are handed out until the rate limit window resets.
+
+    A single controller can be shared by any number of pools (and wrapper
+    instances using the same API key): all of them draw from the same
+    permits.
+    """
+
+    def __init__(
+        self,
+        initial_concurrency=DEFAULT_INITIAL_CONCURRENCY,
+        min_concurrency=1,
+        max_concurrency=DEFAULT_MAX_CONCURRENCY,
+        decrease_factor=0.5,
+    ):
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.decrease_factor = decrease_factor
+        self.limit = float(
+            min(max(initial_concurrency, min_concurrency), max_concurrency)
+        )
+        self.in_flight = 0
+        self.rate_limited_count = 0
+
+        self._cond = threading.Condition()
+        self._paused_until = 0.0
+        self._last_decrease = float('-inf')
+
+    @property
+    def concurrency(self):
+        return int(self.limit)
+
+    def _get_wait(self):
+        """
+        Return 0 if a permit can be handed out right away, otherwise how long
+        to wait before checking again (None meaning until a permit is
+        released or the limits change).
+        """
+        wait = self._paused_until - time.monotonic()
+        if wait > 0:
+            return wait
+        if self.in_flight >= int(self.limit):
+            return None
+        return 0
+
+    def acquire(self):
+        with self._cond:
+            wait = self._get_wait()
+            while wait != 0:
+                self._cond.wait(wait)
+                wait = self._get_wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def permit(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def update(self, response):
+        """Adjust the number of permits based on a `requests` response."""
+        body = None
+        if response.status_code == 429:
+            with contextlib.suppress(ValueError):
+                body = response.json()
+        _, remaining, reset = parse_rate_limit(
+            response.status_code, response.headers, body
+        )
+        with self._cond:
+            self._record(response.status_code, remaining, reset)
+            self._cond.notify_all()
+
+    def _record(self, status_code, remaining, reset):
+        now = time.monotonic()
+        if status_code == 429:
+            self.rate_limited_count += 1
+            reset = reset if reset is not None else DEFAULT_RATE_LIMIT_DELAY
+            self._paused_until = max(self._paused_until, now + reset)
+
+            # Only back off once per window, not once for every request that
+            # was already in flight when we hit the limit.
+            if now >= self._last_decrease + max(reset, 1):
+                self.limit = max(
+                    self.min_concurrency, self.limit * self.decrease_factor
+                )
+                self._last_decrease = now
+        elif remaining is not None and remaining < 1:
+            # We're about to be rate limited, so wait for the window to reset
+            # rather than firing requests that are bound to fail.
+            if reset:
+                self._paused_until = max(self._paused_until, now + reset)
+        elif remaining is None or remaining > self.in_flight:
+            self.limit = min(
+                self.max_concurrency, self.limit + 1.0 / self.limit
+            )
+
+    def stats(self):
+        return {
+            'concurrency': self.concurrency,
+            'in_flight': self.in_flight,
+            'rate_limited': self.rate_limited_count,
+        }
+
+
+class AsyncRateLimitController(RateLimitController):
+    """
+    Same as `RateLimitController`, but for coroutines running in a single
+    asyncio event loop: waiting for a permit doesn't block the loop.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._changed = None
+
+    async def acquire(self):
+        wait = self._get_wait()
+        while wait != 0:
+            # Created lazily, so that it belongs to the running event loop.
+            if self._changed is None:
+                self._changed = asyncio.Event()
+            self._changed.clear()
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._changed.wait(), wait)
+            wait = self._get_wait()
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._notify()
+
+    @contextlib.asynccontextmanager
+    async def permit(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def update(self, status_code, headers, body=None):
+        """Adjust the number of permits based on an API response."""
+        _, remaining, reset = parse_rate_limit(status_code, headers, body)
+        self._record(status_code, remaining, reset)
+        self._notify()
+
+    def _notify(self):
+        if self._changed is not None:
+            self._changed.set()
@@ -0,0 +1,97 @@
+import sys
+
+
+def intern_id(value):
+    """
+    Return the canonical copy of a Close object ID (or of another string
+    that repeats across many objects, such as a status label), so that it's
+    only kept in memory once no matter how many records refer to it.
+    """
+    return sys.intern(value) if value else value
+
+
+class LeadRecord:
+    """
+    Compact, read-only projection of a lead for scripts that hold a whole
+    org's leads in memory (e.g. to look for duplicates).
+
+    Instead of the lead's JSON (a dict per lead, contact, email and phone),
+    a record keeps the handful of fields those scripts look at in slots,
+    with the contacts flattened into tuples of names, email addresses and
+    phone numbers, and the IDs interned. Only the custom fields asked for
+    are kept. Records compare by identity, like the leads they stand for.
+    """
+
+    __slots__ = (
+        'id',
+        'display_name',
+        'status_label',
+        'date_created',
+        'url',
+        'contact_names',
+        'emails',
+        'phones',
+        'custom',
+    )
+
+    def __init__(
+        self,
+        id,
+        display_name='',
+        status_label=None,
+        date_created=None,
+        url=None,
+        contact_names=(),
+        emails=(),
+        phones=(),
+        custom=None,
+    ):
+        self.id = intern_id(id)
+        self.display_name = display_name
+        self.status_label = intern_id(status_label)
+        self.date_created = date_created
+        self.url = url
+        self.contact_names = contact_names
+        self.emails = emails
+        self.phones = phones
+        self.custom = custom
+
+    @classmethod
+    def from_json(cls, lead, custom_fields=()):
+        """
+        Build a record from a lead as returned by the API. Fields that
+        weren't requested with `_fields` are left empty.
+        """
+        contacts = lead.get('contacts') or ()
+        custom = None
+        if custom_fields:
+            lead_custom = lead.get('custom') or {}
+            custom = {
+                name: lead_custom[name]
+                for name in custom_fields
+                if name in lead_custom
+            }
+        return cls(
+            lead['id'],
+            display_name=lead.get('display_name') or '',
+            status_label=lead.get('status_label'),
+            date_created=lead.get('date_created'),
+            url=lead.get('url'),
+            contact_names=tuple(
+                contact['name'] for contact in contacts if contact.get('name')
+            ),
+            emails=tuple(
+                email['email']
+                for contact in contacts
+                for email in contact.get('emails') or ()
+            ),
+            phones=tuple(
+                phone['phone']
+                for contact in contacts
+                for phone in contact.get('phones') or ()
+            ),
+            custom=custom,
+        )
+
+    def __repr__(self):
+        return f'<LeadRecord {self.id} {self.display_name!r}>'
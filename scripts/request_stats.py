@@ -0,0 +1,186 @@
+import json
+import re
+import sys
+import threading
+from collections import defaultdict
+
+from scripts import runtime
+
+# Upper bounds (in seconds) of the latency histogram buckets. Anything slower
+# than the last bound ends up in an overflow bucket.
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+# Close object IDs, e.g. `lead_3jR5uYy8yNtA4TVkDUrdjQWPcWsuIqLqbbhsKcURyop`.
+_OBJECT_ID_RE = re.compile(r'^[a-z]+_[A-Za-z0-9]{16,}$')
+
+
+def normalize_endpoint(endpoint):
+    """
+    Replace the object IDs in an endpoint with `{id}`, so that e.g. all the
+    `lead/lead_xxx` requests are grouped together.
+    """
+    return '/'.join(
+        '{id}' if _OBJECT_ID_RE.match(part) else part
+        for part in endpoint.strip('/').split('/')
+    )
+
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.retries = 0
+        self.hedges = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.response_bytes = 0
+        self.latency = 0.0
+        self.pool_wait = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def get_percentile(self, percentile):
+        """
+        Return an upper bound for the given latency percentile, based on the
+        histogram buckets (None if it falls in the overflow bucket).
+        """
+        target = self.requests * percentile / 100.0
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.histogram):
+            seen += count
+            if seen >= target:
+                return bound
+        return None
+
+    def to_dict(self):
+        return {
+            'requests': self.requests,
+            'retries': self.retries,
+            'hedges': self.hedges,
+            'rate_limited': self.rate_limited,
+            'errors': self.errors,
+            'response_bytes': self.response_bytes,
+            'latency_total': round(self.latency, 3),
+            'latency_mean': (
+                round(self.latency / self.requests, 3)
+                if self.requests
+                else None
+            ),
+            'latency_p50': self.get_percentile(50),
+            'latency_p95': self.get_percentile(95),
+            'latency_histogram': dict(
+                zip(
+                    [f'<={bound}s' for bound in LATENCY_BUCKETS]
+                    + [f'>{LATENCY_BUCKETS[-1]}s'],
+                    self.histogram,
+                )
+            ),
+            'pool_wait_total': round(self.pool_wait, 3),
+        }
+
+
+class RequestStats:
+    """
+    Per endpoint and method counters of the HTTP requests sent through a
+    wrapper: number of requests, retries and 429s, response sizes, a latency
+    histogram and the time spent waiting for a rate limiter permit.
+
+    Every attempt of a request counts as a request of its own, so `retries`
+    is the number of requests that repeated an earlier, failed attempt, and
+    `hedges` the number of requests that duplicated a slow one (see
+    `scripts.hedging`).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = defaultdict(EndpointStats)
+        self._sections = {}
+
+    def add_section(self, name, value):
+        """
+        Include `value` (JSON-serializable) as `name` in the summary, e.g. the
+        connection reuse of a wrapper.
+        """
+        with self._lock:
+            self._sections[name] = value
+
+    def record(
+        self,
+        method,
+        endpoint,
+        status_code,
+        latency,
+        response_bytes=0,
+        pool_wait=0.0,
+        retry=False,
+        hedge=False,
+    ):
+        key = (method.upper(), normalize_endpoint(endpoint))
+        bucket = len(LATENCY_BUCKETS)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                bucket = i
+                break
+
+        with self._lock:
+            stats = self._endpoints[key]
+            stats.requests += 1
+            stats.retries += int(retry)
+            stats.hedges += int(hedge)
+            stats.latency += latency
+            stats.pool_wait += pool_wait
+            stats.response_bytes += response_bytes
+            stats.histogram[bucket] += 1
+            if status_code == 429:
+                stats.rate_limited += 1
+            elif status_code is None or status_code >= 400:
+                stats.errors += 1
+
+    def summary(self):
+        """
+        Return the stats as a JSON-serializable dict, with a `total` entry
+        and an entry for every `METHOD endpoint`, slowest first. The report
+        of the concurrency check (see `scripts.runtime`) is included as
+        `runtime`, if it was run, along with the sections added with
+        `add_section`.
+        """
+        with self._lock:
+            endpoints = sorted(
+                self._endpoints.items(), key=lambda item: -item[1].latency
+            )
+            total = EndpointStats()
+            for _, stats in endpoints:
+                total.requests += stats.requests
+                total.retries += stats.retries
+                total.hedges += stats.hedges
+                total.rate_limited += stats.rate_limited
+                total.errors += stats.errors
+                total.response_bytes += stats.response_bytes
+                total.latency += stats.latency
+                total.pool_wait += stats.pool_wait
+                total.histogram = [
+                    a + b for a, b in zip(total.histogram, stats.histogram)
+                ]
+            summary = {
+                'total': total.to_dict(),
+                'endpoints': {
+                    f'{method} {endpoint}': stats.to_dict()
+                    for (method, endpoint), stats in endpoints
+                },
+            }
+            summary.update(self._sections)
+        if runtime.get_report() is not None:
+            summary['runtime'] = runtime.get_report()
+        return summary
+
+    def write(self, path='-'):
+        """Write the summary as JSON to `path`, or to stderr for `-`."""
+        summary = json.dumps(self.summary(), indent=2)
+        if path == '-':
+            print(summary, file=sys.stderr)
+        else:
+            with open(path, 'w') as f:
+                f.write(summary + '\n')
+
+    def clear(self):
+        with self._lock:
+            self._endpoints.clear()
+            self._sections.clear()
@@ -0,0 +1,184 @@
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from dateutil.parser import parse as parse_date
+
+# Default upper bound for the size of the cached response bodies.
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+# TTL (in seconds) for responses whose date window is still open (or that
+# don't have one at all), by endpoint prefix. The first matching prefix wins.
+DEFAULT_TTL_RULES = [
+    ('me', 3600),
+    ('organization', 3600),
+    ('custom_field_schema', 3600),
+    ('sequence', 600),
+    ('lead', 300),
+]
+
+# TTL for responses that don't match any of the rules above, e.g. activities
+# and events from "today".
+DEFAULT_TTL = 60
+
+# Params that close a date window, e.g. `date_created__lt`.
+_UPPER_BOUND_SUFFIXES = ('__lt', '__lte')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    body TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL,
+    last_accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_accessed
+    ON responses (last_accessed);
+'''
+
+
+class ResponseCache:
+    """
+    Persistent, SQLite-backed cache of GET responses, meant for read-only
+    report runs that fetch the same (mostly historical) pages over and over.
+
+    Responses are keyed by a namespace (so that caches of different API keys
+    can't mix), the endpoint, and the normalized params. Responses for a date
+    window that closed before today never expire, everything else expires
+    according to `ttl_rules`. Once the cached bodies grow beyond `max_size`
+    bytes, the least recently used responses are evicted.
+    """
+
+    def __init__(
+        self,
+        path,
+        max_size=DEFAULT_MAX_SIZE,
+        ttl_rules=None,
+        default_ttl=DEFAULT_TTL,
+    ):
+        self.path = path
+        self.max_size = max_size
+        self.ttl_rules = DEFAULT_TTL_RULES if ttl_rules is None else ttl_rules
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._db.executescript(_SCHEMA)
+        self._size = self._db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses'
+        ).fetchone()[0]
+
+    @staticmethod
+    def make_key(namespace, endpoint, params):
+        params = {
+            k: v for k, v in (params or {}).items() if v not in (None, '')
+        }
+        return '{}:{}?{}'.format(
+            namespace,
+            endpoint.strip('/'),
+            json.dumps(params, sort_keys=True, separators=(',', ':')),
+        )
+
+    def get_ttl(self, endpoint, params):
+        """
+        Return how long a response should be cached for, or None if it never
+        expires because its date window closed before today.
+        """
+        start_of_today = datetime.now(timezone.utc).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        for param, value in (params or {}).items():
+            if not param.endswith(_UPPER_BOUND_SUFFIXES) or not value:
+                continue
+            try:
+                upper_bound = parse_date(str(value))
+            except (ValueError, OverflowError):
+                continue
+            if upper_bound.tzinfo is None:
+                upper_bound = upper_bound.replace(tzinfo=timezone.utc)
+            if upper_bound < start_of_today:
+                return None
+
+        endpoint = endpoint.strip('/')
+        for prefix, ttl in self.ttl_rules:
+            if endpoint == prefix or endpoint.startswith(prefix + '/'):
+                return ttl
+        return self.default_ttl
+
+    def get(self, key):
+        """Return the cached response for `key`, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                'SELECT body, expires_at FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] <= now):
+                self.misses += 1
+                return None
+
+            self._db.execute(
+                'UPDATE responses SET last_accessed = ? WHERE key = ?',
+                (now, key),
+            )
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, response, ttl):
+        body = json.dumps(response, separators=(',', ':'))
+        now = time.time()
+        expires_at = None if ttl is None else now + ttl
+        with self._lock:
+            old = self._db.execute(
+                'SELECT size FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                (key, body, len(body), expires_at, now),
+            )
+            self._size += len(body) - (old[0] if old else 0)
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        # Evict down to 90% of the limit, so that we don't have to evict
+        # again on the very next insert.
+        target = self.max_size * 0.9
+        evicted_keys = []
+        for key, size in self._db.execute(
+            'SELECT key, size FROM responses ORDER BY last_accessed'
+        ):
+            if self._size <= target:
+                break
+            evicted_keys.append((key,))
+            self._size -= size
+        self._db.executemany(
+            'DELETE FROM responses WHERE key = ?', evicted_keys
+        )
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM responses')
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute(
+                'SELECT COUNT(*) FROM responses'
+            ).fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+            'entries': entries,
+            'size': self._size,
+        }
+
+    def close(self):
+        self._db.close()
@@ -1,10 +1,14 @@
 import argparse
+import hashlib
 
-import gevent.monkey
+from scripts.runtime import bootstrap
 
-gevent.monkey.patch_all()
-from closeio_api import APIError, Client as CloseIO_API
-from gevent.pool import Pool
+bootstrap()  # isort: split
+
+from closeio_api import APIError
+
+from scripts.checkpoint import Checkpoint
+from scripts.CloseApiWrapper import CloseApiWrapper
 
 parser = argparse.ArgumentParser(
     description='Restore an array of deleted leads by ID. This CANNOT restore status changes or call recordings.'
@@ -18,8 +22,18 @@ group.add_argument(
     '--leads-file',
     help='List of lead IDs in a form of a textual file with single column of lead IDs',
 )
+parser.add_argument(
+    '--resume',
+    action='store_true',
+    help='Continue from the checkpoint of a previous, interrupted run.',
+)
+parser.add_argument(
+    '--checkpoint-file',
+    default='restore_deleted_leads.checkpoint.json',
+    help='Path to the file the progress of this run is saved to.',
+)
 args = parser.parse_args()
-api = CloseIO_API(args.api_key)
+api = CloseApiWrapper(args.api_key)
 
 # Array of Lead IDs. Add the IDs you want to restore here.
 if args.leads:
@@ -30,15 +44,18 @@ elif args.leads_file:
     lead_ids = [el.strip() for el in lines]  # Strip new lines
     lead_ids = list(filter(None, lead_ids))  # Strip empty lines
 
-# Create a list of active users for the sake of posting opps.
-org_id = api.get('me')['organizations'][0]['id']
-memberships = api.get(
-    'organization/' + org_id, params={'_fields': 'memberships'}
-)['memberships']
-active_users = [i['user_id'] for i in memberships]
+# Leads that were restored (or had nothing to restore) by a previous run are
+# skipped, and so are the objects a previous run already posted for a lead it
+# didn't finish, so that nothing is restored twice.
+checkpoint = Checkpoint(
+    args.checkpoint_file,
+    resume=args.resume,
+    fingerprint=hashlib.sha256(','.join(lead_ids).encode()).hexdigest(),
+)
+checkpoint.data.setdefault('restored', 0)
 
-# Array to keep track of number of leads restored. Because we use gevent, we can't have a standard counter variable.
-total_leads_restored = []
+# Create a list of active users for the sake of posting opps.
+active_users = [i['user_id'] for i in api.get_memberships()]
 
 # This is a list of object types you want to restore on the lead. We can also add activity.email, but in this script
 # it's assumed that email sync will take care of all of the emails that were deleted, assuming the same email accounts
@@ -57,19 +74,22 @@ contact_id_mapping = {}
 
 
 def restore_objects(object_type, old_lead_id, new_lead_id):
-    has_more = True
-    cursor = ''
-    while has_more:
-        resp_objects = api.get(
-            'event',
-            params={
-                'object_type': object_type,
-                'action': 'deleted',
-                '_cursor': cursor,
-                'lead_id': old_lead_id,
-            },
-        )
-        for event in resp_objects['data']:
+    for page in api.iter_pages(
+        'event',
+        params={
+            'object_type': object_type,
+            'action': 'deleted',
+            'lead_id': old_lead_id,
+        },
+    ):
+        for event in page:
+            event_key = f"{old_lead_id}/{event['id']}"
+            if checkpoint.is_completed(event_key):
+                if object_type == 'contact':
+                    contact_id_mapping[
+                        event['object_id']
+                    ] = checkpoint.get_result(event_key)
+                continue
             old_contact_id = None
             if 'previous_data' in event:
                 prev = event['previous_data']
@@ -121,6 +141,9 @@ def restore_objects(object_type, old_lead_id, new_lead_id):
                 # Post the object to the new lead.
                 try:
                     post_request = api.post(endpoint, data=prev)
+                    checkpoint.mark_completed(
+                        event_key, result=post_request.get('id')
+                    )
 
                     # If we posted a contact, add the new contact id to the dictionary.
                     if object_type == 'contact':
@@ -131,22 +154,16 @@ def restore_objects(object_type, old_lead_id, new_lead_id):
                     print(
                         f"ERROR: Could not post {object_type} {event['object_id']} because {str(e)}"
                     )
-        cursor = resp_objects['cursor_next']
-        has_more = bool(resp_objects['cursor_next'])
 
 
 def remove_task_completed_activities(new_lead_id):
-    has_more = True
-    offset = 0
-    task_completed_ids = []
-    while has_more:
-        resp_task_completed = api.get(
+    task_completed_ids = [
+        i['id']
+        for i in api.iter_items(
             'activity/task_completed',
-            params={'_skip': offset, 'lead_id': new_lead_id, '_fields': 'id'},
+            params={'lead_id': new_lead_id, '_fields': 'id'},
         )
-        task_completed_ids = [i['id'] for i in resp_task_completed['data']]
-        offset += len(resp_task_completed['data'])
-        has_more = resp_task_completed['has_more']
+    ]
 
     for completed_id in task_completed_ids:
         try:
@@ -172,11 +189,15 @@ def restore_lead(old_lead_id):
         prev = resp_lead['data'][0]['previous_data']
         if 'id' in prev:
             del prev['id']
-        # Post New Lead.
+        # Post New Lead, unless a previous run already did.
+        lead_key = f'{old_lead_id}/lead'
         try:
-            post_lead = api.post('lead', data=prev)
-            if 'id' in post_lead:
-                new_lead_id = post_lead['id']
+            new_lead_id = checkpoint.get_result(lead_key)
+            if new_lead_id is None:
+                new_lead_id = api.post('lead', data=prev).get('id')
+                if new_lead_id:
+                    checkpoint.mark_completed(lead_key, result=new_lead_id)
+            if new_lead_id:
                 # Restore all objects on the lead.
                 for object_type in object_types:
                     restore_objects(object_type, old_lead_id, new_lead_id)
@@ -185,20 +206,38 @@ def restore_lead(old_lead_id):
                 # regardless of when they were actually completed.
                 remove_task_completed_activities(new_lead_id)
 
-                total_leads_restored.append(1)
-                print(f"{len(total_leads_restored)}: Restored {old_lead_id}")
+                restored = checkpoint.mark_completed(
+                    old_lead_id, count='restored'
+                )
+                print(f"{restored}: Restored {old_lead_id}")
         except APIError as e:
             print(f"{old_lead_id}: Lead could not be posted because {str(e)}")
     else:
         print(
             f"{old_lead_id} could not be restored because there is no data to restore"
         )
+        checkpoint.mark_completed(old_lead_id)
 
 
+if checkpoint.resumed:
+    print(
+        f"Resuming, {sum(map(checkpoint.is_completed, lead_ids))} leads "
+        "were already processed"
+    )
 print(f"Total leads being restored: {len(lead_ids)}")
-pool = Pool(5)
-pool.map(restore_lead, lead_ids)
-print(f"Total leads restored {len(total_leads_restored)}")
+pool = api.create_pool()
+pool.map(
+    restore_lead,
+    [i for i in lead_ids if not checkpoint.is_completed(i)],
+)
+print(f"Total leads restored {checkpoint.data['restored']}")
 print(
-    f"Total leads not restored {(len(lead_ids) - len(total_leads_restored))}"
+    f"Total leads not restored {(len(lead_ids) - checkpoint.data['restored'])}"
 )
+
+# Keep the checkpoint around if some leads failed, so that they can be
+# retried with --resume.
+if all(checkpoint.is_completed(i) for i in lead_ids):
+    checkpoint.finish()
+else:
+    checkpoint.save()
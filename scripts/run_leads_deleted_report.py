@@ -1,7 +1,12 @@
 import argparse
 import csv
 
-from closeio_api import Client as CloseIO_API
+from scripts.runtime import bootstrap
+
+bootstrap()  # isort: split
+
+from scripts.checkpoint import Checkpoint
+from scripts.CloseApiWrapper import CloseApiWrapper
 
 parser = argparse.ArgumentParser(
     description='Create a CSV of all deleted leads in the past 30 days and see how they were deleted'
@@ -14,19 +19,30 @@ parser.add_argument(
     action='store_true',
     help='Use this field to print lead_ids deleted in an array at the end of the script',
 )
+parser.add_argument(
+    '--resume',
+    action='store_true',
+    help='Continue from the checkpoint of a previous, interrupted run.',
+)
+parser.add_argument(
+    '--checkpoint-file',
+    default='run_leads_deleted_report.checkpoint.json',
+    help='Path to the file the progress of this run is saved to.',
+)
 
 args = parser.parse_args()
 
-api = CloseIO_API(args.api_key)
-
-has_more = True
-cursor = ''
-events = []
-leads = []
-reverted_imports = {}
+api = CloseApiWrapper(args.api_key)
 
 me = api.get('me')
 org_id = me['organizations'][0]['id']
+
+checkpoint = Checkpoint(
+    args.checkpoint_file, resume=args.resume, fingerprint=org_id
+)
+events = checkpoint.data.setdefault('events', [])
+leads = checkpoint.data.setdefault('leads', [])
+reverted_imports = checkpoint.data.setdefault('reverted_imports', {})
 org = api.get(
     f'organization/{org_id}',
     params={'_fields': 'name,memberships,inactive_memberships'},
@@ -44,14 +60,17 @@ users = {}
 for member in org_memberships:
     users[member['user_id']] = member['user_full_name']
 
+if checkpoint.resumed:
+    print(f"Resuming with {len(events)} events from {args.checkpoint_file}")
+
 print("Getting Leads deleted...")
 
-while has_more:
-    resp = api.get(
-        'event',
-        params={'object_type': 'lead', 'action': 'deleted', '_cursor': cursor},
-    )
-    for event in resp['data']:
+for page in api.iter_pages(
+    'event',
+    params={'object_type': 'lead', 'action': 'deleted'},
+    checkpoint=checkpoint,
+):
+    for event in page:
         if args.print_lead_ids:
             leads.append(event['lead_id'])
 
@@ -117,8 +136,6 @@ while has_more:
 
         events.append(event_data)
     print(len(events))
-    cursor = resp['cursor_next']
-    has_more = bool(cursor)
 
 f = open(
     f'{org_name} Delete Lead Events in 30 Days.csv',
@@ -152,6 +169,8 @@ try:
 finally:
     f.close()
 
+checkpoint.finish()
+
 if args.print_lead_ids:
     print(f"Total Leads: {len(leads)}")
     print(leads)
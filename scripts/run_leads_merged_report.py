@@ -1,20 +1,27 @@
 import argparse
 import csv
+import sys
 
-import gevent.monkey
-from closeio_api import APIError, Client as CloseIO_API
-from gevent.pool import Pool
+from scripts.runtime import bootstrap
 
-gevent.monkey.patch_all()
+bootstrap()  # isort: split
+
+from closeio_api import APIError
+
+from scripts.CloseApiWrapper import CloseApiWrapper
 
 parser = argparse.ArgumentParser(
     description='Get a list of all lead merge events for the last 30 days from your Close organization'
 )
 parser.add_argument('--api-key', '-k', required=True, help='API Key')
+parser.add_argument(
+    '--response-cache',
+    help='Path to a SQLite file used to cache API responses between runs of this report',
+)
 args = parser.parse_args()
 
 # Initialize the Close API and get all users in the org
-api = CloseIO_API(args.api_key)
+api = CloseApiWrapper(args.api_key, response_cache=args.response_cache)
 
 org_id = api.get('me')['organizations'][0]['id']
 org = api.get(
@@ -56,23 +63,17 @@ def getSourceLeadData(event):
 
 print("Getting all merge events...")
 
-has_more = True
-cursor = ''
 events = []
-offset = 0
-
-# Get all merge events
-while has_more:
-    try:
-        resp = api.get(
-            'event',
-            params={
-                'object_type': 'lead',
-                'action': 'merged',
-                '_cursor': cursor,
-            },
-        )
-        for event in resp['data']:
+error = None
+
+# Get all merge events. The wrapper already retries the failures that are
+# worth retrying, so if the API still fails along the way, the report is
+# written with the events collected so far and flagged as incomplete.
+try:
+    for page in api.iter_pages(
+        'event', params={'object_type': 'lead', 'action': 'merged'}
+    ):
+        for event in page:
             if (
                 event.get('data')
                 and event.get('meta')
@@ -96,15 +97,13 @@ while has_more:
                     event_data['User'] = users[event['user_id']]
 
                 events.append(event_data)
-        cursor = resp['cursor_next']
-        has_more = bool(cursor)
-        offset = len(events)
-        print(f"Events found: {offset}")
-    except APIError as e:
-        print(f"Could not pull data for cursor: {cursor}")
+        print(f"Events found: {len(events)}")
+except APIError as e:
+    error = e
+    print(f"Could not pull all the merge events: {str(e)}")
 
 print("Getting data about the source lead for each merge event...")
-pool = Pool(7)
+pool = api.create_pool()
 pool.map(getSourceLeadData, events)
 
 # Write data to a CSV
@@ -133,3 +132,12 @@ try:
     writer.writerows(events)
 finally:
     f.close()
+
+api.add_stats_sections()
+
+if error:
+    print(
+        f"The report is incomplete: it only has the first {len(events)} "
+        f"merge events, because pulling the rest failed with: {error}"
+    )
+    sys.exit(1)
@@ -0,0 +1,474 @@
+"""
+Concurrency runtime shared by the scripts.
+
+Scripts pick their concurrency backend by calling `bootstrap()` before they
+import anything that does network I/O (requests, closeio_api, the wrappers):
+
+    import argparse
+
+    from scripts.runtime import bootstrap
+
+    bootstrap()  # isort: split
+
+    from scripts.CloseApiWrapper import CloseApiWrapper
+
+(The `isort: split` comment keeps isort from moving the imports that follow
+above the call.)
+
+The backend defaults to the `CLOSE_API_CONCURRENCY_BACKEND` environment
+variable, and then to `gevent`:
+
+- `gevent` monkey patches the standard library, so that pools of greenlets
+  run their requests concurrently.
+- `threads` leaves the standard library alone, and pools are thread pools.
+- `asyncio` is for scripts using `AsyncCloseApiWrapper`. Nothing is patched
+  (patched sockets would block the event loop), and pools are thread pools.
+
+`bootstrap()` then checks that blocking socket operations actually overlap
+on the chosen backend and logs the effective parallelism, with a warning if
+requests would run one at a time (see `check_concurrency`). The helpers below
+(`create_pool`, `spawn`, `wait_any`, `killall` and `Queue`) hand out the
+primitives of the backend in use.
+"""
+import logging
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+
+import gevent
+import gevent.monkey
+import gevent.pool
+import gevent.queue
+
+BACKENDS = ('gevent', 'threads', 'asyncio')
+DEFAULT_BACKEND = os.environ.get('CLOSE_API_CONCURRENCY_BACKEND', 'gevent')
+
+# Modules that hold on to unpatched sockets (or SSL contexts) if they're
+# imported before gevent's monkey patching.
+NETWORK_MODULES = ('ssl', 'urllib3', 'requests', 'closeio_api', 'aiohttp')
+
+# The startup check runs this many tasks that each block on a socket for
+# `PROBE_DELAY` seconds.
+PROBE_WORKERS = 8
+PROBE_DELAY = 0.05
+
+# A backend whose effective parallelism is below this share of the probe
+# workers is reported as not cooperative.
+MIN_PARALLELISM_RATIO = 0.5
+
+# Not the root logger, since `bootstrap()` runs before the scripts configure
+# logging, and logging to the root logger would configure it first.
+logger = logging.getLogger(__name__)
+
+_backend = None
+_report = None
+
+
+class ThreadKilled(BaseException):
+    """Raised in a killed thread (see `spawn`), like `GreenletExit`."""
+
+
+def bootstrap(backend=None, check=True):
+    """
+    Set up the concurrency `backend` (see `BACKENDS`) for the process and,
+    with `check`, log how well requests overlap on it. Calling it again
+    with the same backend does nothing.
+    """
+    global _backend
+    backend = backend or DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(
+            f'Unknown concurrency backend {backend!r}, pick one of: '
+            f'{", ".join(BACKENDS)}'
+        )
+    if _backend is not None:
+        if backend != _backend:
+            raise RuntimeError(
+                f'The {_backend} backend is already set up, the process '
+                f'can\'t switch to {backend}'
+            )
+        return
+
+    if backend == 'gevent' and not gevent.monkey.is_module_patched('socket'):
+        early = [name for name in NETWORK_MODULES if name in sys.modules]
+        if early:
+            logger.warning(
+                '%s imported before the gevent monkey patching, call '
+                'scripts.runtime.bootstrap() before importing them',
+                ', '.join(early),
+            )
+        gevent.monkey.patch_all()
+    _backend = backend
+
+    if check:
+        check_concurrency()
+
+
+def get_backend():
+    """
+    Return the backend set up by `bootstrap()`. Without one, greenlets are
+    used if the sockets are patched, and threads otherwise, since pools of
+    greenlets with blocking sockets run one request at a time.
+    """
+    if _backend is not None:
+        return _backend
+    if gevent.monkey.is_module_patched('socket'):
+        return 'gevent'
+    return 'threads'
+
+
+def _uses_gevent():
+    return get_backend() == 'gevent'
+
+
+def _block_on_socket(delay):
+    a, b = socket.socketpair()
+    try:
+        a.settimeout(delay)
+        try:
+            a.recv(1)
+        except socket.timeout:
+            pass
+    finally:
+        a.close()
+        b.close()
+
+
+async def _async_block_on_socket(delay):
+    import asyncio
+
+    a, b = socket.socketpair()
+    a.setblocking(False)
+    try:
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(loop.sock_recv(a, 1), delay)
+        except asyncio.TimeoutError:
+            pass
+    finally:
+        a.close()
+        b.close()
+
+
+async def _async_probe(workers, delay):
+    import asyncio
+
+    await asyncio.gather(
+        *(_async_block_on_socket(delay) for _ in range(workers))
+    )
+
+
+def check_concurrency(workers=PROBE_WORKERS, delay=PROBE_DELAY):
+    """
+    Run `workers` tasks that each wait on a socket for `delay` seconds, in a
+    pool of the backend in use (or on an event loop for `asyncio`), and
+    return a report of how many of them effectively ran at once. Also logs
+    the report, as a warning if the sockets aren't cooperative.
+    """
+    global _report
+    backend = get_backend()
+    if backend == 'asyncio':
+        # Imported here, since asyncio imports `ssl`, which mustn't be
+        # imported before the gevent monkey patching.
+        import asyncio
+
+        loop = asyncio.new_event_loop()
+        try:
+            start = time.monotonic()
+            loop.run_until_complete(_async_probe(workers, delay))
+        finally:
+            loop.close()
+    else:
+        pool = create_pool(workers)
+        start = time.monotonic()
+        pool.map(_block_on_socket, [delay] * workers)
+    parallelism = workers * delay / (time.monotonic() - start)
+    _report = {
+        'backend': backend,
+        'cooperative': parallelism >= workers * MIN_PARALLELISM_RATIO,
+        'parallelism': round(min(parallelism, workers), 1),
+        'probe_workers': workers,
+    }
+    if _report['cooperative']:
+        logger.info(
+            'Concurrency backend: %s, effective parallelism %.1f of %d',
+            backend,
+            _report['parallelism'],
+            workers,
+        )
+    else:
+        logger.warning(
+            'Sockets are not cooperative on the %s backend (effective '
+            'parallelism %.1f of %d), requests will run one at a time',
+            backend,
+            _report['parallelism'],
+            workers,
+        )
+    return _report
+
+
+def get_report():
+    """Return the report of the last `check_concurrency()`, if any."""
+    return _report
+
+
+class _ThreadHandle:
+    """
+    A function running in a thread of its own, with the parts of the
+    `gevent.Greenlet` API the wrappers use. Threads can't be interrupted, so
+    `kill()` only takes effect at the next `Queue` operation of the thread
+    (or before it starts), where `ThreadKilled` is raised.
+    """
+
+    _current = threading.local()
+
+    def __init__(self, func, args, kwargs):
+        self.value = None
+        self.exception = None
+        self._killed = threading.Event()
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._links = []
+        self._thread = threading.Thread(
+            target=self._run, args=(func, args, kwargs), daemon=True
+        )
+
+    @classmethod
+    def current(cls):
+        return getattr(cls._current, 'handle', None)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self, func, args, kwargs):
+        self._current.handle = self
+        try:
+            if self._killed.is_set():
+                raise ThreadKilled()
+            self.value = func(*args, **kwargs)
+        except ThreadKilled:
+            pass
+        except BaseException as e:
+            self.exception = e
+        finally:
+            # The callbacks run outside of the (possibly killed) handle, so
+            # that their queue operations don't raise `ThreadKilled`, and a
+            # failing one doesn't keep the others from running.
+            self._current.handle = None
+            with self._lock:
+                self._done.set()
+                links, self._links = self._links, []
+            for link in links:
+                try:
+                    link(self)
+                except Exception:
+                    logger.exception('Callback %r of a thread failed', link)
+
+    @property
+    def killed(self):
+        return self._killed.is_set()
+
+    def kill(self, block=False):
+        self._killed.set()
+        if block:
+            self.join()
+
+    def rawlink(self, callback):
+        """Call `callback(handle)` once the thread is done."""
+        with self._lock:
+            if not self._done.is_set():
+                self._links.append(callback)
+                return
+        callback(self)
+
+    def ready(self):
+        return self._done.is_set()
+
+    def successful(self):
+        return self.ready() and self.exception is None and not self.killed
+
+    def join(self, timeout=None):
+        self._done.wait(timeout)
+
+    def get(self):
+        self.join()
+        if self.exception is not None:
+            raise self.exception
+        return self.value
+
+
+class _ThreadQueue(queue.Queue):
+    """
+    `queue.Queue` that gives up waiting (with `ThreadKilled`) once the
+    thread waiting on it has been killed.
+    """
+
+    _POLL_INTERVAL = 0.1
+
+    def put(self, item, block=True, timeout=None):
+        handle = _ThreadHandle.current()
+        if handle is None or not block or timeout is not None:
+            return super().put(item, block, timeout)
+        while True:
+            if handle.killed:
+                raise ThreadKilled()
+            try:
+                return super().put(item, timeout=self._POLL_INTERVAL)
+            except queue.Full:
+                pass
+
+    def get(self, block=True, timeout=None):
+        handle = _ThreadHandle.current()
+        if handle is None or not block or timeout is not None:
+            return super().get(block, timeout)
+        while True:
+            if handle.killed:
+                raise ThreadKilled()
+            try:
+                return super().get(timeout=self._POLL_INTERVAL)
+            except queue.Empty:
+                pass
+
+
+class ThreadPool:
+    """
+    Thread based stand-in for `gevent.pool.Pool`, with the parts of its API
+    the scripts use. At most `size` functions run at a time, and `spawn`
+    waits for a free slot.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._handles = set()
+
+    def _release(self, handle):
+        with self._lock:
+            self._handles.discard(handle)
+        self._slots.release()
+
+    def spawn(self, func, *args, **kwargs):
+        self._slots.acquire()
+        current = _ThreadHandle.current()
+        if current is not None and current.killed:
+            # Killed while waiting for a slot.
+            self._slots.release()
+            raise ThreadKilled()
+        handle = _ThreadHandle(func, args, kwargs)
+        with self._lock:
+            self._handles.add(handle)
+        handle.rawlink(self._release)
+        handle.start()
+        return handle
+
+    def map(self, func, iterable):
+        handles = [self.spawn(func, item) for item in iterable]
+        return [handle.get() for handle in handles]
+
+    def map_async(self, func, iterable):
+        return spawn(self.map, func, iterable)
+
+    def imap_unordered(self, func, iterable):
+        """
+        Yield `func(item)` for every item as soon as it's done. Items are
+        taken from `iterable` only as slots free up, so it can be a long
+        generator. Stopping the iteration early kills the calls it started,
+        and leaves the rest of the pool alone.
+        """
+        results = _ThreadQueue()
+        done = object()
+        lock = threading.Lock()
+        running = set()
+        closed = False
+
+        def _feed():
+            count = 0
+            for item in iterable:
+                handle = self.spawn(func, item)
+                with lock:
+                    if closed:
+                        handle.kill()
+                        return
+                    running.add(handle)
+                handle.rawlink(results.put_nowait)
+                count += 1
+            results.put((done, count))
+
+        feeder = spawn(_feed)
+        pending, total = 0, None
+        try:
+            while total is None or pending < total:
+                result = results.get()
+                if isinstance(result, tuple) and result[0] is done:
+                    total = result[1]
+                    continue
+                with lock:
+                    running.discard(result)
+                pending += 1
+                yield result.get()
+            feeder.get()
+        finally:
+            feeder.kill()
+            with lock:
+                closed = True
+                handles = list(running)
+            for handle in handles:
+                handle.kill()
+
+    def join(self):
+        with self._lock:
+            handles = list(self._handles)
+        for handle in handles:
+            handle.join()
+
+    def kill(self, block=False):
+        with self._lock:
+            handles = list(self._handles)
+        for handle in handles:
+            handle.kill(block=block)
+
+
+def create_pool(size):
+    """Return a pool of the backend in use running `size` tasks at a time."""
+    if _uses_gevent():
+        return gevent.pool.Pool(size)
+    return ThreadPool(size)
+
+
+def spawn(func, *args, **kwargs):
+    """Start `func(*args, **kwargs)` in a greenlet or a thread."""
+    if _uses_gevent():
+        return gevent.spawn(func, *args, **kwargs)
+    handle = _ThreadHandle(func, args, kwargs)
+    handle.start()
+    return handle
+
+
+def wait_any(handles):
+    """Wait for one of the spawned `handles` to be done, and return it."""
+    if _uses_gevent():
+        return gevent.wait(handles, count=1)[0]
+    done = queue.SimpleQueue()
+    for handle in handles:
+        handle.rawlink(done.put)
+    return done.get()
+
+
+def killall(handles):
+    """Kill the spawned `handles` without waiting for them."""
+    if _uses_gevent():
+        gevent.killall(handles, block=False)
+        return
+    for handle in handles:
+        handle.kill()
+
+
+def Queue(maxsize=0):
+    """Return a queue for passing items between spawned tasks."""
+    if _uses_gevent():
+        return gevent.queue.Queue(maxsize=maxsize)
+    return _ThreadQueue(maxsize=maxsize)
@@ -0,0 +1,209 @@
+import asyncio
+import collections
+import threading
+import time
+
+# How long (in seconds) a successful GET response is reused for identical
+# GETs that follow it.
+DEFAULT_RESULT_TTL = 10
+
+# Upper bounds for the number of results kept around, and for their total
+# size in bytes (as measured by `sizeof`), so that results that happen to
+# be large pages don't pile up in memory. Results larger than `max_bytes`
+# aren't kept at all.
+DEFAULT_MAX_RESULTS = 128
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False
+
+
+class _ResultCache:
+    """Bounded store of recent results, keyed by `(generation, key)`."""
+
+    def __init__(self, ttl, max_results, max_bytes, sizeof):
+        self.ttl = ttl
+        self.max_results = max_results
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.generation = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.size = 0
+        self._results = collections.OrderedDict()
+
+    def _pop(self, key=None):
+        if key is None:
+            _, entry = self._results.popitem(last=False)
+        else:
+            entry = self._results.pop(key)
+        self.size -= entry[2]
+
+    def get(self, key):
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            self._pop(key)
+            return None
+        self._results.move_to_end(key)
+        self.cache_hits += 1
+        return entry
+
+    def set(self, key, result):
+        if not self.ttl or key[0] != self.generation:
+            return
+        size = self.sizeof(result) if self.sizeof else 0
+        if size > self.max_bytes:
+            return
+        if key in self._results:
+            self._pop(key)
+        self._results[key] = (time.monotonic() + self.ttl, result, size)
+        self.size += size
+        while (
+            len(self._results) > self.max_results or self.size > self.max_bytes
+        ):
+            self._pop()
+
+    def invalidate(self):
+        self.generation += 1
+        self._results.clear()
+        self.size = 0
+
+    def stats(self):
+        return {
+            'cache_hits': self.cache_hits,
+            'coalesced': self.coalesced,
+            'cached_results': len(self._results),
+            'cached_bytes': self.size,
+        }
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: while a call for a key is in
+    flight, other callers of the same key wait for it and share its outcome
+    (result or exception) instead of making the same call again. Results
+    that `cacheable(result)` accepts are then kept for `ttl` seconds (0 to
+    disable), so that repeats right after the call are absorbed as well.
+    At most `max_results` results are kept, and `max_bytes` bytes of them
+    as measured by `sizeof(result)`.
+
+    `invalidate()` drops the cached results and stops joining the calls
+    already in flight, so that nothing fetched before a write is handed out
+    after it. Results are shared as is, so they should be immutable (or
+    copied by the callers).
+    """
+
+    def __init__(
+        self,
+        ttl=DEFAULT_RESULT_TTL,
+        max_results=DEFAULT_MAX_RESULTS,
+        max_bytes=DEFAULT_MAX_BYTES,
+        sizeof=None,
+    ):
+        self._lock = threading.Lock()
+        self._cache = _ResultCache(ttl, max_results, max_bytes, sizeof)
+        self._in_flight = {}
+
+    def do(self, key, fetch, cacheable=None):
+        """Return `fetch()`, or the outcome of an identical call."""
+        with self._lock:
+            key = (self._cache.generation, key)
+            entry = self._cache.get(key)
+            if entry is not None:
+                return entry[1]
+            call = self._in_flight.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._in_flight[key] = _Call()
+            else:
+                self._cache.coalesced += 1
+
+        if not is_leader:
+            call.done.wait()
+            if call.abandoned:
+                # The leader was interrupted (e.g. its greenlet was killed),
+                # so there's nothing to share. Try again on our own.
+                return self.do(key[1], fetch, cacheable)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fetch()
+        except Exception as e:
+            call.error = e
+            raise
+        except BaseException:
+            call.abandoned = True
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                if call.error is None and not call.abandoned:
+                    if cacheable is None or cacheable(call.result):
+                        self._cache.set(key, call.result)
+            call.done.set()
+        return call.result
+
+    def invalidate(self):
+        with self._lock:
+            self._cache.invalidate()
+
+    def stats(self):
+        with self._lock:
+            return self._cache.stats()
+
+
+class AsyncSingleFlight:
+    """asyncio variant of `SingleFlight`, for a single event loop."""
+
+    def __init__(
+        self,
+        ttl=DEFAULT_RESULT_TTL,
+        max_results=DEFAULT_MAX_RESULTS,
+        max_bytes=DEFAULT_MAX_BYTES,
+        sizeof=None,
+    ):
+        self._cache = _ResultCache(ttl, max_results, max_bytes, sizeof)
+        self._in_flight = {}
+
+    async def do(self, key, fetch, cacheable=None):
+        """Return `await fetch()`, or the outcome of an identical call."""
+        key = (self._cache.generation, key)
+        entry = self._cache.get(key)
+        if entry is not None:
+            return entry[1]
+        future = self._in_flight.get(key)
+        if future is not None:
+            self._cache.coalesced += 1
+            try:
+                # Shielded, so that a cancelled follower doesn't cancel the
+                # call for everyone else.
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    return await self.do(key[1], fetch, cacheable)
+                raise
+
+        future = asyncio.ensure_future(fetch())
+        self._in_flight[key] = future
+        try:
+            result = await future
+        finally:
+            del self._in_flight[key]
+        if cacheable is None or cacheable(result):
+            self._cache.set(key, result)
+        return result
+
+    def invalidate(self):
+        self._cache.invalidate()
+
+    def stats(self):
+        return self._cache.stats()
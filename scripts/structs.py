@@ -0,0 +1,270 @@
+"""
+Typed structs for the objects of the main list endpoints (`Lead`,
+`Contact`, `Activity` and `Event`), for scripts that page through a lot of
+them and only look at a few fields.
+
+A page decoded with `decode_page(content, struct)` holds struct instances
+instead of dicts, with only the struct's fields (or the fields requested with
+`_fields`, see `project_struct`) and the rest of every object skipped. When
+msgspec is installed the structs are msgspec structs and the page is decoded
+straight into them. Otherwise they're plain slotted classes built from the
+decoded JSON. Either way they can be read like the dicts they replace
+(`item['id']`, `item.get('lead_id')`), as well as by attribute.
+"""
+import functools
+import json
+import keyword
+from typing import Any, ClassVar, List
+
+from scripts.json_codec import msgspec
+
+LEAD_FIELDS = (
+    'id',
+    'display_name',
+    'name',
+    'status_id',
+    'status_label',
+    'description',
+    'url',
+    'contacts',
+    'addresses',
+    'opportunities',
+    'tasks',
+    'custom',
+    'organization_id',
+    'created_by',
+    'updated_by',
+    'date_created',
+    'date_updated',
+)
+
+CONTACT_FIELDS = (
+    'id',
+    'lead_id',
+    'name',
+    'title',
+    'display_name',
+    'emails',
+    'phones',
+    'urls',
+    'organization_id',
+    'created_by',
+    'updated_by',
+    'date_created',
+    'date_updated',
+)
+
+ACTIVITY_FIELDS = (
+    'id',
+    '_type',
+    'lead_id',
+    'contact_id',
+    'user_id',
+    'user_name',
+    'status',
+    'direction',
+    'duration',
+    'disposition',
+    'note',
+    'subject',
+    'text',
+    'local_phone',
+    'remote_phone',
+    'recording_url',
+    'voicemail_url',
+    'cost',
+    'source',
+    'sequence_id',
+    'organization_id',
+    'created_by',
+    'updated_by',
+    'date_created',
+    'date_updated',
+)
+
+EVENT_FIELDS = (
+    'id',
+    'object_type',
+    'object_id',
+    'lead_id',
+    'action',
+    'changed_fields',
+    'previous_data',
+    'data',
+    'meta',
+    'request_id',
+    'user_id',
+    'api_key_id',
+    'oauth_client_id',
+    'organization_id',
+    'date_created',
+    'date_updated',
+)
+
+# Keys of a page (besides `data`) that are kept by `decode_page`.
+PAGE_KEYS = ('has_more', 'cursor_next', 'total_results')
+
+
+def _getitem(self, name):
+    if name not in self.FIELDS:
+        raise KeyError(name)
+    return getattr(self, name)
+
+
+def _get(self, name, default=None):
+    if name not in self.FIELDS:
+        return default
+    return getattr(self, name)
+
+
+def _to_dict(self):
+    return {name: getattr(self, name) for name in self.FIELDS}
+
+
+class _SlottedStruct:
+    __slots__ = ()
+    FIELDS = ()
+
+    def __init__(self, **values):
+        for name in self.FIELDS:
+            setattr(self, name, values.get(name))
+
+    __getitem__ = _getitem
+    get = _get
+    to_dict = _to_dict
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        values = ', '.join(
+            f'{name}={getattr(self, name)!r}' for name in self.FIELDS
+        )
+        return f'{type(self).__name__}({values})'
+
+
+def _make_from_json(struct):
+    """
+    Return a `from_json` classmethod for the slotted `struct`, which sets
+    every field through its slot descriptor, skipping the attribute lookups
+    of `setattr`.
+    """
+    setters = [
+        (field, getattr(struct, field).__set__) for field in struct.__slots__
+    ]
+
+    def from_json(cls, obj):
+        instance = cls.__new__(cls)
+        get = obj.get
+        for field, set_value in setters:
+            set_value(instance, get(field))
+        return instance
+
+    return classmethod(from_json)
+
+
+if msgspec is not None:
+    # Structs only ever hold JSON values, which can't refer back to them, so
+    # they're left out of the garbage collector.
+    class _MsgspecStruct(msgspec.Struct, kw_only=True, gc=False):
+        FIELDS: ClassVar[tuple] = ()
+
+        @classmethod
+        def from_json(cls, obj):
+            return cls(**{name: obj.get(name) for name in cls.FIELDS})
+
+        __getitem__ = _getitem
+        get = _get
+        to_dict = _to_dict
+
+
+def define_struct(name, fields):
+    """Return a new struct type called `name`, holding the given `fields`."""
+    fields = tuple(fields)
+    invalid = [
+        field
+        for field in fields
+        if not field.isidentifier() or keyword.iskeyword(field)
+    ]
+    if invalid:
+        raise ValueError(
+            f'{name} fields must be identifiers, got: {", ".join(invalid)}'
+        )
+    if msgspec is not None:
+        struct = msgspec.defstruct(
+            name,
+            [(field, Any, None) for field in fields],
+            bases=(_MsgspecStruct,),
+            kw_only=True,
+            gc=False,
+        )
+    else:
+        struct = type(name, (_SlottedStruct,), {'__slots__': fields})
+        struct.from_json = _make_from_json(struct)
+    struct.FIELDS = fields
+    return struct
+
+
+Lead = define_struct('Lead', LEAD_FIELDS)
+Contact = define_struct('Contact', CONTACT_FIELDS)
+Activity = define_struct('Activity', ACTIVITY_FIELDS)
+Event = define_struct('Event', EVENT_FIELDS)
+
+
+@functools.lru_cache(maxsize=None)
+def _project_struct(struct, fields):
+    return define_struct(struct.__name__, fields)
+
+
+def project_struct(struct, fields=None):
+    """
+    Return a variant of `struct` that holds only the given `fields` (a list
+    or a comma separated `_fields` param), so that a page requested with
+    `_fields` is decoded into just those fields. Without `fields`, `struct`
+    itself is returned.
+    """
+    if not fields:
+        return struct
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    fields = tuple(dict.fromkeys(fields))
+    if fields == struct.FIELDS:
+        return struct
+    return _project_struct(struct, fields)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_page_decoder(struct):
+    page = msgspec.defstruct(
+        f'{struct.__name__}Page',
+        [('data', List[struct], [])]
+        + [(key, Any, msgspec.UNSET) for key in PAGE_KEYS],
+    )
+    return msgspec.json.Decoder(page).decode
+
+
+def decode_page(content, struct, json_decoder=json.loads):
+    """
+    Decode a page of a list endpoint into a dict like the API's, except that
+    its `data` holds `struct` instances. Only `data` and the `PAGE_KEYS` are
+    kept. `json_decoder` is used when msgspec isn't installed.
+    """
+    if msgspec is None:
+        return to_struct_page(json_decoder(content), struct)
+
+    page = _get_page_decoder(struct)(content)
+    resp = {'data': page.data}
+    for key in PAGE_KEYS:
+        value = getattr(page, key)
+        if value is not msgspec.UNSET:
+            resp[key] = value
+    return resp
+
+
+def to_struct_page(resp, struct):
+    """Same as `decode_page`, for a page that has already been decoded."""
+    page = {key: resp[key] for key in PAGE_KEYS if key in resp}
+    page['data'] = [struct.from_json(item) for item in resp['data']]
+    return page
@@ -3,9 +3,14 @@ import csv
 import time
 from datetime import datetime, timedelta
 
-from closeio_api import Client as CloseIO_API
 from dateutil import tz
 
+from scripts.runtime import bootstrap
+
+bootstrap()  # isort: split
+
+from scripts.CloseApiWrapper import CloseApiWrapper
+
 parser = argparse.ArgumentParser(
     description='Get Time To Respond Metrics From Org'
 )
@@ -29,14 +34,20 @@ parser.add_argument(
     action='store_true',
     help='Get stats per individual user',
 )
+parser.add_argument(
+    '--response-cache',
+    help='Path to a SQLite file used to cache API responses between runs of this report',
+)
 
 args = parser.parse_args()
 
-api = CloseIO_API(args.api_key)
+api = CloseApiWrapper(args.api_key, response_cache=args.response_cache)
 
-org_id = api.get('me')['organizations'][0]['id']
-org_name = api.get('organization/' + org_id)['name']
-org_memberships = api.get('organization/' + org_id)['memberships']
+org_id = api.get_organization_id()
+org_name = api.get('organization/' + org_id, params={'_fields': 'name'})[
+    'name'
+]
+org_memberships = api.get_memberships()
 
 assert (
     args.org_count or args.user_counts
@@ -90,36 +101,21 @@ def getTTR(user):
             f"Getting all activities in the last {args.past_days} days for {'All Users'}..."
         )
 
-    has_more = True
     offset = 0
     seconds = 0
     seconds_inc = 0
-    resp = None
     activities = []
 
-    while has_more:
-        if user != None:
-            resp = api.get(
-                'activity',
-                params={
-                    '_skip': offset,
-                    'date_created__gte': start,
-                    'date_created__lte': end,
-                    '_fields': '_type,id,date_created,lead_id,direction,user_id,duration',
-                    'user_id': user['user_id'],
-                },
-            )
-        else:
-            resp = api.get(
-                'activity',
-                params={
-                    '_skip': offset,
-                    'date_created__gte': start,
-                    'date_created__lte': end,
-                    '_fields': '_type,id,date_created,lead_id,direction,user_id,duration',
-                },
-            )
-        for activity in resp['data']:
+    params = {
+        'date_created__gte': start,
+        'date_created__lte': end,
+        '_fields': '_type,id,date_created,lead_id,direction,user_id,duration',
+    }
+    if user != None:
+        params['user_id'] = user['user_id']
+
+    for page in api.iter_pages('activity', params=params):
+        for activity in page:
             if (
                 activity['_type'] in ['Call', 'Email', 'SMS']
                 and activity['lead_id'] != None
@@ -129,8 +125,7 @@ def getTTR(user):
                 )
                 activities.append(activity)
         print(offset)
-        offset += len(resp['data'])
-        has_more = resp['has_more']
+        offset += len(page)
     if user == None:
         user = {}
         user['user_full_name'] = 'All Users'
@@ -295,3 +290,5 @@ try:
     writer.writerows(user_stats)
 finally:
     f.close()
+
+api.add_stats_sections()
@@ -0,0 +1,68 @@
+import argparse
+import logging
+import sys
+
+from scripts.runtime import bootstrap
+
+bootstrap()  # isort: split
+
+from scripts.CloseApiWrapper import CloseApiWrapper
+
+parser = argparse.ArgumentParser(
+    description='Set the status or a custom field of all the leads matching '
+    'a search query. The change runs server-side as a bulk edit.'
+)
+parser.add_argument('--api-key', '-k', required=True, help='API Key')
+parser.add_argument('--query', required=True, help='Search query.')
+group = parser.add_mutually_exclusive_group(required=True)
+group.add_argument('--status', help='Label of the new lead status.')
+group.add_argument(
+    '--custom-field', help='Name of the custom field to set or clear.'
+)
+parser.add_argument(
+    '--value',
+    help='Value of the custom field. Without it, the custom field is cleared.',
+)
+parser.add_argument(
+    '--confirmed',
+    action='store_true',
+    help='Without this flag, the script will do a dry run without actually '
+    'updating any data.',
+)
+parser.add_argument(
+    '--journal',
+    help='Append the outcome of every update to this file as JSON lines '
+    '(when the leads are updated one by one).',
+)
+args = parser.parse_args()
+
+log_format = "[%(asctime)s] %(levelname)s %(message)s"
+if not args.confirmed:
+    log_format = 'DRY RUN: ' + log_format
+logging.basicConfig(level=logging.INFO, format=log_format)
+
+api = CloseApiWrapper(args.api_key)
+
+if args.status:
+    status_ids = [
+        status['id']
+        for status in api.get_lead_statuses()
+        if status['label'].lower() == args.status.lower()
+    ]
+    if not status_ids:
+        logging.error(f'Status not found: {args.status}')
+        sys.exit(1)
+    data = {'status_id': status_ids[0]}
+else:
+    data = {f'custom.{args.custom_field}': args.value}
+
+logging.info(f'Updating the leads matching {args.query!r} with {data}')
+counts = api.update_leads(
+    args.query, data, dry_run=not args.confirmed, journal=args.journal
+)
+logging.info(
+    f'Done! {counts["updated"]} updated, {counts["skipped"]} skipped, '
+    f'{counts["failed"]} failed.'
+)
+if counts['failed']:
+    sys.exit(1)
@@ -1,7 +1,11 @@
 import argparse
 import sys
 
-from closeio_api import Client as CloseIO_API
+from scripts.runtime import bootstrap
+
+bootstrap()  # isort: split
+
+from scripts.CloseApiWrapper import CloseApiWrapper
 
 parser = argparse.ArgumentParser(
     description="Change all the opportunities for a given leads' search query to a given status."
@@ -11,10 +15,14 @@ parser.add_argument('--query', type=str, required=True, help='Search query.')
 parser.add_argument(
     '--status', type=str, required=True, help='Label of the new status'
 )
+parser.add_argument(
+    '--journal',
+    help='Append the outcome of every update to this file as JSON lines.',
+)
 args = parser.parse_args()
 
 # Should tell you how many leads are going to be affected
-api = CloseIO_API(args.api_key)
+api = CloseApiWrapper(args.api_key)
 
 # Get the status_id
 org_id = api.get('api_key')['data'][0]['organization_id']
@@ -30,20 +38,13 @@ new_status_id = new_status_id[0]
 
 print(f'Gathering opportunities for {args.query}')
 
-has_more = True
-offset = 0
-limit = 50
-opp_ids = []
-
-while has_more:
-    resp = api.get(
-        'lead', params={'_skip': offset, '_limit': limit, 'query': args.query}
+opp_ids = [
+    opp['id']
+    for lead in api.iter_items(
+        'lead', params={'_limit': 50, 'query': args.query}
     )
-    opp_ids.extend(
-        [opp['id'] for lead in resp['data'] for opp in lead['opportunities']]
-    )
-    has_more = resp['has_more']
-    offset += limit
+    for opp in lead['opportunities']
+]
 
 ans = input(
     '{0} opportunities found. Do you want to update all of them to {1}? (y/n): '.format(
@@ -56,9 +57,14 @@ if ans.lower() != 'y':
 print(f'Updating opportunities to {args.status}')
 
 # Update opps
-for opp_id in opp_ids:
-    resp = api.put(
-        'opportunity/{0}'.format(opp_id), data={'status_id': new_status_id}
-    )
+operations = (
+    ('put', f'opportunity/{opp_id}', {'status_id': new_status_id})
+    for opp_id in opp_ids
+)
+failed = 0
+for result in api.bulk_execute(operations, journal=args.journal):
+    if result['status'] == 'failed':
+        failed += 1
+        print(f"Couldn't update {result['endpoint']}: {result['error']}")
 
-print('Done!')
+print(f'Done! {len(opp_ids) - failed} updated, {failed} failed.')
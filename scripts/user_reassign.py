@@ -4,7 +4,11 @@
 import argparse
 import logging
 
-from closeio_api import APIError, Client as CloseIO_API
+from scripts.runtime import bootstrap
+
+bootstrap()  # isort: split
+
+from scripts.CloseApiWrapper import CloseApiWrapper
 
 parser = argparse.ArgumentParser(
     description='Assigns tasks or opportunities from one user to another'
@@ -29,6 +33,10 @@ parser.add_argument(
     action='store_true',
     help='Do not abort after first error',
 )
+parser.add_argument(
+    '--journal',
+    help='Append the outcome of every update to this file as JSON lines.',
+)
 group = parser.add_argument_group()
 group.add_argument(
     '--tasks',
@@ -53,9 +61,6 @@ group.add_argument(
 
 args = parser.parse_args()
 
-full_tasks = []
-full_opps = []
-
 if not any(
     [args.tasks, args.opportunities, args.all_tasks, args.all_opportunities]
 ):
@@ -67,18 +72,12 @@ if not args.confirmed:
 logging.basicConfig(level=logging.INFO, format=log_format)
 logging.debug(f'parameters: {vars(args)}')
 
-api = CloseIO_API(args.api_key)
+api = CloseApiWrapper(args.api_key)
 
 emails_to_ids = {}
 if any([args.from_user_email, args.to_user_email]):
-    has_more = True
-    offset = 0
-    while has_more:
-        resp = api.get('user', params={'_skip': offset})
-        for user in resp['data']:
-            emails_to_ids[user['email']] = user['id']
-        offset += len(resp['data'])
-        has_more = resp['has_more']
+    for user in api.iter_items('user'):
+        emails_to_ids[user['email']] = user['id']
 
 logging.debug(emails_to_ids)
 
@@ -107,90 +106,78 @@ logging.info(f'to user_id: {to_user_id} ({ids_to_emails[to_user_id]})')
 
 assert from_user_id != to_user_id, 'equal user codes'
 
-opportunities_errors = 0
+
+def reassign(endpoint, params, data):
+    """
+    Apply `data` to every object returned by `endpoint` for `params` and
+    return the number of updated objects, the number of errors and whether
+    we stopped on an error.
+    """
+    # Gather all the IDs first, since reassigning the objects while we're
+    # paginating through them would shift the pages.
+    ids = [
+        obj['id']
+        for obj in api.iter_items(
+            endpoint, params=params, date_field='date_created'
+        )
+    ]
+    stopped = False
+
+    def get_operations():
+        for obj_id in ids:
+            # Once stopped, no new updates are started, but the ones in
+            # flight still complete and are journaled.
+            if stopped:
+                return
+            yield 'put', f'{endpoint}/{obj_id}', data
+
+    updated = errors = 0
+    for result in api.bulk_execute(
+        get_operations(), dry_run=not args.confirmed, journal=args.journal
+    ):
+        obj_id = result['endpoint'].split('/')[-1]
+        if result['status'] == 'failed':
+            errors += 1
+            if not args.continue_on_error and not stopped:
+                logging.error(f'stopped on error {result["error"]}')
+                stopped = True
+                continue
+            logging.error(
+                f'{endpoint} {obj_id} skipped with error {result["error"]}'
+            )
+        else:
+            logging.info(f'updated {obj_id}')
+            updated += 1
+    return updated, errors, stopped
+
+
+stopped = False
+
+# tasks
+updated_tasks = 0
 tasks_errors = 0
-try:
-    # tasks
-    updated_tasks = 0
-    if args.tasks or args.all_tasks:
-        has_more = True
-        offset = 0
-        while has_more:
-            payload = {
-                'assigned_to': from_user_id,
-                '_order_by': 'date_created',
-                '_skip': offset,
-                '_fields': 'id',
-            }
-
-            if not args.all_tasks:
-                payload['is_complete'] = False
-
-            resp = api.get('task', params=payload)
-
-            tasks = resp['data']
-            for task in tasks:
-                if args.confirmed:
-                    full_tasks.append(task['id'])
-                else:
-                    logging.info(f'updated {task["id"]}')
-                    updated_tasks += 1
-            offset += len(tasks)
-            has_more = resp['has_more']
-
-        for task_id in full_tasks:
-            try:
-                api.put('task/' + task_id, data={'assigned_to': to_user_id})
-                logging.info(f'updated {task_id}')
-                updated_tasks += 1
-            except APIError as e:
-                tasks_errors += 1
-                if not args.continue_on_error:
-                    raise e
-                logging.error(f'task {task["id"]} skipped with error {str(e)}')
-
-    # opportunities
-    updated_opportunities = 0
-    if args.opportunities or args.all_opportunities:
-        has_more = True
-        offset = 0
-        while has_more:
-            payload = {
-                'user_id': from_user_id,
-                '_order_by': 'date_created',
-                '_skip': offset,
-                '_fields': 'id',
-            }
-
-            if not args.all_opportunities:
-                payload['status_type'] = 'active'
-
-            resp = api.get('opportunity', params=payload)
-
-            opportunities = resp['data']
-            for opportunity in opportunities:
-                if args.confirmed:
-                    full_opps.append(opportunity['id'])
-                else:
-                    logging.info(f'updated {opportunity["id"]}')
-                    updated_opportunities += 1
-            offset += len(opportunities)
-            has_more = resp['has_more']
-
-        for opp_id in full_opps:
-            try:
-                api.put('opportunity/' + opp_id, data={'user_id': to_user_id})
-                logging.info(f'updated {opp_id}')
-                updated_opportunities += 1
-            except APIError as e:
-                opportunities_errors += 1
-                if not args.continue_on_error:
-                    raise e
-                logging.error(
-                    f'opportunity {opportunity["id"]} skipped with error {str(e)}'
-                )
-except APIError as e:
-    logging.error(f'stopped on error {str(e)}')
+if args.tasks or args.all_tasks:
+    params = {'assigned_to': from_user_id, '_fields': 'id'}
+
+    if not args.all_tasks:
+        params['is_complete'] = False
+
+    updated_tasks, tasks_errors, stopped = reassign(
+        'task', params, {'assigned_to': to_user_id}
+    )
+
+# opportunities
+updated_opportunities = 0
+opportunities_errors = 0
+if not stopped and (args.opportunities or args.all_opportunities):
+    params = {'user_id': from_user_id, '_fields': 'id'}
+
+    if not args.all_opportunities:
+        params['status_type'] = 'active'
+
+    updated_opportunities, opportunities_errors, stopped = reassign(
+        'opportunity', params, {'user_id': to_user_id}
+    )
 
 logging.info(
     f'summary: updated tasks {updated_tasks}, updated opportunities {updated_opportunities}'
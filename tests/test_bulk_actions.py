@@ -0,0 +1,105 @@
+import pytest
+
+from scripts.CloseApiWrapper import (
+    BulkActionTimeout,
+    CloseApiWrapper,
+    get_lead_bulk_edit,
+)
+from scripts.fake_close_api import FakeCloseApi
+
+
+@pytest.fixture
+def fake():
+    with FakeCloseApi(leads=30, activities_per_lead=0) as fake:
+        yield fake
+
+
+@pytest.fixture
+def api(fake):
+    return CloseApiWrapper('fake', base_url=fake.base_url)
+
+
+def get_status_ids(fake):
+    return {lead['status_id'] for lead in fake.objects['lead'].values()}
+
+
+@pytest.mark.parametrize(
+    'data, expected',
+    [
+        (
+            {'status_id': 'stat_1'},
+            {'type': 'set_lead_status', 'lead_status_id': 'stat_1'},
+        ),
+        (
+            {'custom.Source': 'Web'},
+            {
+                'type': 'set_custom_field',
+                'custom_field_name': 'Source',
+                'custom_field_value': 'Web',
+            },
+        ),
+        (
+            {'custom.cf_123': None},
+            {'type': 'clear_custom_field', 'custom_field_id': 'cf_123'},
+        ),
+        ({'name': 'Acme'}, None),
+        ({'status_id': 'stat_1', 'name': 'Acme'}, None),
+    ],
+)
+def test_get_lead_bulk_edit(data, expected):
+    assert get_lead_bulk_edit(data) == expected
+
+
+def test_update_leads_with_a_bulk_edit(fake, api):
+    status_id = api.get_lead_statuses()[-1]['id']
+    requests = fake.request_count
+    counts = api.update_leads('*', {'status_id': status_id})
+
+    assert counts == {
+        'updated': len(fake.objects['lead']),
+        'skipped': 0,
+        'failed': 0,
+    }
+    assert get_status_ids(fake) == {status_id}
+    # A bulk action and its poll, not a PUT per lead.
+    assert fake.request_count - requests == 2
+
+
+def test_update_leads_one_by_one(fake, api):
+    counts = api.update_leads('*', {'description': 'Updated'})
+
+    assert counts == {
+        'updated': len(fake.objects['lead']),
+        'skipped': 0,
+        'failed': 0,
+    }
+    descriptions = {lead['description'] for lead in fake.objects['lead'].values()}
+    assert descriptions == {'Updated'}
+
+
+def test_update_leads_dry_run(fake, api):
+    status_ids = get_status_ids(fake)
+    status_id = api.get_lead_statuses()[-1]['id']
+    counts = api.update_leads('*', {'status_id': status_id}, dry_run=True)
+
+    assert counts == {
+        'updated': 0,
+        'skipped': len(fake.objects['lead']),
+        'failed': 0,
+    }
+    assert get_status_ids(fake) == status_ids
+
+
+def test_bulk_action_timeout(fake, api):
+    bulk_action = api.submit_bulk_action('delete', 'nothing matches this')
+    fake.bulk_actions[bulk_action['id']].update(
+        status='processing', n_leads=10, n_leads_processed=3
+    )
+    with pytest.raises(BulkActionTimeout, match='3/10'):
+        api.wait_for_bulk_action(
+            'delete', bulk_action['id'], poll_interval=0.01, timeout=0.05
+        )
+
+    fake.bulk_actions[bulk_action['id']]['status'] = 'finished'
+    final = api.wait_for_bulk_action('delete', bulk_action['id'])
+    assert (final['n_leads'], final['n_leads_processed']) == (10, 3)
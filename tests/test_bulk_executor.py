@@ -0,0 +1,111 @@
+import json
+import threading
+import time
+
+import pytest
+import requests
+from closeio_api import APIError
+
+from scripts import bulk_executor
+from scripts.bulk_executor import BulkExecutor
+from scripts.runtime import ThreadPool
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = f'{{"error": "{status_code}"}}'
+
+
+class Api:
+    """Client whose writes fail with the given errors, then succeed."""
+
+    def __init__(self, *errors, latency=0):
+        self.errors = list(errors)
+        self.latency = latency
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def create_pool(self):
+        return ThreadPool(4)
+
+    def _write(self, method, endpoint):
+        with self._lock:
+            self.calls.append((method, endpoint))
+            error = self.errors.pop(0) if self.errors else None
+        time.sleep(self.latency)
+        if error:
+            raise error
+
+    def post(self, endpoint, data):
+        self._write('post', endpoint)
+
+    def put(self, endpoint, data):
+        self._write('put', endpoint)
+
+    def delete(self, endpoint):
+        self._write('delete', endpoint)
+
+
+@pytest.fixture(autouse=True)
+def no_delay(monkeypatch):
+    monkeypatch.setattr(bulk_executor, 'RETRY_DELAY', 0)
+
+
+@pytest.mark.parametrize(
+    'method, errors, status, attempts',
+    [
+        ('put', [], 'succeeded', 1),
+        ('put', [APIError(Response(503))], 'succeeded', 2),
+        ('delete', [requests.exceptions.Timeout()], 'succeeded', 2),
+        ('put', [APIError(Response(503))] * 3, 'failed', 3),
+        # Not worth retrying.
+        ('put', [APIError(Response(400))], 'failed', 1),
+        # May have gone through, so retrying could create a duplicate.
+        ('post', [APIError(Response(503))], 'failed', 1),
+        ('post', [requests.exceptions.Timeout()], 'failed', 1),
+    ],
+)
+def test_retries(method, errors, status, attempts):
+    api = Api(*errors)
+    result = BulkExecutor(api).execute((method, 'task/task_1', {}))
+
+    assert result['status'] == status
+    assert result['attempts'] == attempts
+    assert len(api.calls) == attempts
+
+
+def test_dry_run():
+    api = Api()
+    result = BulkExecutor(api, dry_run=True).execute(
+        ('put', 'task/task_1', {})
+    )
+    assert result['status'] == 'skipped'
+    assert api.calls == []
+
+
+def test_stopping_the_operations_keeps_the_ones_in_flight(tmp_path):
+    journal = str(tmp_path / 'journal.jsonl')
+    api = Api(APIError(Response(400)), latency=0.05)
+    stopped = False
+
+    def get_operations():
+        for i in range(100):
+            if stopped:
+                return
+            yield 'put', f'task/task_{i}', {}
+
+    results = []
+    for result in BulkExecutor(api, journal=journal).run(get_operations()):
+        results.append(result)
+        if result['status'] == 'failed':
+            stopped = True
+
+    # Everything that was sent was reported and journaled.
+    assert 1 < len(api.calls) < 100
+    assert len(results) == len(api.calls)
+    with open(journal) as f:
+        entries = [json.loads(line) for line in f]
+    assert sorted(entry['endpoint'] for entry in entries) == sorted(
+        endpoint for _, endpoint in api.calls
+    )
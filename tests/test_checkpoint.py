@@ -0,0 +1,138 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from scripts.checkpoint import Checkpoint, CheckpointMismatchError
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'state.json')
+
+
+def test_resume(path):
+    checkpoint = Checkpoint(path, fingerprint='leads.csv', save_interval=0)
+    checkpoint.set_position({'_skip': 200})
+    checkpoint.mark_completed('lead_1')
+    checkpoint.mark_completed('lead_2', count='updated')
+    checkpoint.data['rows'] = [1, 2]
+    checkpoint.save()
+
+    resumed = Checkpoint(path, resume=True, fingerprint='leads.csv')
+    assert resumed.resumed
+    assert resumed.position == {'_skip': 200}
+    assert resumed.completed == {'lead_1', 'lead_2'}
+    assert resumed.is_completed('lead_2')
+    assert resumed.data == {'updated': 1, 'rows': [1, 2]}
+    assert resumed.mark_completed('lead_3', count='updated') == 2
+
+
+def test_completed_keys_are_journaled(path):
+    checkpoint = Checkpoint(path, fingerprint='leads.csv', save_interval=3600)
+    checkpoint.set_position(10)
+    checkpoint.mark_completed('10/lead', result='lead_1')
+    checkpoint.mark_completed('lead_2', count='restored')
+    checkpoint.mark_completed('lead_3', count='restored')
+    # The state file isn't rewritten for every key, but they're all in the
+    # journal.
+    assert not os.path.exists(path)
+    with open(path + '.journal') as f:
+        assert len(f.readlines()) == 4
+
+    resumed = Checkpoint(path, resume=True, fingerprint='leads.csv')
+    assert resumed.completed == {'10/lead', 'lead_2', 'lead_3'}
+    assert resumed.get_result('10/lead') == 'lead_1'
+    assert resumed.get_result('lead_2') is None
+    assert resumed.data == {'restored': 2}
+    # The position is only saved along with the data.
+    assert resumed.position is None
+
+
+def test_journal_on_top_of_the_state_file(path):
+    checkpoint = Checkpoint(path, save_interval=3600)
+    checkpoint.set_position(10)
+    checkpoint.mark_completed('lead_1', count='restored', result='lead_a')
+    checkpoint.save()
+    assert not os.path.exists(path + '.journal')
+    checkpoint.mark_completed('lead_2', count='restored')
+    # Interrupted while appending a key.
+    with open(path + '.journal', 'a') as f:
+        f.write('{"completed": "lea')
+
+    resumed = Checkpoint(path, resume=True)
+    assert resumed.position == 10
+    assert resumed.completed == {'lead_1', 'lead_2'}
+    assert resumed.get_result('lead_1') == 'lead_a'
+    assert resumed.data == {'restored': 2}
+    # The resumed run starts with a clean journal.
+    resumed.mark_completed('lead_3')
+    assert Checkpoint(path, resume=True).completed == {
+        'lead_1',
+        'lead_2',
+        'lead_3',
+    }
+
+
+def test_starting_over(path):
+    Checkpoint(path, save_interval=0).mark_completed('lead_1')
+
+    checkpoint = Checkpoint(path)
+    assert not checkpoint.resumed
+    assert checkpoint.completed == set()
+
+
+def test_resuming_without_a_state_file(path):
+    checkpoint = Checkpoint(path, resume=True)
+    assert not checkpoint.resumed
+    assert checkpoint.position is None
+
+
+def test_resuming_other_inputs(path):
+    Checkpoint(path, fingerprint='a.csv', save_interval=0).save()
+    with pytest.raises(CheckpointMismatchError):
+        Checkpoint(path, resume=True, fingerprint='b.csv')
+
+
+def test_resuming_a_journal_of_other_inputs(path):
+    Checkpoint(path, fingerprint='a.csv').mark_completed('lead_1')
+    with pytest.raises(CheckpointMismatchError):
+        Checkpoint(path, resume=True, fingerprint='b.csv')
+
+
+def test_saves_are_throttled(path):
+    checkpoint = Checkpoint(path, save_interval=3600)
+    checkpoint.mark_completed('lead_1')
+    assert not os.path.exists(path)
+    checkpoint.save()
+    assert os.path.exists(path)
+
+
+def test_finish(path):
+    checkpoint = Checkpoint(path, save_interval=0)
+    checkpoint.mark_completed('lead_1')
+    checkpoint.save()
+    checkpoint.mark_completed('lead_2')
+    checkpoint.finish()
+    assert os.listdir(os.path.dirname(path)) == []
+    # Nothing to remove the second time.
+    checkpoint.finish()
+
+
+@pytest.mark.parametrize('save_interval', [0, 3600])
+def test_concurrent_updates(path, save_interval):
+    checkpoint = Checkpoint(path, save_interval=save_interval)
+    with ThreadPoolExecutor(16) as pool:
+        list(
+            pool.map(
+                lambda i: checkpoint.mark_completed(i, count='done'),
+                range(1000),
+            )
+        )
+
+    assert checkpoint.data['done'] == 1000
+    resumed = Checkpoint(path, resume=True)
+    assert len(resumed.completed) == 1000
+    assert resumed.data['done'] == 1000
+    # No temporary files left behind.
+    assert os.listdir(os.path.dirname(path)) == ['state.json']
@@ -0,0 +1,66 @@
+import pytest
+
+from scripts import contact_keys
+from scripts.contact_keys import (
+    KeyCanonicalizer,
+    canonicalize_email,
+    canonicalize_phone,
+)
+
+
+@pytest.fixture
+def fallback_parser(monkeypatch):
+    monkeypatch.setattr(contact_keys, 'phonenumbers', None)
+
+
+@pytest.mark.parametrize(
+    'email, expected',
+    [
+        ('John.Doe@Example.com', 'john.doe@example.com'),
+        (' john+news@example.com ', 'john@example.com'),
+        ('John.Doe+news@GMail.com', 'johndoe@gmail.com'),
+        ('j.doe@googlemail.com', 'jdoe@gmail.com'),
+        ('+tag@example.com', '+tag@example.com'),
+        ('not-an-address', 'not-an-address'),
+    ],
+)
+def test_canonicalize_email(email, expected):
+    assert canonicalize_email(email) == expected
+
+
+@pytest.mark.usefixtures('fallback_parser')
+@pytest.mark.parametrize(
+    'phone, region, expected',
+    [
+        ('+1 (650) 555-1234', 'US', '+16505551234'),
+        ('(650) 555-1234', 'US', '+16505551234'),
+        ('1-650-555-1234', 'US', '+16505551234'),
+        ('650-555-1234 ext. 12', 'US', '+16505551234'),
+        ('555-1234', 'US', '5551234'),
+        ('0044 20 7946 0958', 'US', '+442079460958'),
+        ('020 7946 0958', 'GB', '+442079460958'),
+        ('+44 20 7946 0958', 'GB', '+442079460958'),
+        ('44 20 7946 0958', 'GB', '+442079460958'),
+        ('612 345 678', 'ES', '+34612345678'),
+        ('34 612 345 678', 'ES', '+34612345678'),
+        ('030 1234567', 'DE', '+49301234567'),
+        ('49 30 12345678', 'DE', '+493012345678'),
+        ('612 345 678', 'XX', '612345678'),
+        ('n/a', 'US', 'n/a'),
+    ],
+)
+def test_canonicalize_phone_fallback(phone, region, expected):
+    assert canonicalize_phone(phone, region) == expected
+
+
+def test_key_canonicalizer_calls_the_function_once_per_value():
+    calls = []
+
+    def canonicalize(value, suffix):
+        calls.append(value)
+        return value.lower() + suffix
+
+    canonicalizer = KeyCanonicalizer(canonicalize, suffix='!')
+    assert [canonicalizer(v) for v in ['A', 'b', 'A']] == ['a!', 'b!', 'a!']
+    assert calls == ['A', 'b']
+    assert len(canonicalizer) == 2
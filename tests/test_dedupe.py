@@ -0,0 +1,171 @@
+import random
+
+import pytest
+
+from scripts.dedupe import DuplicateIndex, UnionFind
+from scripts.fuzzy import FuzzyMatcher
+from scripts.records import LeadRecord
+
+
+def make_lead(id, date_created=None, **fields):
+    return LeadRecord(id, date_created=date_created or id, **fields)
+
+
+def get_cluster_ids(index):
+    return [[lead.id for lead in cluster] for cluster in index.get_clusters()]
+
+
+def test_union_find_groups():
+    union_find = UnionFind()
+    union_find.union('a', 'b')
+    union_find.union('c', 'd')
+    union_find.union('b', 'c')
+    union_find.union('x', 'y')
+    union_find.union('a', 'a')
+
+    assert 'a' in union_find
+    assert 'z' not in union_find
+    assert union_find.find('z') == 'z'
+    assert union_find.find('a') == union_find.find('d')
+    assert union_find.find('a') != union_find.find('x')
+    assert sorted(map(sorted, union_find.groups())) == [
+        ['a', 'b', 'c', 'd'],
+        ['x', 'y'],
+    ]
+
+
+def test_union_find_long_chain():
+    union_find = UnionFind()
+    for i in range(1000):
+        union_find.union(i, i + 1)
+    assert len(union_find.groups()) == 1
+    assert len({union_find.find(i) for i in range(1001)}) == 1
+
+
+def test_clusters_are_transitive_across_fields():
+    leads = [
+        make_lead('lead_1', emails=('john@example.com',)),
+        make_lead(
+            'lead_2',
+            emails=('John@Example.com',),
+            phones=('+16505551234',),
+        ),
+        make_lead('lead_3', phones=('+1 650 555 1234',)),
+        make_lead('lead_4', emails=('jane@example.com',)),
+        make_lead('lead_5', display_name='Acme'),
+        make_lead('lead_6', display_name=' ACME '),
+    ]
+    index = DuplicateIndex(['email', 'phone', 'lead_name']).add_all(leads)
+
+    assert get_cluster_ids(index) == [
+        ['lead_1', 'lead_2', 'lead_3'],
+        ['lead_5', 'lead_6'],
+    ]
+    assert index.get_matched_fields(leads[1]) == ['email', 'phone']
+    assert index.get_matched_fields(leads[3]) == []
+    assert list(index.get_duplicates('lead_name')) == ['acme']
+
+
+def test_a_lead_is_listed_once_per_key():
+    lead = make_lead(
+        'lead_1',
+        contact_names=('John Doe', 'john doe'),
+        emails=('john@example.com', 'JOHN@example.com'),
+    )
+    index = DuplicateIndex(['contact_name', 'email']).add_all([lead])
+
+    assert index.get_clusters() == []
+    assert index.get_duplicates('email') == {}
+    assert sorted(index.get_keys(lead)) == [
+        ('contact_name', 'john doe'),
+        ('email', 'john@example.com'),
+    ]
+
+
+def test_clusters_are_ordered():
+    leads = [
+        make_lead('lead_1', date_created='2021-03', url='https://a.com'),
+        make_lead('lead_2', date_created='2021-01', url='http://A.com/x'),
+        make_lead('lead_3', date_created='2021-02', url='https://b.com'),
+        make_lead('lead_4', date_created='2021-04', url='https://b.com'),
+        make_lead('lead_5', date_created='2021-05', url='https://b.com'),
+        make_lead('lead_6', url='no-scheme.com'),
+        make_lead('lead_7', url='no-scheme.com'),
+    ]
+    index = DuplicateIndex(['url']).add_all(leads)
+
+    # Largest first, each oldest lead first.
+    assert get_cluster_ids(index) == [
+        ['lead_3', 'lead_4', 'lead_5'],
+        ['lead_2', 'lead_1'],
+    ]
+
+
+def test_custom_field_keys():
+    leads = [
+        make_lead('lead_1', custom={'Ref': ['a', 'b']}),
+        make_lead('lead_2', custom={'Ref': 'a,b'}),
+        make_lead('lead_3', custom={'Ref': ''}),
+        make_lead('lead_4', custom={}),
+        make_lead('lead_5'),
+    ]
+    index = DuplicateIndex(['custom'], custom_field_name='Ref')
+    index.add_all(leads)
+
+    assert get_cluster_ids(index) == [['lead_1', 'lead_2']]
+
+
+@pytest.mark.parametrize(
+    'kwargs',
+    [
+        {'fields': ['nope']},
+        {'fields': ['custom']},
+        {'fields': ['email'], 'fuzzy_fields': ['email']},
+    ],
+)
+def test_invalid_settings(kwargs):
+    with pytest.raises(ValueError):
+        DuplicateIndex(**kwargs)
+
+
+def test_fuzzy_lead_names():
+    leads = [
+        make_lead('lead_1', display_name='Acme Corporation'),
+        make_lead('lead_2', display_name='ACME Corp.'),
+        make_lead('lead_3', display_name='Acme Corp'),
+        make_lead('lead_4', display_name='Globex'),
+    ]
+    index = DuplicateIndex(['lead_name'], fuzzy_fields=['lead_name'])
+    index.add_all(leads)
+
+    assert get_cluster_ids(index) == [['lead_1', 'lead_2', 'lead_3']]
+    duplicates = index.get_duplicates('lead_name')
+    assert len(duplicates) == 1
+    assert index.get_matched_fields(leads[3]) == []
+
+
+def test_fuzzy_pairs_do_not_depend_on_the_order_of_the_names():
+    rng = random.Random(0)
+    names = [f'acme {i % 30} sales {i}' for i in range(200)]
+    names += ['globex industries', 'globex industry', 'initech']
+
+    def get_pairs(names):
+        matcher = FuzzyMatcher(max_block_size=20)
+        pairs = {frozenset(pair) for pair in matcher.iter_similar_pairs(names)}
+        return pairs, matcher.skipped_blocks
+
+    pairs, skipped_blocks = get_pairs(names)
+    assert frozenset(['globex industries', 'globex industry']) in pairs
+    assert skipped_blocks > 0
+    for _ in range(3):
+        rng.shuffle(names)
+        assert get_pairs(names) == (pairs, skipped_blocks)
+
+
+def test_fuzzy_pairs_are_compared_once():
+    names = ['globex industries', 'globex industry', 'globex industries inc']
+    matcher = FuzzyMatcher()
+    pairs = list(matcher.iter_similar_pairs(names))
+
+    assert len(pairs) == len({frozenset(pair) for pair in pairs})
+    assert matcher.candidate_pairs <= 3
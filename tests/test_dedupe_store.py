@@ -0,0 +1,168 @@
+import pytest
+
+from scripts.dedupe import DuplicateIndex
+from scripts.dedupe_store import DuplicateStore
+from scripts.records import LeadRecord
+
+FIELDS = ['lead_name', 'email', 'phone']
+
+
+def make_lead(id, name=None, emails=(), phones=()):
+    return LeadRecord(
+        id,
+        display_name=name or id,
+        date_created=id,
+        emails=emails,
+        phones=phones,
+    )
+
+
+INITIAL_LEADS = [
+    make_lead('a1', emails=('a@example.com',)),
+    make_lead('a2', emails=('a@example.com',)),
+    make_lead('b1', phones=('+16505550001',)),
+    make_lead('b2', phones=('+16505550001',)),
+    make_lead('c1', emails=('c@example.com',)),
+    make_lead('d1', name='Initech'),
+]
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / 'index.db')
+    store = DuplicateStore(path, DuplicateIndex(FIELDS))
+    store.index.add_all(INITIAL_LEADS)
+    store.rebuild('2021-01-01T00:00:00+00:00')
+    return path
+
+
+def open_store(path, fields=FIELDS):
+    return DuplicateStore(path, DuplicateIndex(fields))
+
+
+def get_stored_clusters(store):
+    clusters = {}
+    for lead_id, cluster in store._db.execute(
+        'SELECT lead_id, cluster FROM clusters'
+    ):
+        clusters.setdefault(cluster, set()).add(lead_id)
+    return sorted(map(sorted, clusters.values()))
+
+
+def get_changes(changes):
+    return sorted(
+        (change, sorted(lead.id for lead in cluster))
+        for change, cluster in changes
+    )
+
+
+def test_rebuild(path):
+    store = open_store(path)
+    assert store.watermark == '2021-01-01T00:00:00+00:00'
+    assert get_stored_clusters(store) == [['a1', 'a2'], ['b1', 'b2']]
+
+
+def test_other_settings_read_as_empty(path):
+    assert open_store(path, fields=['email']).watermark is None
+
+
+def test_fuzzy_fields_cant_be_stored(tmp_path):
+    index = DuplicateIndex(FIELDS, fuzzy_fields=['lead_name'])
+    with pytest.raises(ValueError):
+        DuplicateStore(str(tmp_path / 'index.db'), index)
+
+
+def test_update(path):
+    store = open_store(path)
+    changes, removed = store.update(
+        [
+            # Joins the cluster of a1 and a2.
+            make_lead('c1', emails=('c@example.com', 'a@example.com')),
+            # Makes a new cluster with d1, which is unchanged.
+            make_lead('d2', name='initech'),
+            # Has no keys in common with anything.
+            make_lead('e1'),
+        ],
+        # Leaves b1 on its own.
+        ['b2'],
+        '2021-01-02T00:00:00+00:00',
+    )
+
+    assert get_changes(changes) == [
+        ('Changed', ['a1', 'a2', 'c1']),
+        ('New', ['d1', 'd2']),
+    ]
+    assert removed == 1
+    assert store.watermark == '2021-01-02T00:00:00+00:00'
+    assert get_stored_clusters(store) == [['a1', 'a2', 'c1'], ['d1', 'd2']]
+
+
+def test_update_without_changes(path):
+    store = open_store(path)
+    changes, removed = store.update(
+        [make_lead('a2', emails=('a@example.com',))], [], 'now'
+    )
+
+    assert changes == []
+    assert removed == 0
+    assert get_stored_clusters(store) == [['a1', 'a2'], ['b1', 'b2']]
+
+
+def test_update_merging_clusters(path):
+    store = open_store(path)
+    changes, removed = store.update(
+        [make_lead('a2', emails=('a@example.com',), phones=('6505550001',))],
+        [],
+        'now',
+    )
+
+    assert get_changes(changes) == [('Changed', ['a1', 'a2', 'b1', 'b2'])]
+    assert removed == 0
+
+
+def test_update_splitting_a_cluster(path):
+    store = open_store(path)
+    changes, removed = store.update(
+        [
+            make_lead('a2', emails=('a@example.com', 'x@example.com')),
+            make_lead('a3', emails=('x@example.com',)),
+            make_lead('a1'),
+        ],
+        [],
+        'now',
+    )
+
+    assert get_changes(changes) == [('Changed', ['a2', 'a3'])]
+    assert removed == 0
+    assert get_stored_clusters(store) == [['a2', 'a3'], ['b1', 'b2']]
+
+
+def test_restored_lead_is_kept(path):
+    store = open_store(path)
+    changes, removed = store.update(
+        [make_lead('b2', phones=('+16505550001',))], ['b2'], 'now'
+    )
+
+    assert changes == []
+    assert removed == 0
+
+
+def test_updates_match_a_rebuild(path):
+    updates = [
+        ([make_lead('c1', emails=('a@example.com',))], ['b1']),
+        ([make_lead('f1', phones=('+16505550001',))], []),
+        ([make_lead('a1', name='Initech')], ['a2']),
+        ([], ['d1', 'c1']),
+    ]
+    leads = {lead.id: lead for lead in INITIAL_LEADS}
+    for updated, deleted_ids in updates:
+        open_store(path).update(updated, deleted_ids, 'now')
+        leads.update((lead.id, lead) for lead in updated)
+        for lead_id in deleted_ids:
+            del leads[lead_id]
+
+    index = DuplicateIndex(FIELDS).add_all(leads.values())
+    expected = sorted(
+        sorted(lead.id for lead in cluster) for cluster in index.get_clusters()
+    )
+    assert get_stored_clusters(open_store(path)) == expected
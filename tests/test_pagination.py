@@ -0,0 +1,146 @@
+import pytest
+
+from scripts import CloseApiWrapper as wrapper_module
+from scripts.checkpoint import Checkpoint
+from scripts.CloseApiWrapper import PAGINATION_DONE, CloseApiWrapper
+from scripts.fake_close_api import FakeCloseApi
+
+# Few enough distinct dates that every window ends in the middle of the
+# items sharing its last date.
+DATES = [f'2021-01-0{day}T00:00:00+00:00' for day in range(1, 8)]
+
+
+@pytest.fixture(scope='module')
+def fake():
+    # Deeper `_skip` offsets than the windows go fail.
+    with FakeCloseApi(leads=60, activities_per_lead=5, max_skip=150) as fake:
+        for i, activity in enumerate(fake.objects['activity'].values()):
+            activity['date_created'] = DATES[i * 7 // 300]
+        yield fake
+
+
+@pytest.fixture(autouse=True)
+def shallow_windows(monkeypatch):
+    monkeypatch.setattr(wrapper_module, 'MAX_WINDOW_SKIP', 100)
+
+
+@pytest.fixture
+def api(fake):
+    return CloseApiWrapper('fake', base_url=fake.base_url)
+
+
+def get_activity_ids(fake):
+    return sorted(fake.objects['activity'])
+
+
+def test_keyset_windows_return_every_item_once(fake, api):
+    items = [
+        item
+        for page in api.iter_pages(
+            'activity',
+            params={'_limit': 30, '_fields': 'lead_id'},
+            date_field='date_created',
+        )
+        for item in page
+    ]
+
+    ids = [item['id'] for item in items]
+    assert sorted(ids) == get_activity_ids(fake)
+    dates = [item['date_created'] for item in items]
+    assert dates == sorted(dates)
+    assert set(items[0]) == {'id', 'lead_id', 'date_created'}
+
+
+def test_keyset_windows_of_a_single_date():
+    with FakeCloseApi(leads=40, activities_per_lead=5) as fake:
+        for activity in fake.objects['activity'].values():
+            activity['date_created'] = DATES[0]
+        api = CloseApiWrapper('fake', base_url=fake.base_url)
+        ids = [
+            item['id']
+            for item in api.iter_items(
+                'activity', params={'_limit': 30}, date_field='date_created'
+            )
+        ]
+        assert sorted(ids) == get_activity_ids(fake)
+
+
+def test_keyset_windows_resume_from_a_checkpoint(fake, api, tmp_path):
+    path = str(tmp_path / 'state.json')
+    checkpoint = Checkpoint(path, save_interval=0)
+    ids = []
+    for page_num, page in enumerate(
+        api.iter_pages(
+            'activity',
+            params={'_limit': 30},
+            date_field='date_created',
+            checkpoint=checkpoint,
+            prefetch=0,
+        )
+    ):
+        # Interrupted while processing the 6th page.
+        if page_num == 5:
+            break
+        ids.extend(item['id'] for item in page)
+
+    checkpoint = Checkpoint(path, resume=True)
+    assert checkpoint.position['last_date'] in DATES
+    for page in api.iter_pages(
+        'activity',
+        params={'_limit': 30},
+        date_field='date_created',
+        checkpoint=checkpoint,
+    ):
+        ids.extend(item['id'] for item in page)
+
+    assert sorted(ids) == get_activity_ids(fake)
+    assert checkpoint.position == PAGINATION_DONE
+    assert list(api.iter_pages('activity', checkpoint=checkpoint)) == []
+
+
+@pytest.mark.parametrize('ignored', ['date_created__gte', '_order_by'])
+def test_keyset_windows_fall_back_to_skip(ignored, monkeypatch, caplog):
+    with FakeCloseApi(leads=60, activities_per_lead=5) as fake:
+        for i, activity in enumerate(fake.objects['activity'].values()):
+            activity['date_created'] = DATES[i * 7 // 300]
+        api = CloseApiWrapper('fake', base_url=fake.base_url)
+        get = api.get
+
+        def get_ignoring_param(url, params=None, **kwargs):
+            params = {k: v for k, v in (params or {}).items() if k != ignored}
+            return get(url, params=params, **kwargs)
+
+        monkeypatch.setattr(api, 'get', get_ignoring_param)
+        ids = [
+            item['id']
+            for item in api.iter_items(
+                'activity', params={'_limit': 30}, date_field='date_created'
+            )
+        ]
+
+        assert sorted(ids) == get_activity_ids(fake)
+        assert 'scanning it with _skip instead' in caplog.text
+
+
+def test_skip_pagination(fake, api):
+    lead_ids = list(fake.objects['lead'])[:20]
+    items = list(
+        api.iter_items(
+            'activity',
+            params={'_limit': 30, 'lead_id__in': ','.join(lead_ids)},
+        )
+    )
+    assert len(items) == 100
+    assert len({item['id'] for item in items}) == 100
+
+
+def test_paginated_gets_are_not_reused(api):
+    for _ in range(2):
+        list(
+            api.iter_pages(
+                'activity', params={'_limit': 30}, date_field='date_created'
+            )
+        )
+    assert api.single_flight.stats()['cached_results'] == 0
+    api.get('me')
+    assert api.single_flight.stats()['cached_results'] == 1
@@ -0,0 +1,113 @@
+import pytest
+
+from scripts import rate_limiter
+from scripts.rate_limiter import RateLimitController, parse_rate_limit
+
+
+class Response:
+    def __init__(self, status_code=200, headers=None, body=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.body = body
+
+    def json(self):
+        if self.body is None:
+            raise ValueError('No JSON')
+        return self.body
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limiter.time, 'monotonic', lambda: now[0])
+    return now
+
+
+@pytest.mark.parametrize(
+    'status_code, headers, body, expected',
+    [
+        (200, {}, None, (None, None, None)),
+        (
+            200,
+            {'RateLimit': 'limit=40, remaining=39, reset=1.5'},
+            None,
+            (40, 39, 1.5),
+        ),
+        (
+            200,
+            {'RateLimit-Limit': '40', 'RateLimit-Remaining': '0'},
+            None,
+            (40, 0, None),
+        ),
+        (429, {'Retry-After': '3'}, None, (None, None, 3)),
+        (429, {}, {'error': {'rate_reset': 2.5}}, (None, None, 2.5)),
+        (200, {'RateLimit': 'limit=x'}, None, (None, None, None)),
+    ],
+)
+def test_parse_rate_limit(status_code, headers, body, expected):
+    assert parse_rate_limit(status_code, headers, body) == expected
+
+
+def test_concurrency_grows_additively(clock):
+    controller = RateLimitController(initial_concurrency=4)
+    for _ in range(4):
+        controller.update(Response())
+    assert controller.concurrency == 4
+    assert controller.limit == pytest.approx(4.9, abs=0.05)
+    for _ in range(100):
+        controller.update(Response())
+    # Roughly one more per round of `concurrency` successful requests.
+    assert controller.concurrency == 15
+
+
+def test_concurrency_is_capped(clock):
+    controller = RateLimitController(initial_concurrency=4, max_concurrency=6)
+    for _ in range(100):
+        controller.update(Response())
+    assert controller.concurrency == 6
+
+
+def test_rate_limit_halves_concurrency_once_per_window(clock):
+    controller = RateLimitController(initial_concurrency=16)
+    rate_limited = Response(429, {'Retry-After': '2'})
+    for _ in range(5):
+        controller.update(rate_limited)
+    assert controller.concurrency == 8
+    assert controller.rate_limited_count == 5
+    assert controller._get_wait() == 2
+
+    clock[0] += 2
+    assert controller._get_wait() == 0
+    controller.update(rate_limited)
+    assert controller.concurrency == 4
+
+
+def test_rate_limit_without_a_reset(clock):
+    controller = RateLimitController(initial_concurrency=2)
+    controller.update(Response(429))
+    assert controller.concurrency == 1
+    assert controller._get_wait() == rate_limiter.DEFAULT_RATE_LIMIT_DELAY
+
+    clock[0] += rate_limiter.DEFAULT_RATE_LIMIT_DELAY
+    controller.update(Response(429))
+    # Never below the minimum.
+    assert controller.concurrency == 1
+
+
+def test_exhausted_window_pauses_without_backing_off(clock):
+    controller = RateLimitController(initial_concurrency=8)
+    controller.update(
+        Response(headers={'RateLimit': 'limit=40, remaining=0, reset=3'})
+    )
+    assert controller.concurrency == 8
+    assert controller._get_wait() == 3
+
+
+def test_permits(clock):
+    controller = RateLimitController(initial_concurrency=2)
+    with controller.permit():
+        with controller.permit():
+            assert controller.in_flight == 2
+            # Out of permits until one is released.
+            assert controller._get_wait() is None
+    assert controller.in_flight == 0
@@ -0,0 +1,51 @@
+import threading
+
+from scripts.runtime import ThreadPool
+
+
+def test_imap_unordered_leaves_the_pool_alone():
+    pool = ThreadPool(4)
+    release = threading.Event()
+    other = pool.spawn(lambda: release.wait(5) and 'other')
+
+    for result in pool.imap_unordered(lambda x: x * 2, range(10)):
+        if result:
+            break
+    release.set()
+
+    # The work spawned by another caller isn't killed, and the pool can
+    # still be used.
+    assert other.get() == 'other'
+    assert other.successful()
+    assert sorted(pool.imap_unordered(lambda x: x * 2, range(10))) == list(
+        range(0, 20, 2)
+    )
+
+
+def test_imap_unordered_kills_the_calls_it_started():
+    pool = ThreadPool(3)
+    release = threading.Event()
+    fed = threading.Event()
+
+    def get_items():
+        yield from range(3)
+        fed.set()
+
+    def wait(x):
+        if x:
+            release.wait(5)
+        return x
+
+    results = pool.imap_unordered(wait, get_items())
+    assert next(results) == 0
+    assert fed.wait(5)
+    with pool._lock:
+        handles = list(pool._handles)
+    results.close()
+    release.set()
+    pool.join()
+
+    assert len(handles) == 2
+    assert all(handle.killed for handle in handles)
+    # Their slots were released.
+    assert [pool.spawn(lambda: 1).get() for _ in range(6)] == [1] * 6
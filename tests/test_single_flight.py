@@ -0,0 +1,161 @@
+import asyncio
+import threading
+
+import pytest
+
+from scripts import single_flight
+from scripts.CloseApiWrapper import is_reusable_get
+from scripts.single_flight import AsyncSingleFlight, SingleFlight
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(single_flight.time, 'monotonic', lambda: now[0])
+    return now
+
+
+class Fetch:
+    def __init__(self, result='result', error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return self.result
+
+
+def test_concurrent_calls_are_coalesced():
+    flight = SingleFlight(ttl=0)
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return 'result'
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(flight.do('k', fetch)))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for _ in range(500):
+        if flight.stats()['coalesced'] == 4:
+            break
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == ['result'] * 5
+    assert len(calls) == 1
+    assert flight.stats()['coalesced'] == 4
+    # Nothing is kept with a TTL of 0.
+    assert flight.do('k', lambda: 'again') == 'again'
+
+
+def test_errors_are_shared_but_not_cached():
+    flight = SingleFlight()
+    fetch = Fetch(error=ValueError('boom'))
+    with pytest.raises(ValueError):
+        flight.do('k', fetch)
+    assert flight.do('k', Fetch()) == 'result'
+    assert flight.stats()['cached_results'] == 1
+
+
+def test_results_are_reused_until_they_expire(clock):
+    flight = SingleFlight(ttl=10)
+    fetch = Fetch()
+    assert flight.do('k', fetch) == 'result'
+    clock[0] += 9
+    assert flight.do('k', fetch) == 'result'
+    assert fetch.calls == 1
+    assert flight.stats()['cache_hits'] == 1
+
+    clock[0] += 1
+    assert flight.do('k', fetch) == 'result'
+    assert fetch.calls == 2
+
+
+def test_uncacheable_results_are_not_reused(clock):
+    flight = SingleFlight()
+    fetch = Fetch()
+    flight.do('k', fetch, cacheable=lambda result: False)
+    flight.do('k', fetch, cacheable=lambda result: False)
+    assert fetch.calls == 2
+
+
+def test_invalidate(clock):
+    flight = SingleFlight()
+    fetch = Fetch()
+    flight.do('k', fetch)
+    flight.invalidate()
+    flight.do('k', fetch)
+    assert fetch.calls == 2
+
+
+def test_results_are_bounded_by_count_and_size(clock):
+    flight = SingleFlight(max_results=3, max_bytes=10, sizeof=len)
+    for key in 'abcd':
+        flight.do(key, Fetch('xx'))
+    assert flight.stats()['cached_results'] == 3
+    assert flight.stats()['cached_bytes'] == 6
+
+    # The least recently used results make room for the new ones.
+    flight.do('b', Fetch())
+    flight.do('e', Fetch('xxxxxx'))
+    assert flight.stats()['cached_results'] == 3
+    assert flight.stats()['cached_bytes'] == 10
+    flight.do('f', Fetch('xxxx'))
+    assert flight.stats()['cached_results'] == 2
+    assert flight.stats()['cached_bytes'] == 10
+    fetch = Fetch()
+    flight.do('e', fetch)
+    flight.do('f', fetch)
+    assert fetch.calls == 0
+    flight.do('b', fetch)
+    assert fetch.calls == 1
+
+    # Results larger than the whole cache aren't kept.
+    flight = SingleFlight(max_bytes=10, sizeof=len)
+    flight.do('g', Fetch('x' * 11))
+    assert flight.stats()['cached_results'] == 0
+
+
+def test_async_calls_are_coalesced():
+    flight = AsyncSingleFlight(ttl=0)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'result'
+
+    async def main():
+        return await asyncio.gather(*[flight.do('k', fetch) for _ in range(5)])
+
+    assert asyncio.run(main()) == ['result'] * 5
+    assert len(calls) == 1
+    assert flight.stats()['coalesced'] == 4
+
+
+@pytest.mark.parametrize(
+    'endpoint, params, expected',
+    [
+        ('me', None, True),
+        ('lead/lead_1', {'_fields': 'id'}, True),
+        ('activity', {'lead_id': 'lead_1'}, True),
+        ('activity', {'lead_id': 'lead_1', '_skip': 100}, False),
+        ('lead', {'query': '*', '_limit': 200}, False),
+        ('event', {'_cursor': 'abc'}, False),
+        ('bulk_action/edit/bulk_1', None, False),
+    ],
+)
+def test_is_reusable_get(endpoint, params, expected):
+    assert is_reusable_get(endpoint, params) is expected
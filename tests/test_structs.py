@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+from scripts import structs
+
+PAGE = {
+    'data': [
+        {
+            'id': 'acti_1',
+            'lead_id': 'lead_1',
+            'note': 'Called back',
+            'user_id': 'user_1',
+            'custom': {'Ref': 1},
+        },
+        {'id': 'acti_2', 'lead_id': 'lead_2'},
+    ],
+    'has_more': True,
+    'cursor_next': 'abc',
+    'total_results': 2,
+    'extra': 'dropped',
+}
+
+
+@pytest.fixture(params=['slotted', 'msgspec'])
+def activity(request, monkeypatch):
+    """An `Activity` struct, with and without msgspec."""
+    if request.param == 'msgspec':
+        pytest.importorskip('msgspec')
+    else:
+        monkeypatch.setattr(structs, 'msgspec', None)
+    return structs.define_struct('Activity', structs.ACTIVITY_FIELDS)
+
+
+def check_page(page):
+    assert {key: value for key, value in page.items() if key != 'data'} == {
+        'has_more': True,
+        'cursor_next': 'abc',
+        'total_results': 2,
+    }
+    first, second = page['data']
+    assert first.FIELDS == ('id', 'lead_id', 'note')
+    assert first.to_dict() == {
+        'id': 'acti_1',
+        'lead_id': 'lead_1',
+        'note': 'Called back',
+    }
+    assert first['note'] == first.note == 'Called back'
+    assert first.get('user_id') is None
+    with pytest.raises(KeyError):
+        first['user_id']
+    assert second.to_dict() == {
+        'id': 'acti_2',
+        'lead_id': 'lead_2',
+        'note': None,
+    }
+
+
+def test_decode_page_with_fields(activity):
+    struct = structs.project_struct(activity, 'id,lead_id,note')
+    check_page(structs.decode_page(json.dumps(PAGE).encode(), struct))
+
+
+def test_to_struct_page_with_fields(activity):
+    struct = structs.project_struct(activity, ['id', 'lead_id', 'note'])
+    check_page(structs.to_struct_page(PAGE, struct))
+
+
+def test_all_fields(activity):
+    page = structs.decode_page(json.dumps(PAGE), activity)
+    first = page['data'][0]
+    assert first.FIELDS == structs.ACTIVITY_FIELDS
+    assert first.user_id == 'user_1'
+    assert first.date_created is None
+    assert first == activity.from_json(PAGE['data'][0])
+    assert structs.project_struct(activity, None) is activity
+    assert structs.project_struct(activity, ','.join(activity.FIELDS)) is (
+        activity
+    )
+
+
+def test_invalid_fields():
+    with pytest.raises(ValueError, match='custom.Ref'):
+        structs.define_struct('Lead', ['id', 'custom.Ref'])